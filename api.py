@@ -0,0 +1,282 @@
+"""JSON API for books, reviews and stats.
+
+``/api/books`` uses keyset pagination on ``order_index``: each page ends
+with ``next_after``, which is passed back as ``?after=`` to continue. With
+``?reader=<username>`` every book also carries that reader's ``read`` and
+``read_at`` and the ``mine``/``todo`` filters apply to them. Rows
+are streamed from the cursor as they are encoded, so memory use does not
+depend on the page size.
+
+``/api/history`` returns books read per day, week, month or year and
+cumulatively, for everyone and the readers who read most (or ``?reader=``),
+with each reader's pace toward the goal; see history.py.
+
+``POST /api/progress`` marks and unmarks books for the logged-in reader in
+one transaction and answers with the updated stats and an ``undo`` body
+that, posted back, reverts exactly what the update changed.
+"""
+import json
+from datetime import datetime, timezone
+
+from flask import Blueprint, Response, abort, current_app, jsonify, request, stream_with_context
+from flask_login import current_user
+
+from db import get_db
+from history import challenge_deadline, get_history, parse_date
+from queries import BOOK_COLUMNS, CENTURIES, FILTERS, READER_FILTERS, SORTS, build_books_query
+from readers import MAX_PROGRESS_BATCH, UNDATED, get_reader, update_progress
+from search import highlight_html, plain_text, search_books
+from stats import get_leaderboard, get_stats
+
+api = Blueprint('api', __name__, url_prefix='/api')
+
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 500
+
+REVIEWS_QUERY = '''
+    SELECT id, reader, rating, review, date_added FROM reviews
+    WHERE book_id = ? {before}
+    ORDER BY date_added DESC, id DESC
+    LIMIT ?
+'''
+
+
+def _int_arg(name, default, minimum=None, maximum=None):
+    value = request.args.get(name)
+    if value is None:
+        return default
+    try:
+        value = int(value)
+    except ValueError:
+        abort(400, f'{name} must be an integer')
+    if minimum is not None:
+        value = max(minimum, value)
+    if maximum is not None:
+        value = min(maximum, value)
+    return value
+
+
+def _choice_arg(name, choices):
+    value = request.args.get(name, 'all')
+    if value not in choices:
+        abort(400, f"{name} must be one of {', '.join(choices)}")
+    return value
+
+
+def _fields_arg():
+    fields = request.args.get('fields')
+    if not fields:
+        return list(BOOK_COLUMNS)
+    selected = [field.strip() for field in fields.split(',') if field.strip()]
+    unknown = [field for field in selected if field not in BOOK_COLUMNS]
+    if unknown:
+        abort(400, f"unknown fields: {', '.join(unknown)}")
+    return selected
+
+
+def _reader_arg(cursor):
+    username = request.args.get('reader')
+    if not username:
+        return None
+    reader = get_reader(cursor, username)
+    if reader is None:
+        abort(404, 'Reader not found')
+    return reader['id']
+
+
+@api.route('/books')
+def books():
+    """One page of books: ?filter=&century=&after=&limit=&reader=&fields=id,title,...
+
+    Books come in list order; ?sort=rating orders them by average rating instead,
+    which returns a single page (no ``next_after``).
+    """
+    cursor = get_db().cursor()
+    filter_by = _choice_arg('filter', FILTERS)
+    century_filter = _choice_arg('century', CENTURIES)
+    sort = request.args.get('sort', 'list')
+    if sort not in SORTS:
+        abort(400, f"sort must be one of {', '.join(SORTS)}")
+    after = _int_arg('after', None)
+    if after is not None and sort != 'list':
+        abort(400, 'after only applies to sort=list')
+    limit = _int_arg('limit', DEFAULT_LIMIT, minimum=1, maximum=MAX_LIMIT)
+    fields = _fields_arg()
+    reader_id = _reader_arg(cursor)
+    if filter_by in READER_FILTERS and reader_id is None:
+        abort(400, f'filter {filter_by} needs a reader')
+
+    # order_index is always fetched to build the next cursor
+    columns = fields if 'order_index' in fields else fields + ['order_index']
+    query = build_books_query(filter_by, century_filter, columns=columns,
+                              after=after is not None, limit=True, reader=reader_id is not None,
+                              sort=sort)
+    params = (((reader_id,) if reader_id is not None else ())
+              + ((after,) if after is not None else ()) + (limit,))
+    if reader_id is not None:
+        fields = fields + ['read', 'read_at']
+    cursor.execute(query, params)
+
+    def generate():
+        yield '{"books": ['
+        count = 0
+        last_order_index = None
+        for row in cursor:
+            last_order_index = row['order_index']
+            book = {field: bool(row[field]) if field == 'read' else row[field] for field in fields}
+            yield (',' if count else '') + json.dumps(book)
+            count += 1
+        next_after = last_order_index if count == limit and sort == 'list' else None
+        yield f'], "count": {count}, "next_after": {json.dumps(next_after)}}}'
+
+    return Response(stream_with_context(generate()), mimetype='application/json')
+
+
+@api.route('/books/<int:book_id>/reviews')
+def book_reviews(book_id):
+    """Reviews of one book, newest first: ?before=<review id>&limit="""
+    cursor = get_db().cursor()
+    cursor.execute('SELECT 1 FROM books WHERE id = ?', (book_id,))
+    if not cursor.fetchone():
+        abort(404, 'Book not found')
+
+    before = _int_arg('before', None)
+    limit = _int_arg('limit', DEFAULT_LIMIT, minimum=1, maximum=MAX_LIMIT)
+
+    if before is None:
+        cursor.execute(REVIEWS_QUERY.format(before=''), (book_id, limit))
+    else:
+        cursor.execute(REVIEWS_QUERY.format(
+            before='AND (date_added, id) < (SELECT date_added, id FROM reviews WHERE id = ?)'
+        ), (book_id, before, limit))
+    reviews = [dict(row) for row in cursor.fetchall()]
+
+    return jsonify({
+        'book_id': book_id,
+        'reviews': reviews,
+        'next_before': reviews[-1]['id'] if len(reviews) == limit else None,
+    })
+
+
+@api.route('/search')
+def search():
+    """Ranked full-text matches: ?q=&limit=, with <mark>-highlighted HTML fragments"""
+    limit = _int_arg('limit', DEFAULT_LIMIT, minimum=1, maximum=MAX_LIMIT)
+    results = search_books(get_db().cursor(), request.args.get('q', ''), limit=limit)
+    return jsonify({
+        'query': request.args.get('q', ''),
+        'results': [{
+            'id': row['id'],
+            'title': plain_text(row['title_match']),
+            'author': plain_text(row['author_match']),
+            'year': row['year'],
+            'title_html': highlight_html(row['title_match']),
+            'author_html': highlight_html(row['author_match']),
+            'review_snippet_html': highlight_html(row['review_snippet']) if row['review_snippet'] else None,
+            'rank': row['rank'],
+        } for row in results],
+    })
+
+
+@api.route('/stats')
+def stats():
+    return jsonify(get_stats(get_db().cursor()))
+
+
+@api.route('/leaderboard')
+def leaderboard():
+    return jsonify(get_leaderboard(get_db().cursor()))
+
+
+@api.route('/history')
+def history():
+    """Books read per bucket and cumulatively, see history.get_history"""
+    deadline = challenge_deadline(current_app.config)
+    try:
+        return jsonify(get_history(get_db().cursor(), request.args.get('period', 'month'),
+                                   request.args.get('century', 'all'), request.args.get('reader'),
+                                   parse_date(request.args.get('start'), 'start'),
+                                   parse_date(request.args.get('end'), 'end'), deadline))
+    except ValueError as error:
+        abort(400, str(error))
+    except LookupError as error:
+        abort(404, str(error))
+
+
+def _book_id(value):
+    if isinstance(value, bool) or not isinstance(value, int):
+        abort(400, 'book ids must be integers')
+    return value
+
+
+def _read_item(item):
+    """(book_id, read_at) from a book id, a {"id": ..., "read_at": "YYYY-MM-DD[ HH:MM:SS[+HH:MM]]"} object
+    or an {"id": ..., "undated": true} object"""
+    if not isinstance(item, dict):
+        return _book_id(item), None
+    if item.get('undated') is True:
+        if item.get('read_at') is not None:
+            abort(400, 'an undated book cannot have a read_at')
+        return _book_id(item.get('id')), UNDATED
+    read_at = item.get('read_at')
+    if read_at is not None:
+        try:
+            read_at = datetime.fromisoformat(str(read_at))
+        except ValueError:
+            abort(400, 'read_at must be an ISO date or date and time')
+        # Stored in UTC like CURRENT_TIMESTAMP; times without an offset are taken as UTC
+        if read_at.tzinfo is not None:
+            read_at = read_at.astimezone(timezone.utc)
+        read_at = read_at.strftime('%Y-%m-%d %H:%M:%S')
+    return _book_id(item.get('id')), read_at
+
+
+@api.route('/progress', methods=['POST'])
+def progress():
+    """Mark and unmark books for the logged-in reader.
+
+    Body: {"read": [book id or {"id": ..., "read_at": ...}, ...], "unread": [book id, ...]}
+    A read item without read_at is dated now; {"id": ..., "undated": true}
+    (which undo bodies use for marks that had no date) stores no date.
+    """
+    if not current_user.is_authenticated:
+        abort(401, 'Log in to record reading progress')
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict):
+        abort(400, 'expected a JSON object with "read" and/or "unread" lists')
+    read_items, unread_items = body.get('read', []), body.get('unread', [])
+    if not isinstance(read_items, list) or not isinstance(unread_items, list):
+        abort(400, '"read" and "unread" must be lists')
+    if len(read_items) + len(unread_items) > MAX_PROGRESS_BATCH:
+        abort(400, f'at most {MAX_PROGRESS_BATCH} books per update')
+
+    read = [_read_item(item) for item in read_items]
+    unread = [_book_id(item) for item in unread_items]
+    if {book_id for book_id, _ in read} & set(unread):
+        abort(400, 'a book cannot be both read and unread in one update')
+
+    conn = get_db()
+    cursor = conn.cursor()
+    marked, unmarked = update_progress(cursor, current_user.reader_id, read, unread)
+    conn.commit()
+
+    reader = get_reader(cursor, current_user.id)
+    return jsonify({
+        'marked': marked,
+        'unmarked': [book_id for book_id, _ in unmarked],
+        'unchanged': len(read) + len(unread) - len(marked) - len(unmarked),
+        'undo': {
+            'read': [{'id': book_id, 'read_at': read_at} if read_at else {'id': book_id, 'undated': True}
+                     for book_id, read_at in unmarked],
+            'unread': marked,
+        },
+        'reader': {'username': reader['username'], 'books_read': reader['books_read']},
+        'stats': get_stats(cursor),
+    })
+
+
+@api.errorhandler(400)
+@api.errorhandler(401)
+@api.errorhandler(404)
+def json_error(error):
+    return jsonify({'error': error.description}), error.code
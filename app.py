@@ -1,27 +1,84 @@
-import csv
+import math
+import time
+_import_started = time.perf_counter()
+
 import sqlite3
+import tempfile
+import click
 from datetime import datetime
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify
+from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, abort
 from flask_login import LoginManager, UserMixin, login_user, logout_user, login_required, current_user
-from werkzeug.security import check_password_hash
+from werkzeug.middleware.proxy_fix import ProxyFix
 import os
-import requests
-import re
-from dotenv import load_dotenv
-from config import config
 
-# Load environment variables
-load_dotenv()
+# Load environment variables (before the config reads them); python-dotenv is only needed with a .env file
+_env_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.env')
+if os.path.exists(_env_file):
+    from dotenv import load_dotenv
+    load_dotenv(_env_file)
+
+from config import config
+from api import REVIEWS_QUERY as API_REVIEWS_QUERY, api
+import assets
+import auth
+import backups
+from cover_store import is_stored, store_cover
+from csv_sync import apply_sync, read_csv_books, sync_csv
+import db
+from db import bump_data_version, get_db
+from history import build_history_query, challenge_deadline, chart, get_history, parse_date
+from http_cache import cached_page
+import instrumentation
+from instrumentation import instrument_session
+from jobs import LATEST_JOB_QUERY, enqueue_job, get_latest_job, start_job_thread
+from queries import (BOOK_DETAIL_QUERY, BOOK_REVIEWS_QUERY, BOOK_REVIEWS_SHOWN, BOOKS_PAGE_SIZE, CENTURIES,
+                     COVER_QUERY, FILTERS, LATEST_RATINGS_QUERY, LEGACY_FILTERS, READER_FILTERS, SORTS,
+                     UNENRICHED_BOOKS_QUERY, build_books_query)
+from readers import (BOOK_READERS_QUERY, MARK_READ_SQL, MARK_UNDATED_SQL, PROGRESS_QUERY, READER_QUERY,
+                     TOP_READERS_QUERY, UNMARK_READ_SQL, add_reader, configured_password_hash, get_reader,
+                     mark_book_read, reader_gradient, sync_founding_readers)
+from search import SEARCH_QUERY, highlight_html, search_books
+import static_export
+from stats import (LEADERBOARD_READERS_QUERY, LEADERBOARD_REVIEWERS_QUERY, LEADERBOARD_SIZE, MIN_RATINGS,
+                   MOST_READ_QUERY, READER_COUNT_QUERY, STATS_QUERY, TOP_RATED_QUERY, TOP_READERS,
+                   get_leaderboard, get_stats)
 
 app = Flask(__name__)
 
 # Configure app based on environment
 config_name = os.environ.get('FLASK_ENV', 'development')
 app.config.from_object(config[config_name])
+# A malformed CHALLENGE_DEADLINE stops the start here, instead of failing every history request
+challenge_deadline(app.config)
 
-# Database path - use absolute path to avoid issues in production
-DATABASE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'reading_challenge.db')
+# Database path - use absolute path to avoid issues in production. Without DATABASE_PATH it is
+# data/reading_challenge.db once deploy.sh has moved it there (docker-compose mounts ./data),
+# otherwise reading_challenge.db next to this file
+_APP_DIR = os.path.dirname(os.path.abspath(__file__))
+_DATA_DIR_DATABASE = os.path.join(_APP_DIR, 'data', 'reading_challenge.db')
+DATABASE_PATH = os.environ.get('DATABASE_PATH') or (
+    _DATA_DIR_DATABASE if os.path.isfile(_DATA_DIR_DATABASE) else os.path.join(_APP_DIR, 'reading_challenge.db'))
 CSV_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'book_list.csv')
+app.config['DATABASE_PATH'] = DATABASE_PATH
+
+# Behind nginx the client address comes from X-Forwarded-For (logins are throttled per address)
+if app.config['TRUSTED_PROXIES']:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config['TRUSTED_PROXIES'])
+
+# Pooled per-thread connections, released after every request
+db.init_app(app)
+
+# Request profiling (only when INSTRUMENTATION is set)
+instrumentation.init_app(app)
+
+# Template bytecode cache and the CSS/JS bundles written by `flask build`
+assets.init_app(app)
+
+# Canonical page URLs, and pre-rendered anonymous pages kept current after writes
+static_export.init_app(app)
+
+# JSON API
+app.register_blueprint(api)
 
 # Initialize Flask-Login
 login_manager = LoginManager()
@@ -29,15 +86,19 @@ login_manager.init_app(app)
 login_manager.login_view = 'login'
 login_manager.login_message = 'Please log in to mark books as read or add reviews.'
 
-# User class for Flask-Login
+# User class for Flask-Login, the session stores the reader's username
 class User(UserMixin):
-    def __init__(self, id):
-        self.id = id
+    def __init__(self, reader):
+        self.id = reader['username']
+        self.reader_id = reader['id']
+        self.name = reader['name']
+        self.books_read = reader['books_read']
 
 @login_manager.user_loader
 def load_user(user_id):
-    if user_id in ['s', 'n']:
-        return User(user_id)
+    reader = get_reader(get_db().cursor(), user_id)
+    if reader:
+        return User(reader)
     return None
 
 @app.route('/login', methods=['GET', 'POST'])
@@ -45,19 +106,41 @@ def login():
     if request.method == 'POST':
         username = request.form.get('username', '').lower()
         password = request.form.get('password', '')
+        address = request.remote_addr or ''
+        conn = get_db()
+        cursor = conn.cursor()
+        
+        # Refuse throttled attempts before spending any CPU on the hash
+        wait = auth.throttle_wait(cursor, app.config, username, address)
+        if wait:
+            flash(f'Too many failed logins, please try again in {math.ceil(wait / 60)} minutes', 'error')
+            return render_template('login.html'), 429, {'Retry-After': str(math.ceil(wait))}
         
-        # Secure authentication with hashed passwords
-        valid_user = False
-        if username == 's':
-            valid_user = check_password_hash(app.config['SILAS_PASSWORD_HASH'], password)
-        elif username == 'n':
-            valid_user = check_password_hash(app.config['NADINE_PASSWORD_HASH'], password)
+        # Counted before the hash is checked, concurrent attempts see each other
+        auth.record_failure(cursor, app.config, username, address)
+        conn.commit()
+        
+        reader = get_reader(cursor, username)
+        valid_user, new_hash = False, None
+        if reader and reader['password_hash']:
+            # A hash that comes from the config would be put back on the next start
+            rehash = reader['password_hash'] != configured_password_hash(app.config, username)
+            try:
+                valid_user, new_hash = auth.check_password(app.config, reader['password_hash'], password,
+                                                           rehash=rehash)
+            except auth.LoginBusy:
+                flash('Too many logins at once, please try again in a moment', 'error')
+                return render_template('login.html'), 503, {'Retry-After': '1'}
         
         if valid_user:
-            user = User(username)
+            auth.clear_failures(cursor, username, address)
+            if new_hash:
+                cursor.execute('UPDATE readers SET password_hash = ? WHERE id = ? AND password_hash = ?',
+                               (new_hash, reader['id'], reader['password_hash']))
+            conn.commit()
+            user = User(reader)
             login_user(user)
-            name = 'Silas' if username == 's' else 'Nadine'
-            flash(f'Welcome back, {name}! Happy reading! 📚', 'success')
+            flash(f'Welcome back, {user.name}! Happy reading! 📚', 'success')
             return redirect(url_for('index'))
         else:
             flash('Invalid credentials', 'error')
@@ -73,312 +156,315 @@ def logout():
 
 # Database initialization
 def init_db():
-    conn = sqlite3.connect(DATABASE_PATH)
-    cursor = conn.cursor()
+    conn = db.connect(DATABASE_PATH)
     
-    # Create books table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS books (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            title TEXT NOT NULL,
-            author TEXT NOT NULL,
-            year INTEGER,
-            s_read BOOLEAN DEFAULT FALSE,
-            n_read BOOLEAN DEFAULT FALSE,
-            cover_url TEXT,
-            order_index INTEGER
-        )
-    ''')
-    
-    # Create reviews table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS reviews (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            book_id INTEGER,
-            reader TEXT NOT NULL,
-            rating INTEGER CHECK(rating >= 1 AND rating <= 5),
-            review TEXT,
-            date_added TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (book_id) REFERENCES books (id)
-        )
-    ''')
+    # Create tables and apply schema migrations (indexes, new columns) to new and existing databases
+    applied = db.create_schema(conn)
+    if applied:
+        print(f"Applied schema migrations: {applied}")
     
-    conn.commit()
+    # Founding readers take their password hashes from the config
+    sync_founding_readers(conn, app.config)
     conn.close()
 
-# Function to fetch cover image from Open Library API
-def get_cover_image(title, author):
-    try:
-        import urllib.parse
-        
-        # Clean title and author for API search
-        clean_title = re.sub(r'[^\w\s]', '', title).strip()
-        clean_author = re.sub(r'[^\w\s]', '', author).strip()
-        
-        # URL encode the parameters
-        encoded_title = urllib.parse.quote(clean_title)
-        encoded_author = urllib.parse.quote(clean_author)
-        
-        # Search Open Library API (use HTTPS)
-        search_url = f"https://openlibrary.org/search.json?title={encoded_title}&author={encoded_author}&limit=1"
-        
-        headers = {
-            'User-Agent': 'ReadingChallenge/1.0 (https://github.com/reading-challenge)'
-        }
-        
-        response = requests.get(search_url, headers=headers, timeout=15)
-        
-        if response.status_code == 200:
-            data = response.json()
-            if data.get('docs') and len(data['docs']) > 0:
-                book = data['docs'][0]
-                if 'cover_i' in book:
-                    cover_id = book['cover_i']
-                    # Use HTTPS for cover images
-                    cover_url = f"https://covers.openlibrary.org/b/id/{cover_id}-L.jpg"
-                    print(f"Found cover for '{title}' by {author}: {cover_url}")
-                    return cover_url
-                else:
-                    print(f"No cover found for '{title}' by {author}")
-            else:
-                print(f"No search results for '{title}' by {author}")
-        else:
-            print(f"API request failed for '{title}' by {author}: Status {response.status_code}")
-            
-    except Exception as e:
-        print(f"Error fetching cover for '{title}' by {author}: {e}")
-    
-    return None
-
-# Load books from CSV into database
+# Load books from CSV into database (network-free; covers are fetched by a background job)
 def load_books_from_csv():
-    conn = sqlite3.connect(DATABASE_PATH)
+    """Insert the CSV rows into an empty books table, returns the number of books added"""
+    # BEGIN IMMEDIATE takes the write lock up front, so when several gunicorn
+    # workers boot at once only the first one finds the table empty
+    conn = db.connect(DATABASE_PATH, timeout=30, isolation_level=None)
     cursor = conn.cursor()
-    
-    # Check if books are already loaded
-    cursor.execute('SELECT COUNT(*) FROM books')
-    if cursor.fetchone()[0] > 0:
-        conn.close()
-        return
-    
-    # Check if CSV file exists
-    if not os.path.exists(CSV_PATH):
-        print(f"Warning: {CSV_PATH} not found. Adding sample books for testing.")
-        # Add some sample books for testing
-        sample_books = [
-            (False, False, "Pride and Prejudice", "Jane Austen", 1813),
-            (False, False, "To Kill a Mockingbird", "Harper Lee", 1960),
-            (False, False, "1984", "George Orwell", 1949),
-            (False, False, "The Great Gatsby", "F. Scott Fitzgerald", 1925),
-            (False, False, "Jane Eyre", "Charlotte Brontë", 1847)
-        ]
-        
-        for i, (s_read, n_read, title, author, year) in enumerate(sample_books):
-            cursor.execute('''
-                INSERT INTO books (title, author, year, s_read, n_read, cover_url, order_index)
-                VALUES (?, ?, ?, ?, ?, ?, ?)
-            ''', (title, author, year, s_read, n_read, None, i))
-        
-        conn.commit()
-        conn.close()
-        print("Sample books added successfully")
-        return
+    cursor.execute('BEGIN IMMEDIATE')
     
     try:
-        with open(CSV_PATH, 'r', encoding='utf-8') as file:
-            csv_reader = csv.reader(file)
-            next(csv_reader)  # Skip header
-            
-            order_index = 0
-            for row in csv_reader:
-                if len(row) >= 4 and row[2]:  # Make sure we have title and author
-                    s_read = row[0].strip().lower() == 'x'
-                    n_read = row[1].strip().lower() == 'x'
-                    title = row[2].strip()
-                    author = row[3].strip()
-                    
-                    # Extract year from title if present and remove brackets
-                    year = None
-                    if '(' in title and ')' in title:
-                        try:
-                            year_str = title[title.rfind('(') + 1:title.rfind(')')]
-                            year = int(year_str)
-                            title = title[:title.rfind('(')].strip()
-                        except ValueError:
-                            pass
-                    
-                    # Fetch cover image (enabled for both development and production)
-                    cover_url = get_cover_image(title, author)
-                    
-                    cursor.execute('''
-                        INSERT INTO books (title, author, year, s_read, n_read, cover_url, order_index)
-                        VALUES (?, ?, ?, ?, ?, ?, ?)
-                    ''', (title, author, year, s_read, n_read, cover_url, order_index))
-                    
-                    order_index += 1
+        # Check if books are already loaded
+        cursor.execute('SELECT COUNT(*) FROM books')
+        if cursor.fetchone()[0] > 0:
+            cursor.execute('ROLLBACK')
+            return 0
         
-        conn.commit()
-        print(f"Successfully loaded {order_index} books from CSV")
+        # Check if CSV file exists
+        if not os.path.exists(CSV_PATH):
+            print(f"Warning: {CSV_PATH} not found. Adding sample books for testing.")
+            # Add some sample books for testing
+            sample_books = [
+                {'title': "Pride and Prejudice", 'author': "Jane Austen", 'year': 1813},
+                {'title': "To Kill a Mockingbird", 'author': "Harper Lee", 'year': 1960},
+                {'title': "1984", 'author': "George Orwell", 'year': 1949},
+                {'title': "The Great Gatsby", 'author': "F. Scott Fitzgerald", 'year': 1925},
+                {'title': "Jane Eyre", 'author': "Charlotte Brontë", 'year': 1847}
+            ]
+            summary = apply_sync(cursor, sample_books)
+            cursor.execute('COMMIT')
+            print("Sample books added successfully")
+            return summary['inserted']
+        
+        summary = apply_sync(cursor, read_csv_books(CSV_PATH))
+        cursor.execute('COMMIT')
+        print(f"Successfully loaded {summary['inserted']} books from CSV")
+        return summary['inserted']
     except Exception as e:
+        cursor.execute('ROLLBACK')
         print(f"Error loading books from CSV: {e}")
+        return 0
+    finally:
+        conn.close()
+
+def sync_books_from_csv():
+    """Apply additions, corrections, reordering and read marks from the CSV, returns the summary"""
+    conn = db.connect(DATABASE_PATH, timeout=30, isolation_level=None)
+    try:
+        summary = sync_csv(conn, CSV_PATH)
     finally:
         conn.close()
+    print(f"CSV sync: {summary['inserted']} new, {summary['updated']} updated, "
+          f"{summary['unchanged']} unchanged, {summary['missing']} no longer in the CSV, "
+          f"{summary['marked']} read marks added")
+    return summary
+
+def enrich_book_metadata(books, progress=None):
+    """Look up covers and metadata for (id, title, author) rows, returns the number found"""
+    # Imported here so that workers only load requests and asyncio once they enrich books
+    from covers import CoverCache
+    from enrichment import HttpClient, enrich_books, providers_from_config
+    
+    with HttpClient.from_config(app.config) as http, CoverCache.from_config(app.config) as cache:
+        instrument_session(http.session)
+        providers = providers_from_config(http, app.config)
+        # Enough books per chunk to keep every connection busy with batch queries
+        chunk_size = http.concurrency * app.config['ENRICHMENT_BATCH_SIZE']
+        return enrich_books(DATABASE_PATH, books, providers, chunk_size=chunk_size,
+                            cache=cache, progress=progress)
+
+def fetch_covers_for_books(progress=None):
+    """Enrich the books due for a lookup (see UNENRICHED_BOOKS_QUERY), returns the number found"""
+    conn = db.connect(DATABASE_PATH)
+    cursor = conn.cursor()
+    cursor.execute(UNENRICHED_BOOKS_QUERY, (time.time(),))
+    books = cursor.fetchall()
+    conn.close()
+    
+    if progress is not None:
+        progress(total=len(books))
+    if not books:
+        return 0
+    found = enrich_book_metadata(books, progress=progress)
+    # Covers and metadata are written outside any request
+    static_export.schedule(app)
+    return found
+
+def start_cover_job():
+    """Queue a cover fetch and start working on it in the background, returns the job id"""
+    job_id = enqueue_job(DATABASE_PATH, 'covers')
+    start_job_thread(DATABASE_PATH, 'covers', fetch_covers_for_books)
+    return job_id
+
+def backup_database(progress=None):
+    """Snapshot the database into BACKUP_DIR and drop the oldest snapshots, returns the snapshot path"""
+    path, pages, restarts = backups.snapshot(DATABASE_PATH, app.config['BACKUP_DIR'],
+                                             pages=app.config['BACKUP_PAGES_PER_STEP'],
+                                             pause=app.config['BACKUP_STEP_PAUSE'])
+    removed = backups.prune(app.config['BACKUP_DIR'], DATABASE_PATH, app.config['BACKUP_KEEP'])
+    # Reported once at the end: writing progress mid-copy would restart the copy, so
+    # backup jobs get a longer heartbeat timeout instead (jobs.STALE_AFTER_KIND)
+    if progress is not None:
+        progress(total=pages, done=pages)
+    print(f"Backed up {DATABASE_PATH} to {path} ({pages} pages, {restarts} restarts, "
+          f"{len(removed)} old snapshots removed)")
+    return path
+
+def start_background_work():
+    """Start this process's threads: queued cover jobs, the static export and the backup scheduler"""
+    start_job_thread(DATABASE_PATH, 'covers', fetch_covers_for_books)
+    # Write the first static export, or catch up with changes made while the app was down
+    static_export.schedule(app)
+    if app.config['BACKUP_INTERVAL_HOURS'] > 0:
+        backups.start_scheduler(DATABASE_PATH, app.config['BACKUP_INTERVAL_HOURS'] * 3600, backup_database)
 
 # Initialize database and load books when app starts (works with both direct run and gunicorn)
-def initialize_app():
+def initialize_app(import_seconds=None):
     """Initialize database and load books with proper error handling"""
     try:
-        print(f"Initializing database at: {DATABASE_PATH}")
-        print(f"CSV file location: {CSV_PATH}")
-        print(f"Current working directory: {os.getcwd()}")
-        print(f"App file directory: {os.path.dirname(os.path.abspath(__file__))}")
-        
+        started = time.perf_counter()
         init_db()
-        print("Database tables created successfully")
+        schema_done = time.perf_counter()
         
-        print("Loading books from CSV...")
-        load_books_from_csv()
-        print("App initialization complete")
+        if app.config['CSV_SYNC_ON_STARTUP'] and os.path.exists(CSV_PATH):
+            added = sync_books_from_csv()['inserted']
+        else:
+            added = load_books_from_csv()
+        if added:
+            # Fetch cover images in the background (enabled for both development and production)
+            enqueue_job(DATABASE_PATH, 'covers')
+        # Under gunicorn each worker starts its threads after the fork (see gunicorn.conf.py)
+        if not os.environ.get('BACKGROUND_WORK_AFTER_FORK'):
+            start_background_work()
+        books_done = time.perf_counter()
         
-        # Verify the database was properly initialized
-        conn = sqlite3.connect(DATABASE_PATH)
-        cursor = conn.cursor()
-        cursor.execute('SELECT COUNT(*) FROM books')
-        book_count = cursor.fetchone()[0]
-        print(f"Database contains {book_count} books")
-        conn.close()
+        # One line of cold-start timings: module imports, schema check/migrations, CSV load
+        imports = f"imports {import_seconds * 1000:.0f} ms, " if import_seconds is not None else ''
+        print(f"Initialized {DATABASE_PATH} ({imports}schema {(schema_done - started) * 1000:.0f} ms, "
+              f"books {(books_done - schema_done) * 1000:.0f} ms, {added} added)")
         
     except Exception as e:
         print(f"ERROR during app initialization: {e}")
         import traceback
         traceback.print_exc()
 
-# Call initialization
-initialize_app()
+# Call initialization (image builds set SKIP_INITIALIZE to run `flask build` without a database)
+if not os.environ.get('SKIP_INITIALIZE'):
+    initialize_app(import_seconds=time.perf_counter() - _import_started)
 
-@app.route('/')
-def index():
-    # Ensure database is initialized
-    try:
-        conn = sqlite3.connect(DATABASE_PATH)
-        cursor = conn.cursor()
-        
-        # Test if books table exists
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='books'")
-        if not cursor.fetchone():
-            # Table doesn't exist, try to initialize
-            print("Books table not found, initializing database...")
-            conn.close()
-            initialize_app()
-            conn = sqlite3.connect(DATABASE_PATH)
-            cursor = conn.cursor()
-        
-    except Exception as e:
-        print(f"Database connection error: {e}")
-        # Try to initialize database
-        initialize_app()
-        conn = sqlite3.connect(DATABASE_PATH)
-        cursor = conn.cursor()
-    
-    # Get filter parameters
+# Query arguments that select a page of the book grid
+GRID_ARGS = ('filter', 'century', 'sort', 'after', 'offset')
+
+def grid_args():
+    """Filter, century, sort and reader id of the book grid requested"""
     filter_by = request.args.get('filter', 'all')
     century_filter = request.args.get('century', 'all')
-    
-    # Build base query
-    base_conditions = []
-    
-    # Apply reading status filter
-    if filter_by == 'silas':
-        base_conditions.append('s_read = 1')
-    elif filter_by == 'nadine':
-        base_conditions.append('n_read = 1')
-    elif filter_by == 'both':
-        base_conditions.append('s_read = 1 AND n_read = 1')
-    elif filter_by == 'unread':
-        base_conditions.append('s_read = 0 AND n_read = 0')
-    
-    # Apply century filter
-    if century_filter == '19th':
-        base_conditions.append('year >= 1800 AND year < 1900')
-    elif century_filter == '20th':
-        base_conditions.append('year >= 1900 AND year < 2000')
-    elif century_filter == '21st':
-        base_conditions.append('year >= 2000')
-    
-    # Build final query
-    where_clause = ''
-    if base_conditions:
-        where_clause = 'WHERE ' + ' AND '.join(base_conditions)
-    
-    query = f'''
-        SELECT id, title, author, year, s_read, n_read, cover_url FROM books
-        {where_clause}
-        ORDER BY order_index
-    '''
-    
-    cursor.execute(query)
+    sort = request.args.get('sort', 'list')
+    if sort not in SORTS:
+        sort = 'list'
+    
+    # Logged-in readers see their own progress on every card
+    reader_id = current_user.reader_id if current_user.is_authenticated else None
+    if filter_by in READER_FILTERS and reader_id is None:
+        filter_by = 'all'
+    return filter_by, century_filter, sort, reader_id
+
+def legacy_filter_redirect():
+    """Redirect for an old ?filter=silas|nadine|both link, or None.
+
+    A founding reader following a link to their own books gets their 'mine'
+    list, everyone else the books someone has read.
+    """
+    usernames = LEGACY_FILTERS.get(request.args.get('filter'))
+    if usernames is None:
+        return None
+    own = current_user.is_authenticated and current_user.id in usernames
+    args = {**request.args.to_dict(), 'filter': 'mine' if own else 'read'}
+    return redirect(url_for(request.endpoint, **args))
+
+def load_books_page(cursor, filter_by, century_filter, sort, reader_id):
+    """One page of grid cards, and the query arguments of the next page (None on the last one)"""
+    # List order continues after an order_index, the other orders skip rows along their index
+    after = request.args.get('after', type=int) if sort == 'list' else None
+    offset = max(0, request.args.get('offset', 0, type=int)) if sort != 'list' else 0
+    
+    query = build_books_query(filter_by, century_filter, after=after is not None, limit=True,
+                              offset=bool(offset), reader=reader_id is not None, sort=sort)
+    params = (((reader_id,) if reader_id is not None else ()) + ((after,) if after is not None else ())
+              + (BOOKS_PAGE_SIZE + 1,) + ((offset,) if offset else ()))
+    cursor.execute(query, params)
     books = cursor.fetchall()
+    if len(books) <= BOOKS_PAGE_SIZE:
+        return books, None
+    
+    books = books[:BOOKS_PAGE_SIZE]
+    next_page = {'filter': filter_by, 'century': century_filter, 'sort': sort}
+    if sort == 'list':
+        next_page['after'] = books[-1]['order_index']
+    else:
+        next_page['offset'] = offset + BOOKS_PAGE_SIZE
+    return books, next_page
+
+@app.route('/')
+@cached_page(vary_args=GRID_ARGS)
+def index():
+    legacy = legacy_filter_redirect()
+    if legacy:
+        return legacy
+    cursor = get_db().cursor()
     
-    # Get reading statistics
-    cursor.execute('SELECT COUNT(*) FROM books WHERE s_read = 1')
-    s_read_count = cursor.fetchone()[0]
-    
-    cursor.execute('SELECT COUNT(*) FROM books WHERE n_read = 1')
-    n_read_count = cursor.fetchone()[0]
-    
-    cursor.execute('SELECT COUNT(*) FROM books')
-    total_books = cursor.fetchone()[0]
-    
-    # Get century statistics
-    cursor.execute('SELECT COUNT(*) FROM books WHERE year >= 1800 AND year < 1900')
-    books_19th = cursor.fetchone()[0]
-    
-    cursor.execute('SELECT COUNT(*) FROM books WHERE year >= 1900 AND year < 2000')
-    books_20th = cursor.fetchone()[0]
-    
-    cursor.execute('SELECT COUNT(*) FROM books WHERE year >= 2000')
-    books_21st = cursor.fetchone()[0]
-    
-    conn.close()
+    # Get reading statistics (cached until the next write)
+    try:
+        stats = get_stats(cursor)
+    except sqlite3.OperationalError as e:
+        # Tables don't exist yet, try to initialize
+        print(f"Database not ready ({e}), initializing database...")
+        initialize_app()
+        stats = get_stats(cursor)
     
-    stats = {
-        's_read': s_read_count,
-        'n_read': n_read_count,
-        'total': total_books,
-        's_percentage': round((s_read_count / total_books * 100), 1) if total_books > 0 else 0,
-        'n_percentage': round((n_read_count / total_books * 100), 1) if total_books > 0 else 0,
-        'books_19th': books_19th,
-        'books_20th': books_20th,
-        'books_21st': books_21st
-    }
+    # Only the first page of cards, the grid loads the rest from /books/fragment while scrolling
+    filter_by, century_filter, sort, reader_id = grid_args()
+    books, next_page = load_books_page(cursor, filter_by, century_filter, sort, reader_id)
     
-    return render_template('index.html', books=books, stats=stats, current_filter=filter_by, current_century=century_filter)
+    return render_template('index.html', books=books, next_page=next_page, stats=stats,
+                           current_filter=filter_by, current_century=century_filter, current_sort=sort)
+
+@app.route('/books/fragment')
+@cached_page(vary_args=GRID_ARGS)
+def books_fragment():
+    """The next page of book grid cards, as an HTML fragment"""
+    legacy = legacy_filter_redirect()
+    if legacy:
+        return legacy
+    books, next_page = load_books_page(get_db().cursor(), *grid_args())
+    return render_template('_book_cards.html', books=books, next_page=next_page)
 
 @app.route('/book/<int:book_id>')
+@cached_page(vary_args=('all_reviews',))
 def book_detail(book_id):
-    conn = sqlite3.connect(DATABASE_PATH)
-    cursor = conn.cursor()
+    cursor = get_db().cursor()
     
     # Get book details including cover URL
-    cursor.execute('''
-        SELECT id, title, author, year, s_read, n_read, cover_url FROM books WHERE id = ?
-    ''', (book_id,))
+    cursor.execute(BOOK_DETAIL_QUERY, (book_id,))
     book = cursor.fetchone()
     
     if not book:
         flash('Book not found', 'error')
         return redirect(url_for('index'))
     
-    # Get reviews for this book
-    cursor.execute('''
-        SELECT reader, rating, review, date_added FROM reviews 
-        WHERE book_id = ? ORDER BY date_added DESC
-    ''', (book_id,))
+    # Newest reviews first; the full list only on request (-1 is no limit)
+    show_all = request.args.get('all_reviews') == '1'
+    cursor.execute(BOOK_REVIEWS_QUERY, (book_id, -1 if show_all else BOOK_REVIEWS_SHOWN))
     reviews = cursor.fetchall()
     
-    conn.close()
+    # Each reader's latest rating, kept up to date by the reviews triggers
+    cursor.execute(LATEST_RATINGS_QUERY, (book_id,))
+    latest_ratings = cursor.fetchall()
     
-    return render_template('book_detail.html', book=book, reviews=reviews)
+    # First readers to finish it, and whether the current reader has
+    cursor.execute(BOOK_READERS_QUERY, (book_id,))
+    book_readers = cursor.fetchall()
+    read_by_me = False
+    if current_user.is_authenticated:
+        cursor.execute(PROGRESS_QUERY, (current_user.reader_id, book_id))
+        read_by_me = cursor.fetchone() is not None
+    
+    return render_template('book_detail.html', book=book, reviews=reviews, latest_ratings=latest_ratings,
+                           book_readers=book_readers, read_by_me=read_by_me)
+
+@app.route('/leaderboard')
+@cached_page()
+def leaderboard():
+    """Readers, reviewers and books ranked by the precomputed counters"""
+    return render_template('leaderboard.html', board=get_leaderboard(get_db().cursor()))
+
+@app.route('/history')
+def history():
+    """Books read over time and the pace toward the goal, from the reading rollups"""
+    # Not cached: the default range moves with the date, not only with the data
+    deadline = challenge_deadline(app.config)
+    try:
+        data = get_history(get_db().cursor(), request.args.get('period', 'month'), request.args.get('century', 'all'),
+                           request.args.get('reader'), parse_date(request.args.get('start'), 'start'),
+                           parse_date(request.args.get('end'), 'end'), deadline)
+    except (ValueError, LookupError) as error:
+        flash(str(error), 'error')
+        return redirect(url_for('history'))
+    readers = [entry for entry in data['series'] if entry['id']]
+    return render_template('history.html', history=data, readers=readers,
+                           everyone_chart=chart(data, data['series'][:1], 'cumulative'),
+                           readers_chart=chart(data, readers, 'cumulative'))
+
+@app.route('/search')
+@cached_page(vary_args=('q',))
+def search():
+    """Full-text search over titles, authors and reviews"""
+    query = request.args.get('q', '').strip()
+    results = search_books(get_db().cursor(), query)
+    return render_template('search.html', query=query, results=results)
 
 @app.route('/mark_read/<int:book_id>/<reader>')
 @login_required
@@ -388,19 +474,14 @@ def mark_read(book_id, reader):
         flash('You can only mark your own books as read', 'error')
         return redirect(url_for('book_detail', book_id=book_id))
     
-    if reader not in ['s', 'n']:
-        flash('Invalid reader', 'error')
-        return redirect(url_for('index'))
-    
-    conn = sqlite3.connect(DATABASE_PATH)
+    conn = get_db()
     cursor = conn.cursor()
     
-    column = f'{reader}_read'
-    cursor.execute(f'UPDATE books SET {column} = 1 WHERE id = ?', (book_id,))
-    conn.commit()
-    conn.close()
-    
-    flash(f'Book marked as read by {reader.upper()}!', 'success')
+    if mark_book_read(cursor, current_user.reader_id, book_id):
+        conn.commit()
+        flash(f'Book marked as read by {current_user.name}!', 'success')
+    else:
+        flash('This book is already marked as read', 'info')
     return redirect(url_for('book_detail', book_id=book_id))
 
 @app.route('/add_review/<int:book_id>', methods=['POST'])
@@ -427,16 +508,16 @@ def add_review(book_id):
         flash('Rating must be between 1 and 5', 'error')
         return redirect(url_for('book_detail', book_id=book_id))
     
-    conn = sqlite3.connect(DATABASE_PATH)
+    conn = get_db()
     cursor = conn.cursor()
     
     cursor.execute('''
         INSERT INTO reviews (book_id, reader, rating, review)
         VALUES (?, ?, ?, ?)
     ''', (book_id, reader, rating, review_text))
+    bump_data_version(cursor)
     
     conn.commit()
-    conn.close()
     
     flash('Review added successfully!', 'success')
     return redirect(url_for('book_detail', book_id=book_id))
@@ -444,42 +525,284 @@ def add_review(book_id):
 @app.route('/fetch_covers', methods=['POST'])
 @login_required
 def fetch_covers():
-    """Fetch missing cover images for books that don't have them"""
+    """Start fetching missing cover images in the background"""
     try:
-        conn = sqlite3.connect(DATABASE_PATH)
-        cursor = conn.cursor()
-        
-        # Get books without cover images
-        cursor.execute('SELECT id, title, author FROM books WHERE cover_url IS NULL OR cover_url = ""')
-        books_without_covers = cursor.fetchall()
-        
-        updated_count = 0
-        for book_id, title, author in books_without_covers:
-            cover_url = get_cover_image(title, author)
-            if cover_url:
-                cursor.execute('UPDATE books SET cover_url = ? WHERE id = ?', (cover_url, book_id))
-                updated_count += 1
-                print(f"Updated cover for: {title} by {author}")
-        
-        conn.commit()
-        conn.close()
-        
-        if updated_count > 0:
-            flash(f'Successfully fetched {updated_count} book covers!', 'success')
-        else:
-            flash('No new covers found. All books may already have covers or the API might be unavailable.', 'info')
-            
+        start_cover_job()
+        flash('Fetching missing book covers and details in the background. They will appear as they are found.', 'info')
     except Exception as e:
-        print(f"Error fetching covers: {e}")
+        print(f"Error starting cover fetch: {e}")
         flash('Error fetching covers. Please try again later.', 'error')
     
     return redirect(url_for('index'))
 
+@app.route('/fetch_covers/status')
+@login_required
+def fetch_covers_status():
+    """Progress of the most recent cover fetch as JSON"""
+    job = get_latest_job(DATABASE_PATH, 'covers')
+    if job is None:
+        return jsonify({'status': 'idle'})
+    return jsonify(job)
+
+@app.route('/covers/<int:book_id>')
+def cover_image(book_id):
+    """Redirect to the locally stored cover, downloading it on first request"""
+    size = 'original' if request.args.get('size') == 'original' else 'thumb'
+    conn = get_db()
+    cursor = conn.cursor()
+    cursor.execute(COVER_QUERY, (book_id,))
+    book = cursor.fetchone()
+    if not book or not book['cover_url']:
+        abort(404)
+    
+    path = book['cover_original'] if size == 'original' else book['cover_thumb']
+    if not is_stored(path):
+        try:
+            original_path, thumb_path = store_cover(book['cover_url'])
+        except Exception as e:
+            print(f"Error storing cover for book {book_id}: {e}")
+            # Fall back to the Open Library image
+            return redirect(book['cover_url'])
+        cursor.execute('UPDATE books SET cover_original = ?, cover_thumb = ? WHERE id = ?',
+                       (original_path, thumb_path, book_id))
+        bump_data_version(cursor)
+        conn.commit()
+        path = original_path if size == 'original' else thumb_path
+    
+    response = redirect(url_for('static', filename=path))
+    response.cache_control.public = True
+    response.cache_control.max_age = 86400
+    return response
+
+app.add_template_filter(highlight_html, 'search_highlight')
+app.add_template_global(reader_gradient)
+
+@app.template_global()
+def cover_src(book, size='thumb'):
+    """Image URL for a book row: the hashed local file if stored, else the /covers proxy"""
+    path = book['cover_original'] if size == 'original' else book['cover_thumb']
+    if is_stored(path):
+        return url_for('static', filename=path)
+    if book['cover_url']:
+        return url_for('cover_image', book_id=book['id'], size=size)
+    return None
+
+@app.after_request
+def cache_hashed_static(response):
+    # Stored covers and built bundles have content hashes in their names, so they never change
+    if request.path.startswith(('/static/covers/', '/static/dist/')) and response.status_code == 200:
+        response.cache_control.public = True
+        response.cache_control.max_age = 31536000
+        response.cache_control.immutable = True
+        response.cache_control.no_cache = None
+    return response
+
 @app.route('/about')
+@cached_page()
 def about():
     """About page with information about the reading challenge"""
     return render_template('about.html')
 
+# Route queries allowed to read a whole table, with the reason
+ALLOWED_SCANS = {
+    'index stats': 'one pass over the covering stats index, cached until the next write',
+    'index reader count': 'counts the readers once, cached with the stats until the next write',
+    'fetch_covers unenriched': 'walks the partial index of books not yet enriched, a background job',
+}
+
+def route_queries():
+    """Every query a route runs, as (label, sql, params), for the query plan check"""
+    queries = [
+        (f'index filter={filter_by} century={century}',
+         build_books_query(filter_by, century, limit=True, reader=filter_by in READER_FILTERS),
+         ((1,) if filter_by in READER_FILTERS else ()) + (BOOKS_PAGE_SIZE + 1,))
+        for filter_by in FILTERS for century in CENTURIES
+    ]
+    queries += [
+        ('index as reader', build_books_query('all', 'all', limit=True, reader=True), (1, BOOKS_PAGE_SIZE + 1)),
+        ('index by rating', build_books_query('all', 'all', limit=True, sort='rating'), (BOOKS_PAGE_SIZE + 1,)),
+        ('index by rating as reader', build_books_query('all', 'all', limit=True, reader=True, sort='rating'),
+         (1, BOOKS_PAGE_SIZE + 1)),
+        ('books_fragment next page', build_books_query('unread', '20th', after=True, limit=True),
+         (48, BOOKS_PAGE_SIZE + 1)),
+        ('books_fragment next page for reader',
+         build_books_query('todo', 'all', after=True, limit=True, reader=True), (1, 48, BOOKS_PAGE_SIZE + 1)),
+        ('books_fragment by rating', build_books_query('all', 'all', limit=True, offset=True, sort='rating'),
+         (BOOKS_PAGE_SIZE + 1, BOOKS_PAGE_SIZE)),
+        ('index stats', STATS_QUERY, ()),
+        ('index reader count', READER_COUNT_QUERY, ()),
+        ('index top readers', TOP_READERS_QUERY, (TOP_READERS,)),
+        ('login reader', READER_QUERY, ('s',)),
+        ('book_detail book', BOOK_DETAIL_QUERY, (1,)),
+        ('book_detail reviews', BOOK_REVIEWS_QUERY, (1, BOOK_REVIEWS_SHOWN)),
+        ('book_detail latest ratings', LATEST_RATINGS_QUERY, (1,)),
+        ('book_detail readers', BOOK_READERS_QUERY, (1,)),
+        ('book_detail progress', PROGRESS_QUERY, (1, 1)),
+        ('mark_read', MARK_READ_SQL, (1, None, 1)),
+        ('api progress unmark', UNMARK_READ_SQL, (1, 1)),
+        ('api progress undo undated', MARK_UNDATED_SQL, (1, 1)),
+        ('fetch_covers unenriched', UNENRICHED_BOOKS_QUERY, (0,)),
+        ('fetch_covers status', LATEST_JOB_QUERY, ('covers',)),
+        ('api books page', build_books_query('read', '19th', after=True, limit=True), (0, 50)),
+        ('api books page for reader', build_books_query('todo', 'all', after=True, limit=True, reader=True),
+         (1, 0, 50)),
+        ('api book reviews', API_REVIEWS_QUERY.format(before=''), (1, 50)),
+        ('search', SEARCH_QUERY, ('"war"*', 50)),
+        ('leaderboard readers', LEADERBOARD_READERS_QUERY, (LEADERBOARD_SIZE,)),
+        ('leaderboard reviewers', LEADERBOARD_REVIEWERS_QUERY, (LEADERBOARD_SIZE,)),
+        ('leaderboard top rated', TOP_RATED_QUERY, (MIN_RATINGS, LEADERBOARD_SIZE)),
+        ('leaderboard most read', MOST_READ_QUERY, (LEADERBOARD_SIZE,)),
+        ('history', build_history_query(3), {'period': 'week', 'century': '20th', 'first': '2025-03-03',
+                                             'after': '2025-09-01', 'year_start': '2025-01-01',
+                                             'month_start': '2025-03-01', 'reader0': 0, 'reader1': 1,
+                                             'reader2': 2}),
+    ]
+    return queries
+
+def update_static_export(full=False):
+    """Bring STATIC_EXPORT_DIR up to date after a command wrote (the running app's thread may not notice)"""
+    if app.config['STATIC_EXPORT_DIR']:
+        rendered, written, seconds = static_export.export_site(app, app.config['STATIC_EXPORT_DIR'], full=full)
+        print(f"Static export: {written} of {rendered} pages changed in {seconds * 1000:.0f} ms")
+
+@app.cli.command('sync-csv')
+@click.option('--covers/--no-covers', default=True, help='Look up covers and metadata for newly added books.')
+def sync_csv_command(covers):
+    """Sync book_list.csv into the database, touching only what changed"""
+    summary = sync_books_from_csv()
+    if covers and summary['new_ids']:
+        conn = db.connect(DATABASE_PATH)
+        new_books = conn.execute(
+            f"SELECT id, title, author FROM books WHERE id IN ({', '.join('?' * len(summary['new_ids']))})",
+            summary['new_ids']
+        ).fetchall()
+        conn.close()
+        found = enrich_book_metadata(new_books)
+        print(f"Found metadata for {found} of {len(new_books)} new books")
+    update_static_export()
+
+@app.cli.command('add-reader')
+@click.argument('username')
+@click.argument('name')
+@click.password_option()
+def add_reader_command(username, name, password):
+    """Add a member to the reading group"""
+    conn = db.connect(DATABASE_PATH)
+    try:
+        with conn:
+            add_reader(conn.cursor(), username, name, auth.hash_password(app.config, password))
+            bump_data_version(conn)
+    except sqlite3.IntegrityError:
+        raise SystemExit(f"Reader '{username.lower()}' already exists")
+    finally:
+        conn.close()
+    print(f"Added reader {name} ({username.lower()})")
+    update_static_export()
+
+@app.cli.command('build')
+@click.option('--bundles/--no-bundles', default=True, help='Vendor, minify and fingerprint the CSS/JS bundles.')
+def build_command(bundles):
+    """Precompile the templates and build the static bundles, ahead of the first start"""
+    started = time.perf_counter()
+    if bundles:
+        for name, path in assets.build_bundles().items():
+            size = os.path.getsize(os.path.join(assets.STATIC_DIR, path))
+            print(f"{name}: static/{path} ({size / 1024:.0f} KiB)")
+    count = assets.precompile_templates(app)
+    if count:
+        print(f"Compiled {count} templates into {app.config['TEMPLATE_CACHE_DIR']}")
+    else:
+        print("TEMPLATE_CACHE_DIR is empty, templates are compiled on first use")
+    print(f"Build finished in {(time.perf_counter() - started) * 1000:.0f} ms")
+
+@app.cli.command('export-static')
+@click.option('--out', help='Export directory (default: STATIC_EXPORT_DIR).')
+@click.option('--full', is_flag=True, help='Render every page, not only what changed since the last export.')
+def export_static_command(out, full):
+    """Render the pages anonymous visitors see into static files for nginx"""
+    out = out or app.config['STATIC_EXPORT_DIR']
+    if not out:
+        raise SystemExit("Set STATIC_EXPORT_DIR or pass --out")
+    rendered, written, seconds = static_export.export_site(app, out, full=full)
+    print(f"Exported {rendered} pages into {out} ({written} changed) in {seconds * 1000:.0f} ms")
+
+@app.cli.command('backup')
+@click.option('--list', 'list_only', is_flag=True, help='List the snapshots instead of taking one.')
+def backup_command(list_only):
+    """Snapshot the live database into BACKUP_DIR (safe while the app is serving)"""
+    if not list_only:
+        backup_database()
+    for path in backups.list_snapshots(app.config['BACKUP_DIR'], DATABASE_PATH):
+        print(f"{path} ({os.path.getsize(path) / 1024 / 1024:.1f} MiB)")
+
+@app.cli.command('restore-backup')
+@click.argument('snapshot', type=click.Path(exists=True, dir_okay=False))
+@click.confirmation_option(prompt='Replace all data in the live database with this snapshot?')
+def restore_backup_command(snapshot):
+    """Replace the live database's content with a snapshot, online"""
+    try:
+        safety_path = backups.restore_snapshot(DATABASE_PATH, snapshot, app.config['BACKUP_DIR'])
+    except ValueError as e:
+        raise SystemExit(str(e))
+    print(f"Restored {snapshot} into {DATABASE_PATH}; the data it replaced is in {safety_path}")
+    # The export's manifest describes the data that was replaced, so render every page
+    update_static_export(full=True)
+
+@app.cli.command('export-data')
+@click.argument('path', type=click.Path(dir_okay=False))
+def export_data_command(path):
+    """Write books, readers, reviews and reading progress to a gzipped JSON file"""
+    conn = db.connect(DATABASE_PATH, isolation_level=None)
+    try:
+        counts = backups.export_data(conn, path)
+    finally:
+        conn.close()
+    print(f"Exported {', '.join(f'{count} {name}' for name, count in counts.items())} to {path}")
+
+@app.cli.command('import-data')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+def import_data_command(path):
+    """Merge a file written by export-data into the database"""
+    conn = db.connect(DATABASE_PATH)
+    try:
+        with conn:
+            added = backups.import_data(conn.cursor(), path)
+    except ValueError as e:
+        raise SystemExit(str(e))
+    finally:
+        conn.close()
+    print(f"Imported {', '.join(f'{count} {name}' for name, count in added.items())} from {path}")
+    update_static_export()
+
+@app.cli.command('check-query-plans')
+@click.option('--database', help='Database to check (default: DATABASE_PATH).')
+@click.option('--scratch', is_flag=True, help='Check against an empty database with the current schema.')
+def check_query_plans(database, scratch):
+    """Fail if any route query reads a whole table or index instead of searching one.
+
+    Exits non-zero on a failure. With --scratch it needs no database, so it
+    can run next to `flask build` (SKIP_INITIALIZE=1) in CI or an image build.
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        if scratch:
+            database = os.path.join(tmp, 'plans.db')
+        conn = db.connect(database or DATABASE_PATH)
+        if scratch:
+            db.create_schema(conn)
+        failures = 0
+        for label, sql, params in route_queries():
+            scans = db.full_table_scans(conn, sql, params)
+            if scans and label in ALLOWED_SCANS:
+                print(f"allowed    {label}: {ALLOWED_SCANS[label]}")
+            elif scans:
+                failures += 1
+                print(f"FULL SCAN  {label}: {'; '.join(scans)}")
+            else:
+                print(f"ok         {label}")
+        conn.close()
+    if failures:
+        raise SystemExit(f"{failures} route queries do full table scans")
+
 if __name__ == '__main__':
     # Database initialization is now handled at app startup above
     # Use environment variables for production deployment
@@ -0,0 +1,215 @@
+"""Vendored CSS/JS bundles and precompiled templates.
+
+``flask build`` does the slow work of a cold start ahead of time:
+
+- it downloads Bootstrap and Font Awesome once into ``static/vendor`` (the
+  copies are reused by later builds, and can be committed to build offline),
+  concatenates them with the app's own ``static/css/app.css`` into one
+  stylesheet and one script, strips comments and whitespace, and writes them
+  to ``static/dist`` under content-hashed names, along with the fonts the CSS
+  refers to. ``static/dist/manifest.json`` maps each bundle to its file.
+  Because a file's name changes whenever its content does, they are served
+  with far-future ``immutable`` cache headers;
+- it compiles every template into Jinja bytecode under
+  ``TEMPLATE_CACHE_DIR``, so workers load compiled templates instead of
+  parsing them on their first request.
+
+Without a build the pages keep linking the CDN copies and templates are
+compiled on first use, as before.
+"""
+import hashlib
+import json
+import os
+import re
+import tempfile
+import urllib.parse
+
+from flask import url_for
+from jinja2 import FileSystemBytecodeCache
+
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+VENDOR_SUBDIR = 'vendor'
+DIST_SUBDIR = 'dist'
+MANIFEST_PATH = os.path.join(STATIC_DIR, DIST_SUBDIR, 'manifest.json')
+
+BOOTSTRAP_CSS_URL = 'https://cdn.jsdelivr.net/npm/bootstrap@5.1.3/dist/css/bootstrap.min.css'
+FONTAWESOME_CSS_URL = 'https://cdnjs.cloudflare.com/ajax/libs/font-awesome/6.0.0/css/all.min.css'
+BOOTSTRAP_JS_URL = 'https://cdn.jsdelivr.net/npm/bootstrap@5.1.3/dist/js/bootstrap.bundle.min.js'
+
+# Bundle name -> sources, in order; URLs are vendored, other paths are relative to static/
+BUNDLES = {
+    'app.css': (BOOTSTRAP_CSS_URL, FONTAWESOME_CSS_URL, 'css/app.css'),
+    'app.js': (BOOTSTRAP_JS_URL,),
+}
+
+DOWNLOAD_TIMEOUT = 30
+
+CSS_URL_RE = re.compile(r'url\(\s*([\'"]?)([^\'")]+)\1\s*\)')
+SOURCE_MAP_RE = re.compile(r'^\s*(//|/\*)# sourceMappingURL=.*$', re.MULTILINE)
+# Quoted strings and comments, which the CSS minifier must not reach into
+CSS_TOKEN_RE = re.compile(r'''"(?:[^"\\]|\\.)*"|'(?:[^'\\]|\\.)*'|/\*.*?\*/''', re.DOTALL)
+
+_manifest = {}
+
+
+def _is_url(source):
+    return source.startswith(('http://', 'https://'))
+
+
+def _vendor_path(url):
+    """Local copy of a vendored URL, keeping the CDN's directory layout so relative references still resolve"""
+    parts = urllib.parse.urlsplit(url)
+    return os.path.join(STATIC_DIR, VENDOR_SUBDIR, parts.netloc, parts.path.lstrip('/'))
+
+
+def _read_source(source, session):
+    """Bytes of a bundle source or a file it refers to, downloading vendored files on first use"""
+    if not _is_url(source):
+        with open(os.path.join(STATIC_DIR, source), 'rb') as f:
+            return f.read()
+
+    path = _vendor_path(source)
+    if not os.path.exists(path):
+        response = session.get(source, timeout=DOWNLOAD_TIMEOUT)
+        response.raise_for_status()
+        _write_atomic(path, response.content)
+        print(f"Vendored {source}")
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def _write_atomic(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.part')
+    with os.fdopen(fd, 'wb') as tmp:
+        tmp.write(data)
+    os.chmod(tmp_path, 0o644)
+    os.replace(tmp_path, path)
+
+
+def _write_hashed(name, data):
+    """Store `data` in static/dist with a content hash in its name, returns the path relative to static/"""
+    stem, ext = os.path.splitext(name)
+    hashed_name = f'{stem}.{hashlib.sha256(data).hexdigest()[:12]}{ext}'
+    path = os.path.join(STATIC_DIR, DIST_SUBDIR, hashed_name)
+    if not os.path.exists(path):
+        _write_atomic(path, data)
+    return f'{DIST_SUBDIR}/{hashed_name}'
+
+
+def _squeeze_css(code):
+    code = re.sub(r'\s+', ' ', code)
+    code = re.sub(r'\s*([{};,>])\s*', r'\1', code)
+    return re.sub(r':\s+', ':', code).replace(';}', '}')
+
+
+def _drop_comment(match):
+    token = match.group(0)
+    return '' if token.startswith('/*') and not token.startswith('/*!') else token
+
+
+def minify_css(css):
+    """Drop comments (except /*! license headers */) and the whitespace around CSS punctuation.
+
+    Quoted strings (``content: "a, b"``, font names) and license headers are
+    kept as they are.
+    """
+    # Comments go first, so the code on either side of one is squeezed as one piece
+    css = CSS_TOKEN_RE.sub(_drop_comment, css)
+    parts = []
+    position = 0
+    for match in CSS_TOKEN_RE.finditer(css):
+        parts.append(_squeeze_css(css[position:match.start()]))
+        parts.append(match.group(0))
+        position = match.end()
+    parts.append(_squeeze_css(css[position:]))
+    return ''.join(parts).strip()
+
+
+def minify_js(js):
+    """Drop source map references; the vendored scripts are minified upstream"""
+    return SOURCE_MAP_RE.sub('', js).strip()
+
+
+def _inline_css_urls(css, source, session):
+    """Copy the fonts and images `css` refers to into static/dist, returns the CSS pointing at the copies"""
+    def replace(match):
+        reference = match.group(2).strip()
+        if reference.startswith(('data:', '#', '/')) or _is_url(reference):
+            return match.group(0)
+        target = reference.split('#')[0].split('?')[0]
+        if _is_url(source):
+            target = urllib.parse.urljoin(source, target)
+        else:
+            target = os.path.normpath(os.path.join(os.path.dirname(source), target))
+        fragment = reference[len(reference.split('#')[0]):]
+        copied = _write_hashed(os.path.basename(urllib.parse.urlsplit(target).path),
+                               _read_source(target, session))
+        return f'url({os.path.basename(copied)}{fragment})'
+
+    return CSS_URL_RE.sub(replace, css)
+
+
+def build_bundles(session=None):
+    """Write every bundle to static/dist, returns the manifest (bundle name -> path relative to static/)"""
+    if session is None:
+        from covers import new_session
+        session = new_session()
+
+    manifest = {}
+    for name, sources in BUNDLES.items():
+        parts = []
+        for source in sources:
+            text = _read_source(source, session).decode('utf-8')
+            if name.endswith('.css'):
+                parts.append(minify_css(_inline_css_urls(text, source, session)))
+            else:
+                parts.append(minify_js(text))
+        separator = '\n' if name.endswith('.css') else ';\n'
+        manifest[name] = _write_hashed(name, separator.join(parts).encode('utf-8'))
+
+    _write_atomic(MANIFEST_PATH, json.dumps(manifest, indent=2).encode('utf-8'))
+    return manifest
+
+
+def precompile_templates(app):
+    """Compile every template into the bytecode cache, returns the number of templates"""
+    env = app.jinja_env
+    if env.bytecode_cache is None:
+        return 0
+    names = env.list_templates()
+    for name in names:
+        env.get_template(name)
+    return len(names)
+
+
+def load_manifest():
+    """Reload static/dist/manifest.json (no bundles if it was never built)"""
+    global _manifest
+    try:
+        with open(MANIFEST_PATH) as f:
+            _manifest = json.load(f)
+    except (OSError, ValueError):
+        _manifest = {}
+    return _manifest
+
+
+def asset_url(name):
+    """URL of a built bundle, or None if `flask build` has not been run"""
+    path = _manifest.get(name)
+    return url_for('static', filename=path) if path else None
+
+
+def init_app(app):
+    """Use the template bytecode cache and the built bundles, if any"""
+    cache_dir = app.config['TEMPLATE_CACHE_DIR']
+    if cache_dir:
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+        except OSError as e:
+            print(f"Template cache disabled, cannot create {cache_dir}: {e}")
+        else:
+            app.jinja_env.bytecode_cache = FileSystemBytecodeCache(cache_dir)
+
+    load_manifest()
+    app.add_template_global(asset_url)
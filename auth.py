@@ -0,0 +1,134 @@
+"""Login throttling, and password checks that cannot tie up the workers.
+
+Checking a password hash is slow on purpose: about half a second of CPU for
+Werkzeug's default PBKDF2. A burst of login attempts could otherwise keep
+every worker busy hashing while pages wait. Two things bound that:
+
+- Throttling. Every login attempt is counted as failed per username and
+  client address, and per client address, in ``login_failures`` (migration
+  10), which all workers share, before its hash is checked, so a burst of
+  concurrent attempts cannot all slip past the limit. Once either count
+  reaches its limit (``LOGIN_MAX_FAILURES_PER_USER``,
+  ``LOGIN_MAX_FAILURES_PER_IP``) within ``LOGIN_THROTTLE_WINDOW`` seconds of
+  the first failure, further attempts are refused before any hashing until
+  the window is over. The username is counted together with the address so
+  that someone guessing a reader's password locks out only themselves, not
+  the reader. A successful login takes its attempt back and clears its
+  username's count from that address.
+- A bounded executor. Hashes are checked on ``LOGIN_HASH_WORKERS`` threads
+  per process, with at most ``LOGIN_HASH_QUEUE`` more attempts waiting. An
+  attempt that finds the queue full is turned away at once (``LoginBusy``)
+  instead of holding a request thread, so pages keep their threads and CPU.
+
+After a successful login, a hash made with other parameters than
+``PASSWORD_HASH_METHOD`` is replaced with a fresh one. Logged-in requests
+never touch the hash: Flask-Login keeps the username in the signed session.
+"""
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+THROTTLE_QUERY = '''
+    SELECT scope, failures, window_start FROM login_failures
+    WHERE (scope = 'user' AND key = ?) OR (scope = 'ip' AND key = ?)
+'''
+RECORD_FAILURE_SQL = '''
+    INSERT INTO login_failures (scope, key, window_start, failures) VALUES (?, ?, ?, 1)
+    ON CONFLICT (scope, key) DO UPDATE SET failures = failures + 1
+'''
+
+# (pid, executor, slots) of this process; workers forked from a preloading master make their own
+_checker = None
+_checker_lock = threading.Lock()
+
+# Hash method -> the "method:parameters" prefix Werkzeug writes for it today
+_current_prefixes = {}
+
+
+class LoginBusy(Exception):
+    """Too many password checks are already running or waiting in this process"""
+
+
+def _user_key(username, address):
+    # Addresses hold no '@', so the last one separates the two
+    return f'{username}@{address}'
+
+
+def throttle_wait(cursor, config, username, address, now=None):
+    """Seconds until `username` may try to log in again from `address` (0 if it may now)"""
+    now = now or time.time()
+    window = config['LOGIN_THROTTLE_WINDOW']
+    limits = {'user': config['LOGIN_MAX_FAILURES_PER_USER'], 'ip': config['LOGIN_MAX_FAILURES_PER_IP']}
+    wait = 0
+    for scope, failures, window_start in cursor.execute(THROTTLE_QUERY, (_user_key(username, address), address)).fetchall():
+        if limits[scope] and failures >= limits[scope] and window_start > now - window:
+            wait = max(wait, window_start + window - now)
+    return wait
+
+
+def record_failure(cursor, config, username, address, now=None):
+    """Count a login attempt against the username from `address` and the address; the caller commits"""
+    now = now or time.time()
+    # Windows that ran out start over with this failure
+    cursor.execute('DELETE FROM login_failures WHERE window_start <= ?', (now - config['LOGIN_THROTTLE_WINDOW'],))
+    for scope, key in (('user', _user_key(username, address)), ('ip', address)):
+        cursor.execute(RECORD_FAILURE_SQL, (scope, key, now))
+
+
+def clear_failures(cursor, username, address):
+    """Take back a successful login's attempt and forget the username's failures from its address.
+
+    The caller commits.
+    """
+    cursor.execute("DELETE FROM login_failures WHERE scope = 'user' AND key = ?", (_user_key(username, address),))
+    cursor.execute("UPDATE login_failures SET failures = failures - 1 WHERE scope = 'ip' AND key = ?", (address,))
+
+
+def hash_password(config, password):
+    """Hash a new password with PASSWORD_HASH_METHOD"""
+    return generate_password_hash(password, method=config['PASSWORD_HASH_METHOD'])
+
+
+def _current_prefix(method):
+    if method not in _current_prefixes:
+        # Werkzeug fills in the default parameters, one (slow) hash per process tells which
+        _current_prefixes[method] = generate_password_hash('', method=method).split('$', 1)[0]
+    return _current_prefixes[method]
+
+
+def _check(password_hash, password, method):
+    if not check_password_hash(password_hash, password):
+        return False, None
+    if method is None or password_hash.split('$', 1)[0] == _current_prefix(method):
+        return True, None
+    return True, generate_password_hash(password, method=method)
+
+
+def _get_checker(config):
+    global _checker
+    with _checker_lock:
+        if _checker is None or _checker[0] != os.getpid():
+            workers = config['LOGIN_HASH_WORKERS']
+            _checker = (os.getpid(), ThreadPoolExecutor(workers, thread_name_prefix='password-check'),
+                        threading.BoundedSemaphore(workers + config['LOGIN_HASH_QUEUE']))
+        return _checker
+
+
+def check_password(config, password_hash, password, rehash=True):
+    """Check a password on the bounded executor, returns (valid, new hash or None).
+
+    The new hash is set when the password is right but `password_hash` was
+    made with outdated parameters (and `rehash` is true). Raises LoginBusy
+    instead of waiting when the executor's queue is full.
+    """
+    _, executor, slots = _get_checker(config)
+    if not slots.acquire(blocking=False):
+        raise LoginBusy
+    try:
+        method = config['PASSWORD_HASH_METHOD'] if rehash else None
+        return executor.submit(_check, password_hash, password, method).result()
+    finally:
+        slots.release()
@@ -0,0 +1,300 @@
+"""Online snapshots, restore, and a portable export of the reading data.
+
+``snapshot()`` copies the live database with SQLite's backup API
+(``sqlite3.Connection.backup``), ``BACKUP_PAGES_PER_STEP`` pages at a time
+with a short pause in between. Each step is one short read transaction,
+so requests keep reading and writing throughout, and nothing ever copies
+the file while gunicorn writes to it. SQLite restarts a backup whose source
+was written by another connection mid-copy; after ``MAX_RESTARTS`` of those
+the rest is copied in one step, which in WAL mode still only holds a read
+snapshot. Snapshots are checked with ``PRAGMA quick_check`` before they
+are given their final name (``reading_challenge-20250101T030000Z.db``) in
+``BACKUP_DIR``; ``prune()`` keeps the newest ``BACKUP_KEEP``. With
+``BACKUP_INTERVAL_HOURS`` set, ``start_scheduler()`` queues a snapshot as a
+``backup`` job whenever the last one is older than that, so only one
+worker takes it.
+
+``restore_snapshot()`` copies a snapshot back into the live database with
+the same API, in a single step, so other connections see either the old
+data or the restored data, never a mix. It snapshots the current database
+first, migrates the restored schema if it is older, and moves the data
+version past its current value so no cached page survives.
+
+``export_data()`` writes books, readers, reviews and reading progress to a
+gzipped JSON file, keyed by book key and username instead of row ids, and
+``import_data()`` merges such a file into any database without duplicating
+what is already there.
+"""
+import contextlib
+import gzip
+import json
+import os
+import re
+import sqlite3
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+
+import db
+from jobs import enqueue_job, run_pending_jobs
+
+# Backups restarted this often (the source keeps changing) finish in one step
+MAX_RESTARTS = 5
+
+# How often the scheduler checks whether a snapshot is due
+SCHEDULE_CHECK_SECONDS = 300
+
+EXPORT_FORMAT = 'reading-challenge-export'
+EXPORT_VERSION = 1
+
+# Book columns worth keeping; counts and ratings are derived, local cover files are re-fetched
+BOOK_FIELDS = ('book_key', 'title', 'author', 'year', 'order_index', 'cover_url', 'isbn', 'page_count',
+               'subjects', 'ol_key', 'metadata_source', 'enriched_at')
+# Looked-up metadata an import fills in where the existing book has none
+METADATA_FIELDS = ('cover_url', 'isbn', 'page_count', 'subjects', 'ol_key', 'metadata_source', 'enriched_at')
+READER_FIELDS = ('username', 'name', 'password_hash', 'created_at')
+
+
+class _TooManyRestarts(Exception):
+    pass
+
+
+def _snapshot_re(db_path):
+    stem = os.path.splitext(os.path.basename(db_path))[0]
+    return re.compile(rf'^{re.escape(stem)}-(\d{{8}}T\d{{6}}Z)(-[a-z-]+)?\.db$')
+
+
+def _snapshot_name(db_path, label=None):
+    stem = os.path.splitext(os.path.basename(db_path))[0]
+    stamp = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+    return f'{stem}-{stamp}-{label}.db' if label else f'{stem}-{stamp}.db'
+
+
+def list_snapshots(backup_dir, db_path):
+    """Snapshots of `db_path` in `backup_dir`, newest first"""
+    pattern = _snapshot_re(db_path)
+    try:
+        names = os.listdir(backup_dir)
+    except FileNotFoundError:
+        return []
+    matches = [match for match in map(pattern.match, names) if match]
+    matches.sort(key=lambda match: match.group(1), reverse=True)
+    return [os.path.join(backup_dir, match.group(0)) for match in matches]
+
+
+def copy_database(source, target, pages=-1, pause=0.0):
+    """Copy `source` into `target` with the backup API, `pages` per step; returns the restarts seen"""
+    state = {'remaining': None, 'restarts': 0}
+
+    def progress(status, remaining, total):
+        # Remaining pages only go up when SQLite started over
+        if state['remaining'] is not None and remaining > state['remaining']:
+            state['restarts'] += 1
+            if state['restarts'] > MAX_RESTARTS:
+                raise _TooManyRestarts
+        state['remaining'] = remaining
+        if remaining and pause:
+            time.sleep(pause)
+
+    try:
+        source.backup(target, pages=pages, progress=progress)
+    except _TooManyRestarts:
+        source.backup(target)
+    return state['restarts']
+
+
+def snapshot(db_path, backup_dir, pages=256, pause=0.005, label=None):
+    """Copy the live database into `backup_dir`, returns (snapshot path, pages copied, restarts)"""
+    os.makedirs(backup_dir, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=backup_dir, suffix='.part')
+    os.close(fd)
+    try:
+        source = db.connect(db_path)
+        target = sqlite3.connect(tmp_path)
+        try:
+            restarts = copy_database(source, target, pages=pages, pause=pause)
+            # A snapshot is a single self-contained file
+            target.execute('PRAGMA journal_mode = DELETE')
+            check = target.execute('PRAGMA quick_check').fetchone()[0]
+            if check != 'ok':
+                raise RuntimeError(f'snapshot failed its integrity check: {check}')
+            page_count = target.execute('PRAGMA page_count').fetchone()[0]
+        finally:
+            target.close()
+            source.close()
+        path = os.path.join(backup_dir, _snapshot_name(db_path, label))
+        os.replace(tmp_path, path)
+    except BaseException:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(tmp_path)
+        raise
+    return path, page_count, restarts
+
+
+def prune(backup_dir, db_path, keep):
+    """Delete all but the newest `keep` snapshots, returns the paths removed"""
+    removed = list_snapshots(backup_dir, db_path)[keep:]
+    for path in removed:
+        os.remove(path)
+    return removed
+
+
+def restore_snapshot(db_path, snapshot_path, backup_dir):
+    """Replace the live database's content with a snapshot, returns the snapshot taken of it first"""
+    source = sqlite3.connect(f'file:{os.path.abspath(snapshot_path)}?mode=ro', uri=True)
+    try:
+        check = source.execute('PRAGMA quick_check').fetchone()[0]
+        if check != 'ok':
+            raise ValueError(f'{snapshot_path} failed its integrity check: {check}')
+        if source.execute('PRAGMA user_version').fetchone()[0] > db.SCHEMA_VERSION:
+            raise ValueError(f'{snapshot_path} was written by a newer version of the app')
+
+        safety_path, _, _ = snapshot(db_path, backup_dir, label='pre-restore')
+        live = db.connect(db_path, isolation_level=None)
+        try:
+            data_version = db.get_data_version(live.cursor())
+            # One step: other connections switch from the old data to the restored data at once
+            copy_database(source, live)
+            db.create_schema(live)
+            cursor = live.cursor()
+            cursor.execute('BEGIN IMMEDIATE')
+            try:
+                # Past both versions, so no cache keyed on either survives
+                cursor.execute("UPDATE app_meta SET value = MAX(value, ?) WHERE key = 'data_version'",
+                               (data_version,))
+                db.bump_data_version(cursor)
+                # Every book page may differ from the restored data
+                cursor.execute('''
+                    INSERT INTO static_export_pending (book_id) SELECT id FROM books WHERE true
+                    ON CONFLICT (book_id) DO UPDATE SET seq = seq + 1
+                ''')
+                cursor.execute('COMMIT')
+            except Exception:
+                cursor.execute('ROLLBACK')
+                raise
+        finally:
+            live.close()
+    finally:
+        source.close()
+    return safety_path
+
+
+def export_data(conn, path):
+    """Write books, readers, reviews and reading progress to a gzipped JSON file, returns the row counts"""
+    # One read transaction, so the export is consistent even while others write
+    conn.execute('BEGIN')
+    try:
+        data = {
+            'format': EXPORT_FORMAT,
+            'version': EXPORT_VERSION,
+            'exported_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'books': _rows(conn, f"SELECT {', '.join(BOOK_FIELDS)} FROM books ORDER BY order_index, id"),
+            'readers': _rows(conn, f"SELECT {', '.join(READER_FIELDS)} FROM readers ORDER BY id"),
+            'reviews': _rows(conn, '''
+                SELECT b.book_key, r.reader, r.rating, r.review, r.date_added
+                FROM reviews r JOIN books b ON b.id = r.book_id ORDER BY r.id
+            '''),
+            'progress': _rows(conn, '''
+                SELECT b.book_key, rd.username AS reader, rp.read_at
+                FROM reading_progress rp
+                JOIN books b ON b.id = rp.book_id
+                JOIN readers rd ON rd.id = rp.reader_id
+                ORDER BY rp.reader_id, rp.book_id
+            '''),
+        }
+    finally:
+        conn.execute('COMMIT')
+
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix='.part')
+    with os.fdopen(fd, 'wb') as raw, gzip.GzipFile(fileobj=raw, mode='wb') as f:
+        f.write(json.dumps(data, ensure_ascii=False).encode('utf-8'))
+    os.replace(tmp_path, path)
+    return {name: len(data[name]) for name in ('books', 'readers', 'reviews', 'progress')}
+
+
+def _rows(conn, sql):
+    cursor = conn.execute(sql)
+    columns = [column[0] for column in cursor.description]
+    return [dict(zip(columns, row)) for row in cursor]
+
+
+def import_data(cursor, path):
+    """Merge an export into the database, returns the rows added per table; the caller commits.
+
+    Books are matched by book key and readers by username. Existing rows are
+    kept (an existing book only gains metadata it lacks), reviews identical
+    to one already stored and progress already recorded are skipped, so
+    importing the same file twice adds nothing.
+    """
+    with gzip.open(path, 'rb') as f:
+        data = json.loads(f.read())
+    if data.get('format') != EXPORT_FORMAT or data.get('version') != EXPORT_VERSION:
+        raise ValueError(f'{path} is not a version {EXPORT_VERSION} export')
+    added = dict.fromkeys(('books', 'readers', 'reviews', 'progress'), 0)
+
+    for reader in data['readers']:
+        cursor.execute('''
+            INSERT INTO readers (username, name, password_hash, created_at)
+            VALUES (?, ?, ?, COALESCE(?, CURRENT_TIMESTAMP))
+            ON CONFLICT (username) DO NOTHING
+        ''', [reader[field] for field in READER_FIELDS])
+        added['readers'] += cursor.rowcount
+    reader_ids = dict(cursor.execute('SELECT username, id FROM readers').fetchall())
+
+    book_ids = dict(cursor.execute('SELECT book_key, id FROM books').fetchall())
+    for book in data['books']:
+        book_id = book_ids.get(book['book_key'])
+        if book_id is None:
+            cursor.execute(f"INSERT INTO books ({', '.join(BOOK_FIELDS)}) VALUES ({', '.join('?' * len(BOOK_FIELDS))})",
+                           [book[field] for field in BOOK_FIELDS])
+            book_ids[book['book_key']] = cursor.lastrowid
+            added['books'] += 1
+        elif any(book[field] is not None for field in METADATA_FIELDS):
+            cursor.execute(f'''
+                UPDATE books SET {', '.join(f'{field} = COALESCE({field}, ?)' for field in METADATA_FIELDS)}
+                WHERE id = ? AND ({' OR '.join(f'{field} IS NULL' for field in METADATA_FIELDS)})
+            ''', [book[field] for field in METADATA_FIELDS] + [book_id])
+
+    stored = set(cursor.execute('SELECT book_id, reader, rating, review, date_added FROM reviews').fetchall())
+    for review in data['reviews']:
+        book_id = book_ids.get(review['book_key'])
+        row = (book_id, review['reader'], review['rating'], review['review'], review['date_added'])
+        if book_id is None or row in stored:
+            continue
+        cursor.execute('INSERT INTO reviews (book_id, reader, rating, review, date_added) VALUES (?, ?, ?, ?, ?)',
+                       row)
+        stored.add(row)
+        added['reviews'] += 1
+
+    for progress in data['progress']:
+        book_id = book_ids.get(progress['book_key'])
+        reader_id = reader_ids.get(progress['reader'])
+        if book_id is None or reader_id is None:
+            continue
+        cursor.execute('INSERT OR IGNORE INTO reading_progress (reader_id, book_id, read_at) VALUES (?, ?, ?)',
+                       (reader_id, book_id, progress['read_at']))
+        added['progress'] += cursor.rowcount
+
+    if any(added.values()):
+        db.bump_data_version(cursor)
+    return added
+
+
+def _schedule_loop(db_path, interval, handler):
+    while True:
+        try:
+            # The jobs table makes sure only one worker snapshots per interval
+            enqueue_job(db_path, 'backup', min_interval=interval)
+            run_pending_jobs(db_path, 'backup', handler)
+        except Exception as e:
+            print(f"Backup scheduler: {e}")
+        time.sleep(min(interval, SCHEDULE_CHECK_SECONDS))
+
+
+def start_scheduler(db_path, interval, handler):
+    """Run `handler(progress)` as a backup job whenever the last one is `interval` seconds old"""
+    thread = threading.Thread(target=_schedule_loop, args=(db_path, interval, handler),
+                              name='backup-scheduler', daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+
+"""
+Backup latency benchmark.
+
+Builds a large synthetic database (as bench_routes.py does), serves it with
+gunicorn and keeps several client threads requesting homepages and book
+pages while a writer marks a book read every 100 ms (so pages keep being
+re-rendered and the source of the backup keeps changing). It measures
+request latency with no backup running, while snapshots are taken back to
+back in batches of --pages pages with --pause seconds between steps (the
+app's default), while they are taken in one step, and with no backup
+again. It reports p50, p95
+and p99 latency per phase, plus snapshot count, duration and restarts.
+
+    python benchmarks/bench_backup.py --books 100000 --seconds 20
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import tempfile
+import threading
+import time
+
+import requests
+
+import common  # noqa: F401  (puts the repo on sys.path)
+from common import summarize
+
+import backups  # noqa: E402
+from bench_routes import PASSWORD, build_db, gunicorn_server  # noqa: E402
+
+
+def snapshot_loop(path, backup_dir, pages, pause, stop, queue):
+    """Child process: take snapshots back to back until `stop` is set"""
+    results = []
+    while not stop.is_set():
+        start = time.perf_counter()
+        snapshot_path, page_count, restarts = backups.snapshot(path, backup_dir, pages=pages, pause=pause)
+        results.append((time.perf_counter() - start, page_count, restarts))
+        os.remove(snapshot_path)
+    queue.put(results)
+
+
+def run_phase(base_url, books, seconds, concurrency):
+    """Request pages from `concurrency` threads for `seconds`, returns (latencies, books marked read)"""
+    latencies = []
+    marked = []
+    lock = threading.Lock()
+    deadline = time.monotonic() + seconds
+
+    def reader(index):
+        rng = random.Random(index)
+        session = requests.Session()
+        local = []
+        while time.monotonic() < deadline:
+            url = rng.choice(('/', f'/book/{rng.randint(1, books)}', '/?filter=unread&century=20th'))
+            start = time.perf_counter()
+            session.get(base_url + url).raise_for_status()
+            local.append(time.perf_counter() - start)
+        with lock:
+            latencies.extend(local)
+
+    def writer():
+        rng = random.Random(-1)
+        session = requests.Session()
+        session.post(f'{base_url}/login', data={'username': 's', 'password': PASSWORD})
+        while time.monotonic() < deadline:
+            response = session.get(f'{base_url}/mark_read/{rng.randint(1, books)}/s', allow_redirects=False)
+            marked.append(response.status_code == 302)
+            time.sleep(0.1)
+
+    threads = [threading.Thread(target=reader, args=(i,)) for i in range(concurrency)]
+    threads.append(threading.Thread(target=writer))
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, sum(marked)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('--books', type=int, default=100000)
+    parser.add_argument('--seconds', type=float, default=20, help='length of each phase')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--pages', type=int, default=256, help='pages per backup step')
+    parser.add_argument('--pause', type=float, default=0.005, help='seconds between backup steps')
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--threads', type=int, default=4)
+    args = parser.parse_args()
+
+    # No backup both first and last, to tell drift on the machine from the backups' effect
+    phases = (('no backup', None), (f'{args.pages} pages/step', (args.pages, args.pause)), ('one step', (-1, 0)),
+              ('no backup again', None))
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'bench.db')
+        backup_dir = os.path.join(tmp, 'backups')
+        build_db(path, args.books, reviews_per_book=2, readers=20, read_share=0.3)
+        print(f"{args.books} books, {os.path.getsize(path) / 1024 / 1024:.0f} MiB, "
+              f"{args.concurrency} client threads + 1 writer, {args.seconds:.0f} s per phase")
+        print(f"{'phase':>16} {'requests':>9} {'writes':>7} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} "
+              f"{'snapshots':>10} {'s each':>7} {'restarts':>9}")
+
+        with gunicorn_server(path, args.workers, args.threads) as base_url:
+            # Warm the workers' page caches and connections first, so the first phase is not penalised
+            run_phase(base_url, args.books, args.seconds / 2, args.concurrency)
+            for label, backup in phases:
+                stop, queue, process = multiprocessing.Event(), multiprocessing.Queue(), None
+                if backup:
+                    process = multiprocessing.Process(target=snapshot_loop,
+                                                      args=(path, backup_dir, *backup, stop, queue))
+                    process.start()
+                latencies, marked = run_phase(base_url, args.books, args.seconds, args.concurrency)
+                snapshots = []
+                if process:
+                    stop.set()
+                    snapshots = queue.get()
+                    process.join()
+
+                stats = summarize(latencies)
+                each = sum(s[0] for s in snapshots) / len(snapshots) if snapshots else 0.0
+                print(f"{label:>16} {len(latencies):>9} {marked:>7} {stats['p50_ms']:>8.1f} {stats['p95_ms']:>8.1f} "
+                      f"{stats['p99_ms']:>8.1f} {len(snapshots):>10} {each:>7.2f} "
+                      f"{sum(s[2] for s in snapshots):>9}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+
+"""
+Cover fetch benchmark.
+
+Enriches a synthetic book list against a local stub Open Library server
+through ``enrichment.enrich_books``, one book per request, first serially and
+then with increasing concurrency. Serial time grows as n x latency; the
+pooled HTTP client should approach n / concurrency.
+
+    python benchmarks/bench_cover_fetch.py --books 200 --latency 0.05
+"""
+import argparse
+import contextlib
+import io
+import os
+import tempfile
+import time
+
+import common  # noqa: F401  (puts the repo on sys.path)
+
+import db  # noqa: E402
+from bench_routes import build_db  # noqa: E402
+from enrichment import HttpClient, OpenLibraryProvider, enrich_books  # noqa: E402
+from stub_openlibrary import StubOpenLibrary  # noqa: E402
+
+
+def build_books(path, count):
+    """A fresh database of `count` books at `path`, returns their (id, title, author) rows"""
+    build_db(path, count, reviews_per_book=0, readers=2, read_share=0)
+    conn = db.connect(path)
+    rows = conn.execute('SELECT id, title, author FROM books').fetchall()
+    conn.close()
+    return rows
+
+
+def run(stub, db_path, count, concurrency):
+    books = build_books(db_path, count)
+    start = time.perf_counter()
+    with HttpClient(concurrency=concurrency, rate_limit=0, retries=0) as http, \
+            contextlib.redirect_stdout(io.StringIO()):
+        providers = [OpenLibraryProvider(http, stub.search_url, batch_size=1)]
+        updated = enrich_books(db_path, books, providers, chunk_size=len(books))
+    return time.perf_counter() - start, updated
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('--books', type=int, default=200)
+    parser.add_argument('--latency', type=float, default=0.05, help='stub response delay in seconds')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 8, 16, 32])
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp, StubOpenLibrary(args.latency) as stub:
+        print(f"{args.books} books, {args.latency * 1000:.0f} ms stub latency")
+        print(f"{'concurrency':>12} {'seconds':>9} {'expected':>9} {'speedup':>8} {'updated':>8}")
+        baseline = None
+        for concurrency in args.concurrency:
+            elapsed, updated = run(stub, os.path.join(tmp, f'bench{concurrency}.db'), args.books, concurrency)
+            baseline = baseline or elapsed
+            expected = args.books * args.latency / concurrency
+            print(f"{concurrency:>12} {elapsed:>9.2f} {expected:>9.2f} {baseline / elapsed:>7.1f}x {updated:>8}")
+
+
+if __name__ == '__main__':
+    main()
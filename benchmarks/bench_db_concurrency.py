@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+
+"""
+Reader/writer concurrency benchmark.
+
+Reader processes run the homepage book query in a loop while a writer
+process keeps committing large cover-update transactions, holding each one
+open across simulated network waits the way /fetch_covers used to. The run
+is repeated with the old default rollback journal and with the tuned
+connections from db.connect() (WAL). With the rollback journal readers
+stall until the writer commits; under WAL their latency stays flat.
+
+    python benchmarks/bench_db_concurrency.py --books 5000 --seconds 5
+"""
+import argparse
+import multiprocessing
+import os
+import sqlite3
+import tempfile
+import time
+
+import common  # noqa: F401  (puts the repo on sys.path)
+from common import summarize
+
+import db  # noqa: E402
+from bench_routes import build_db  # noqa: E402
+
+READ_QUERY = 'SELECT id, title, author, year, read_count, cover_url FROM books ORDER BY order_index'
+
+
+def prepare(path, books, tuned):
+    build_db(path, books, reviews_per_book=0, readers=2, read_share=0)
+    if not tuned:
+        # build_db leaves the file in WAL mode; leave it once, before several processes open it
+        conn = sqlite3.connect(path)
+        conn.execute('PRAGMA journal_mode = DELETE')
+        conn.close()
+
+
+def open_connection(path, tuned):
+    if tuned:
+        return db.connect(path, check_same_thread=False)
+    return sqlite3.connect(path, check_same_thread=False)
+
+
+def reader(path, tuned, stop, results):
+    conn = open_connection(path, tuned)
+    latencies = []
+    errors = 0
+    while not stop.is_set():
+        start = time.perf_counter()
+        try:
+            conn.execute(READ_QUERY).fetchall()
+        except sqlite3.OperationalError:
+            errors += 1
+            continue
+        latencies.append(time.perf_counter() - start)
+    conn.close()
+    results.put((latencies, errors))
+
+
+def writer(path, tuned, stop, books):
+    conn = open_connection(path, tuned)
+    # A small page cache forces the writer to spill to the database file
+    # mid-transaction, which needs an exclusive lock in rollback mode
+    conn.execute('PRAGMA cache_size = 50')
+    generation = 0
+    chunk = max(1, books // 5)
+    while not stop.is_set():
+        generation += 1
+        with conn:
+            # Like the old /fetch_covers: updates interleaved with network waits
+            # inside a single transaction
+            for first in range(1, books + 1, chunk):
+                conn.executemany('UPDATE books SET cover_url = ? WHERE id = ?',
+                                 [(f'https://covers.example/{generation}/{i}.jpg', i)
+                                  for i in range(first, min(first + chunk, books + 1))])
+                time.sleep(0.05)
+        time.sleep(0.01)
+    conn.close()
+
+
+def run(path, tuned, readers, seconds, books):
+    # Separate processes, like gunicorn workers, so the GIL does not skew the numbers
+    stop = multiprocessing.Event()
+    results = multiprocessing.Queue()
+    processes = [multiprocessing.Process(target=reader, args=(path, tuned, stop, results))
+                 for _ in range(readers)]
+    processes.append(multiprocessing.Process(target=writer, args=(path, tuned, stop, books)))
+    for process in processes:
+        process.start()
+    time.sleep(seconds)
+    stop.set()
+
+    latencies = []
+    errors = 0
+    for _ in range(readers):
+        reader_latencies, reader_errors = results.get()
+        latencies.extend(reader_latencies)
+        errors += reader_errors
+    for process in processes:
+        process.join()
+    return summarize(latencies), errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('--books', type=int, default=5000)
+    parser.add_argument('--readers', type=int, default=2)
+    parser.add_argument('--seconds', type=float, default=5)
+    args = parser.parse_args()
+
+    print(f"{args.books} books, {args.readers} readers, 1 writer, {args.seconds}s per mode")
+    print(f"{'mode':>10} {'reads':>7} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8} {'errors':>7}")
+    for label, tuned in (('rollback', False), ('wal', True)):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'bench.db')
+            prepare(path, args.books, tuned)
+            result, errors = run(path, tuned, args.readers, args.seconds, args.books)
+        print(f"{label:>10} {result['count']:>7} {result['p50_ms']:>8.2f} {result['p95_ms']:>8.2f} "
+              f"{result['p99_ms']:>8.2f} {result['max_ms']:>8.2f} {errors:>7}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+
+"""
+Metadata enrichment benchmark.
+
+Enriches a synthetic book list against the local stub servers with the
+enrichment pipeline (batched Open Library OR queries, per-book retries for
+titles the batch did not match, Google Books fallback for books Open
+Library does not know) at several batch sizes; batch size 1 is one search
+request per book. Reports wall time, HTTP round trips per book and how many
+books got each field.
+
+    python benchmarks/bench_enrichment.py --books 500 --latency 0.05
+"""
+import argparse
+import contextlib
+import io
+import os
+import sqlite3
+import tempfile
+import time
+
+import common  # noqa: F401  (puts the repo on sys.path)
+
+import db  # noqa: E402
+from bench_routes import build_db  # noqa: E402
+from enrichment import GoogleBooksProvider, HttpClient, OpenLibraryProvider, enrich_books  # noqa: E402
+from stub_openlibrary import StubOpenLibrary  # noqa: E402
+
+COVERAGE_QUERY = '''
+    SELECT COUNT(cover_url), COUNT(isbn), COUNT(page_count), COUNT(subjects), COUNT(enriched_at) FROM books
+'''
+
+
+def build_books(path, count):
+    """A fresh database of `count` books at `path`, returns their (id, title, author) rows"""
+    build_db(path, count, reviews_per_book=0, readers=2, read_share=0)
+    conn = db.connect(path)
+    rows = conn.execute('SELECT id, title, author FROM books').fetchall()
+    conn.close()
+    return rows
+
+
+def coverage(path):
+    conn = sqlite3.connect(path)
+    counts = conn.execute(COVERAGE_QUERY).fetchone()
+    conn.close()
+    return dict(zip(('cover', 'isbn', 'pages', 'subjects', 'enriched'), counts))
+
+
+def run_enrichment(stub, path, books, concurrency, batch_size):
+    with HttpClient(concurrency=concurrency, rate_limit=0, retries=0) as http:
+        providers = [OpenLibraryProvider(http, stub.search_url, batch_size=batch_size),
+                     GoogleBooksProvider(http, stub.google_url)]
+        enrich_books(path, books, providers, chunk_size=concurrency * batch_size)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('--books', type=int, default=500)
+    parser.add_argument('--latency', type=float, default=0.05, help='stub response delay in seconds')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--batch-size', type=int, nargs='+', default=[1, 5, 10, 20])
+    parser.add_argument('--variant-share', type=float, default=0.1,
+                        help='share of titles the batch query does not match exactly')
+    parser.add_argument('--unknown-share', type=float, default=0.05,
+                        help='share of titles Open Library does not know')
+    args = parser.parse_args()
+
+    runs = [(f'enrich batch={size}',
+              lambda stub, path, books, size=size: run_enrichment(stub, path, books, args.concurrency, size))
+             for size in args.batch_size]
+
+    print(f"{args.books} books, {args.latency * 1000:.0f} ms stub latency, concurrency {args.concurrency}, "
+          f"{args.variant_share:.0%} title variants, {args.unknown_share:.0%} unknown to Open Library")
+    print(f"{'run':>18} {'seconds':>8} {'requests':>9} {'per book':>9} "
+          f"{'cover':>6} {'isbn':>6} {'pages':>6} {'subjects':>9}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for number, (label, run) in enumerate(runs):
+            path = os.path.join(tmp, f'bench{number}.db')
+            books = build_books(path, args.books)
+            with StubOpenLibrary(args.latency, args.variant_share, args.unknown_share) as stub:
+                start = time.perf_counter()
+                with contextlib.redirect_stdout(io.StringIO()):
+                    run(stub, path, books)
+                seconds = time.perf_counter() - start
+                requests_made = stub.request_count
+            found = coverage(path)
+            print(f"{label:>18} {seconds:>8.2f} {requests_made:>9} {requests_made / args.books:>9.2f} "
+                  f"{found['cover']:>6} {found['isbn']:>6} {found['pages']:>6} {found['subjects']:>9}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+
+"""
+Reading history benchmark.
+
+Builds synthetic databases whose reading_events logs hold different numbers
+of marks and unmarks, spread over the last five years, and times the
+history for common ranges (30 days, 26 weeks, 24 months, 10 years) through
+the rollups. For comparison it times the same month counts aggregated
+straight from reading_events, and it times marking a book read and
+unmarking it again (two events) with and without the rollup trigger. The
+rollup times should stay flat as the log grows.
+
+    python benchmarks/bench_history.py --events 10000 100000 300000
+"""
+import argparse
+import os
+import random
+import sqlite3
+import tempfile
+import time
+from datetime import date, timedelta
+
+import common  # noqa: F401  (puts the repo on sys.path)
+from common import summarize
+
+import db  # noqa: E402
+from bench_routes import build_db  # noqa: E402
+from history import get_history  # noqa: E402
+
+TODAY = date(2026, 6, 15)
+RANGES = (('day', 30), ('week', 26), ('month', 24), ('year', 10))
+EVENTS_QUERY = '''
+    SELECT reader_id, strftime('%Y-%m-01', read_at), SUM(CASE event WHEN 'read' THEN 1 ELSE -1 END)
+    FROM reading_events
+    WHERE read_at >= ? AND reader_id IN (SELECT id FROM readers ORDER BY books_read DESC, name LIMIT 6)
+    GROUP BY 1, 2
+'''
+
+
+def add_events(path, events, books, seed=7):
+    """Mark and unmark random books at random dates until the log holds `events` rows"""
+    rng = random.Random(seed)
+    conn = db.connect(path, isolation_level=None)
+    reader_ids = [row[0] for row in conn.execute('SELECT id FROM readers')]
+    days = 5 * 365
+    while conn.execute('SELECT COALESCE(MAX(id), 0) FROM reading_events').fetchone()[0] < events:
+        conn.execute('BEGIN')
+        conn.executemany(
+            'INSERT OR IGNORE INTO reading_progress (reader_id, book_id, read_at) VALUES (?, ?, ?)',
+            ((rng.choice(reader_ids), rng.randint(1, books),
+              f'{TODAY - timedelta(days=rng.randrange(days))} 12:00:00') for _ in range(5000)))
+        conn.executemany('DELETE FROM reading_progress WHERE reader_id = ? AND book_id = ?',
+                         ((rng.choice(reader_ids), rng.randint(1, books)) for _ in range(1500)))
+        conn.execute('COMMIT')
+    conn.execute('ANALYZE')
+    conn.close()
+
+
+def timed(function, repeat):
+    latencies = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        latencies.append(time.perf_counter() - start)
+    return summarize(latencies)
+
+
+def mark_cost(path, books, repeat):
+    """Median ms to mark a book read and unmark it again, in one transaction"""
+    conn = db.connect(path, isolation_level=None)
+    rng = random.Random(3)
+
+    def mark():
+        book_id = rng.randint(1, books)
+        conn.execute('BEGIN')
+        conn.execute("INSERT OR IGNORE INTO reading_progress (reader_id, book_id, read_at) "
+                     "VALUES (1, ?, '2026-06-01 12:00:00')", (book_id,))
+        conn.execute('DELETE FROM reading_progress WHERE reader_id = 1 AND book_id = ?', (book_id,))
+        conn.execute('COMMIT')
+
+    stats = timed(mark, repeat)
+    conn.close()
+    return stats['p50_ms']
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('--events', type=int, nargs='+', default=[10000, 100000, 300000])
+    parser.add_argument('--books', type=int, default=5000)
+    parser.add_argument('--readers', type=int, default=50)
+    parser.add_argument('--repeat', type=int, default=200)
+    args = parser.parse_args()
+
+    print(f"{args.books} books, {args.readers} readers, times in ms (p50 / p95)")
+    print(f"{'events':>8} " + ' '.join(f"{f'{period} x{count}':>14}" for period, count in RANGES)
+          + f" {'events scan':>14} {'mark':>6} {'no rollup':>10}")
+    for events in args.events:
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'bench.db')
+            build_db(path, args.books, reviews_per_book=0, readers=args.readers, read_share=0)
+            add_events(path, events, args.books)
+
+            conn = db.connect(path)
+            cursor = conn.cursor()
+            cells = []
+            for period, count in RANGES:
+                stats = timed(lambda: get_history(cursor, period, current=TODAY), args.repeat)
+                cells.append(f"{stats['p50_ms']:>6.2f} / {stats['p95_ms']:<5.2f}")
+            since = (TODAY.replace(day=1) - timedelta(days=700)).replace(day=1).isoformat()
+            scan = timed(lambda: conn.execute(EVENTS_QUERY, (since,)).fetchall(), max(args.repeat // 10, 5))
+            cells.append(f"{scan['p50_ms']:>6.1f} / {scan['p95_ms']:<5.1f}")
+            conn.close()
+
+            with_rollup = mark_cost(path, args.books, args.repeat)
+            plain = sqlite3.connect(path)
+            plain.execute('DROP TRIGGER reading_events_rollup')
+            plain.close()
+            without_rollup = mark_cost(path, args.books, args.repeat)
+            print(f"{events:>8} " + ' '.join(f'{cell:>14}' for cell in cells)
+                  + f" {with_rollup:>6.2f} {without_rollup:>10.2f}")
+
+
+if __name__ == '__main__':
+    main()
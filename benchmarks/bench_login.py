@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+
+"""
+Login storm benchmark.
+
+Serves a synthetic database with gunicorn and keeps several client threads
+requesting homepages and book pages, first on their own and then while
+attacker threads post wrong passwords for reader "s". Each attacker has its
+own X-Forwarded-For address and sends --rate attempts a second without
+waiting for answers, which is what nginx's limit_req (10r/s per address)
+lets through. Attempts unanswered after 5 seconds count as timeouts.
+This runs against three server setups: the defaults (throttling plus the
+bounded password-check executor), the bounded executor with throttling off,
+and neither, where every attempt is hashed on its request thread as before.
+It reports page latency per phase and what the login attempts got back.
+
+    python benchmarks/bench_login.py --books 10000 --seconds 15
+"""
+import argparse
+import collections
+import os
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from unittest import mock
+
+import requests
+
+import common  # noqa: F401  (puts the repo on sys.path)
+from common import summarize
+
+from bench_routes import build_db, gunicorn_server  # noqa: E402
+
+ATTEMPT_TIMEOUT = 5
+
+SETUPS = (
+    ('throttled + bounded', {}),
+    ('bounded only', {'LOGIN_MAX_FAILURES_PER_USER': '0', 'LOGIN_MAX_FAILURES_PER_IP': '0'}),
+    ('neither', {'LOGIN_MAX_FAILURES_PER_USER': '0', 'LOGIN_MAX_FAILURES_PER_IP': '0',
+                 'LOGIN_HASH_WORKERS': '64', 'LOGIN_HASH_QUEUE': '0'}),
+)
+
+
+def run_phase(base_url, books, seconds, readers, attackers, rate):
+    """Request pages from `readers` threads while `attackers` threads post bad logins"""
+    latencies = []
+    statuses = collections.Counter()
+    lock = threading.Lock()
+    deadline = time.monotonic() + seconds
+
+    def reader(index):
+        rng = random.Random(index)
+        session = requests.Session()
+        local = []
+        while time.monotonic() < deadline:
+            url = rng.choice(('/', f'/book/{rng.randint(1, books)}', '/?filter=unread&century=20th'))
+            start = time.perf_counter()
+            session.get(base_url + url).raise_for_status()
+            local.append(time.perf_counter() - start)
+        with lock:
+            latencies.extend(local)
+
+    def attempt(index):
+        try:
+            response = requests.post(f'{base_url}/login', data={'username': 's', 'password': f'wrong{index}'},
+                                     headers={'X-Forwarded-For': f'10.0.0.{index + 1}'}, allow_redirects=False,
+                                     timeout=ATTEMPT_TIMEOUT)
+            status = response.status_code
+        except requests.Timeout:
+            status = 'timeout'
+        with lock:
+            statuses[status] += 1
+
+    def attacker(index, pool):
+        # Attackers do not wait for answers, every attempt goes out on schedule
+        next_attempt = time.monotonic()
+        while next_attempt < deadline:
+            time.sleep(max(0, next_attempt - time.monotonic()))
+            pool.submit(attempt, index)
+            next_attempt += 1 / rate
+
+    with ThreadPoolExecutor(max(1, int(attackers * rate * ATTEMPT_TIMEOUT))) as pool:
+        threads = [threading.Thread(target=reader, args=(i,)) for i in range(readers)]
+        threads += [threading.Thread(target=attacker, args=(i, pool)) for i in range(attackers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    return latencies, statuses
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('--books', type=int, default=10000)
+    parser.add_argument('--seconds', type=float, default=15, help='length of each phase')
+    parser.add_argument('--readers', type=int, default=4, help='page client threads')
+    parser.add_argument('--attackers', type=int, default=4, help='bad login threads, one address each')
+    parser.add_argument('--rate', type=float, default=10, help='attempts per second per attacker')
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--threads', type=int, default=4)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'bench.db')
+        build_db(path, args.books, reviews_per_book=2, readers=20, read_share=0.3)
+        print(f"{args.books} books, gunicorn {args.workers} workers x {args.threads} threads, "
+              f"{args.readers} page clients, {args.attackers} attackers at {args.rate:g}/s, {args.seconds:.0f} s per phase")
+        print(f"{'setup':>20} {'phase':>9} {'pages':>6} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} "
+              f"{'logins/s':>9}  login responses")
+
+        for label, env in SETUPS:
+            with ExitStack() as stack:
+                stack.enter_context(mock.patch.dict(os.environ, env, TRUSTED_PROXIES='1'))
+                base_url = stack.enter_context(gunicorn_server(path, args.workers, args.threads))
+                # Warm up the workers before measuring
+                run_phase(base_url, args.books, 2, args.readers, 0, args.rate)
+                for phase, attackers in (('quiet', 0), ('storm', args.attackers)):
+                    latencies, statuses = run_phase(base_url, args.books, args.seconds, args.readers, attackers,
+                                                    args.rate)
+                    stats = summarize(latencies)
+                    responses = ', '.join(f'{count} x {status}' for status, count in sorted(statuses.items(), key=str))
+                    print(f"{label:>20} {phase:>9} {len(latencies):>6} {stats['p50_ms']:>8.1f} "
+                          f"{stats['p95_ms']:>8.1f} {stats['p99_ms']:>8.1f} "
+                          f"{sum(statuses.values()) / args.seconds:>9.1f}  {responses or '-'}")
+            # Failures counted by this setup must not throttle the next one
+            conn = sqlite3.connect(path)
+            with conn:
+                conn.execute('DELETE FROM login_failures')
+            conn.close()
+
+
+if __name__ == '__main__':
+    main()
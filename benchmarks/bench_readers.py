@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+
+"""
+Reading group size benchmark.
+
+Builds databases with the same books and a growing number of readers,
+each of whom has finished a random share of the books, then renders the
+homepage, a book page and an API page through the Flask test client as a
+logged-in reader. Before every request another reader marks a book, so
+the response and stats caches are always cold, as in a busy group. Page
+latency should follow the number of books shown and stay flat as the
+group grows.
+
+    python benchmarks/bench_readers.py --books 1000 --readers 2,50,500
+"""
+import argparse
+import contextlib
+import io
+import multiprocessing
+import os
+import random
+import tempfile
+import time
+
+import common  # noqa: F401  (puts the repo on sys.path)
+from common import summarize
+
+import db  # noqa: E402
+from bench_routes import build_db  # noqa: E402
+from readers import mark_book_read  # noqa: E402
+
+PAGES = (
+    ('index', '/'),
+    ('index todo', '/?filter=todo'),
+    ('book', '/book/{book_id}'),
+    ('api books', '/api/books?reader=s&limit=100'),
+)
+
+
+def run(path, books, requests, results):
+    os.environ['DATABASE_PATH'] = path
+    with contextlib.redirect_stdout(io.StringIO()):
+        import app
+
+    rng = random.Random(7)
+    writer = db.connect(path)
+    reader_ids = [row[0] for row in writer.execute('SELECT id FROM readers')]
+    client = app.app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = 's'
+        session['_fresh'] = True
+
+    timings = {}
+    for label, url in PAGES:
+        latencies = []
+        for _ in range(requests):
+            # Someone else marks a book, which invalidates every cache
+            with writer:
+                while not mark_book_read(writer.cursor(), rng.choice(reader_ids), rng.randint(1, books)):
+                    pass
+            start = time.perf_counter()
+            response = client.get(url.format(book_id=rng.randint(1, books)))
+            response.get_data()
+            latencies.append(time.perf_counter() - start)
+            response.close()
+            assert response.status_code == 200, (url, response.status_code)
+        timings[label] = summarize(latencies)
+    writer.close()
+    results.put(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('--books', type=int, default=1000)
+    parser.add_argument('--readers', default='2,50,500', help='comma separated group sizes')
+    parser.add_argument('--read-share', type=float, default=0.4, help='share of the books each reader has read')
+    parser.add_argument('--requests', type=int, default=50, help='requests per page')
+    args = parser.parse_args()
+
+    # A fresh interpreter per database, so the app and its caches start clean
+    context = multiprocessing.get_context('spawn')
+    print(f"{args.books} books, {args.read_share:.0%} read by each reader, {args.requests} requests per page")
+    print(f"{'readers':>8} {'progress rows':>14} {'page':>12} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for readers in (int(value) for value in args.readers.split(',')):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'bench.db')
+            build_db(path, args.books, reviews_per_book=0, readers=readers, read_share=args.read_share)
+            results = context.Queue()
+            process = context.Process(target=run, args=(path, args.books, args.requests, results))
+            process.start()
+            timings = results.get()
+            process.join()
+        rows = readers * int(args.books * args.read_share)
+        for label, result in timings.items():
+            print(f"{readers:>8} {rows:>14} {label:>12} {result['p50_ms']:>8.2f} "
+                  f"{result['p95_ms']:>8.2f} {result['p99_ms']:>8.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,333 @@
+#!/usr/bin/env python3
+
+"""
+Route benchmark and regression check.
+
+Builds synthetic databases of each requested size through the app's own
+schema and migrations (reviews and reading marks in proportion to the
+books), then drives every page: the homepage with each filter x century
+combination, book pages, marking a book read, adding a review, search,
+the leaderboard and the JSON API. Each route is requested through the
+Flask test client, through a real gunicorn process with several client
+threads, or both, logged in as reader "s". It reports p50/p95/p99 latency
+and requests per second, writes the results as JSON and, given a baseline
+file from an earlier run, prints the change per route and exits non-zero
+when a p95 got worse by more than the threshold.
+
+    python benchmarks/bench_routes.py --sizes 1000,10000 --output results.json
+    python benchmarks/bench_routes.py --sizes 1000,10000 --baseline results.json
+
+By default pages are served from the response cache after their first
+request, as in production between writes; --cold bumps the data version
+before every request so each one renders from the database. Building the
+100k-book database takes a couple of minutes (every mark and review goes
+through the real triggers); --db-dir keeps the built databases for the
+next run.
+"""
+import argparse
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import platform
+import random
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+
+import requests
+from werkzeug.security import generate_password_hash
+
+import common  # noqa: F401  (puts the repo on sys.path)
+from common import REPO_ROOT, summarize
+
+import db  # noqa: E402
+from queries import CENTURIES, FILTERS  # noqa: E402
+
+PASSWORD = 'bench'
+WORDS = ('novel', 'moving', 'slow', 'brilliant', 'characters', 'ending', 'prose', 'dull', 'classic',
+         'reread', 'long', 'funny', 'bleak', 'beautiful', 'translation', 'plot')
+
+
+def build_db(path, books, reviews_per_book, readers, read_share):
+    rng = random.Random(42)
+    conn = db.connect(path, isolation_level=None)
+    db.create_schema(conn)
+    conn.execute('BEGIN')
+    conn.executemany(
+        'INSERT INTO books (title, author, year, order_index) VALUES (?, ?, ?, ?)',
+        [(f'{rng.choice(WORDS).title()} {rng.choice(WORDS).title()} {i}', f'Author {i % 500}',
+          1800 + i % 225, i) for i in range(1, books + 1)])
+    # Migration 5 created the two founding readers
+    conn.executemany('INSERT INTO readers (username, name) VALUES (?, ?)',
+                     [(f'reader{i}', f'Reader {i}') for i in range(3, readers + 1)])
+    usernames = [row[0] for row in conn.execute('SELECT username FROM readers')]
+    reader_ids = [row[0] for row in conn.execute('SELECT id FROM readers')]
+    conn.executemany(
+        'INSERT INTO reading_progress (reader_id, book_id, read_at) VALUES (?, ?, CURRENT_TIMESTAMP)',
+        ((reader_id, book_id) for reader_id in reader_ids
+         for book_id in rng.sample(range(1, books + 1), int(books * read_share))))
+    conn.executemany(
+        'INSERT INTO reviews (book_id, reader, rating, review) VALUES (?, ?, ?, ?)',
+        ((rng.randint(1, books), rng.choice(usernames), rng.randint(1, 5),
+          ' '.join(rng.choices(WORDS, k=rng.randint(5, 30)))) for _ in range(books * reviews_per_book)))
+    conn.execute('COMMIT')
+    conn.execute('ANALYZE')
+    conn.close()
+
+
+def route_plan(books):
+    """(label, method, url, form) generators; every call picks a fresh random book"""
+    plan = [(f'index {filter_by} {century}', 'GET',
+             lambda rng, f=filter_by, c=century: f'/?filter={f}&century={c}', None)
+            for filter_by in FILTERS for century in CENTURIES]
+    plan += [
+        ('index by rating', 'GET', lambda rng: '/?sort=rating', None),
+        ('books_fragment', 'GET', lambda rng: f'/books/fragment?after={rng.randint(0, books)}', None),
+        ('books_fragment by rating', 'GET',
+         lambda rng: f'/books/fragment?sort=rating&offset={rng.randint(0, books // 48) * 48}', None),
+        ('book_detail', 'GET', lambda rng: f'/book/{rng.randint(1, books)}', None),
+        ('mark_read', 'GET', lambda rng: f'/mark_read/{rng.randint(1, books)}/s', None),
+        ('add_review', 'POST', lambda rng: f'/add_review/{rng.randint(1, books)}',
+         lambda rng: {'reader': 's', 'rating': rng.randint(1, 5), 'review': ' '.join(rng.choices(WORDS, k=12))}),
+        ('search', 'GET', lambda rng: f'/search?q={rng.choice(WORDS)}', None),
+        ('leaderboard', 'GET', lambda rng: '/leaderboard', None),
+        ('history', 'GET', lambda rng: '/history', None),
+        ('api history', 'GET', lambda rng: f"/api/history?period={rng.choice(('day', 'week', 'month', 'year'))}", None),
+        ('api books', 'GET', lambda rng: f'/api/books?reader=s&after={rng.randint(0, books)}&limit=50', None),
+        ('api stats', 'GET', lambda rng: '/api/stats', None),
+    ]
+    return plan
+
+
+def bump(path):
+    """Invalidate every response and stats cache, as any write would"""
+    conn = sqlite3.connect(path)
+    with conn:
+        db.bump_data_version(conn.cursor())
+    conn.close()
+
+
+def run_route(send, path, method, url, form, requests_per_route, concurrency, cold):
+    """Time `requests_per_route` requests spread over `concurrency` threads"""
+    latencies = []
+    failures = []
+    lock = threading.Lock()
+
+    def worker(index, count):
+        rng = random.Random(index)
+        local = []
+        for _ in range(count):
+            if cold:
+                bump(path)
+            target = url(rng)
+            data = form(rng) if form else None
+            start = time.perf_counter()
+            status = send(index, method, target, data)
+            local.append(time.perf_counter() - start)
+            if status >= 400:
+                with lock:
+                    failures.append((target, status))
+        with lock:
+            latencies.extend(local)
+
+    shares = [requests_per_route // concurrency + (1 if i < requests_per_route % concurrency else 0)
+              for i in range(concurrency)]
+    threads = [threading.Thread(target=worker, args=(i, share)) for i, share in enumerate(shares) if share]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - start
+
+    if failures:
+        raise RuntimeError(f'{len(failures)} failed requests, first: {failures[0]}')
+    result = summarize(latencies)
+    result['rps'] = round(len(latencies) / wall, 1) if wall else 0.0
+    return result
+
+
+def run_plan(send, path, books, requests_per_route, concurrency, cold):
+    results = {}
+    for label, method, url, form in route_plan(books):
+        results[label] = run_route(send, path, method, url, form, requests_per_route, concurrency, cold)
+    return results
+
+
+def run_test_client(path, books, requests_per_route, cold, queue):
+    """Child process entry point: drive the app in-process through the Flask test client"""
+    os.environ['DATABASE_PATH'] = path
+    with contextlib.redirect_stdout(io.StringIO()):
+        import app
+
+    client = app.app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = 's'
+        session['_fresh'] = True
+
+    def send(index, method, url, data):
+        response = client.open(url, method=method, data=data)
+        response.get_data()
+        response.close()
+        return response.status_code
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        queue.put(run_plan(send, path, books, requests_per_route, 1, cold))
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+@contextlib.contextmanager
+def gunicorn_server(path, workers, threads):
+    port = free_port()
+    env = dict(os.environ, DATABASE_PATH=path, FLASK_ENV='development', SECRET_KEY='bench',
+               SILAS_PASSWORD_HASH=generate_password_hash(PASSWORD))
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '--workers', str(workers), '--threads', str(threads),
+         '--bind', f'127.0.0.1:{port}', 'wsgi:app'],
+        cwd=REPO_ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    base_url = f'http://127.0.0.1:{port}'
+    try:
+        deadline = time.monotonic() + 60
+        while True:
+            try:
+                requests.get(f'{base_url}/about', timeout=5)
+                break
+            except requests.RequestException:
+                if process.poll() is not None or time.monotonic() > deadline:
+                    raise RuntimeError('gunicorn did not start')
+                time.sleep(0.2)
+        yield base_url
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def run_gunicorn(path, books, requests_per_route, concurrency, workers, threads, cold):
+    with gunicorn_server(path, workers, threads) as base_url:
+        sessions = []
+        for _ in range(concurrency):
+            session = requests.Session()
+            response = session.post(f'{base_url}/login', data={'username': 's', 'password': PASSWORD},
+                                    allow_redirects=False)
+            if response.status_code != 302:
+                raise RuntimeError('could not log in to the benchmark server')
+            sessions.append(session)
+
+        def send(index, method, url, data):
+            response = sessions[index].request(method, base_url + url, data=data, allow_redirects=False)
+            return response.status_code
+
+        results = run_plan(send, path, books, requests_per_route, concurrency, cold)
+        for session in sessions:
+            session.close()
+        return results
+
+
+def compare(results, baseline, threshold, min_delta_ms):
+    """Print p95 changes against `baseline`, returns the number of regressions"""
+    regressions = 0
+    print(f"\n{'mode':>11} {'books':>7} {'route':>24} {'base p95':>9} {'p95':>9} {'change':>8}")
+    for mode, sizes in results.items():
+        for size, routes in sizes.items():
+            for label, result in routes.items():
+                base = baseline.get(mode, {}).get(size, {}).get(label)
+                if base is None:
+                    continue
+                change = (result['p95_ms'] - base['p95_ms']) / base['p95_ms'] if base['p95_ms'] else 0.0
+                regressed = (change > threshold and result['p95_ms'] - base['p95_ms'] > min_delta_ms)
+                regressions += regressed
+                print(f"{mode:>11} {size:>7} {label:>24} {base['p95_ms']:>9.2f} {result['p95_ms']:>9.2f} "
+                      f"{change:>+8.0%}{'  REGRESSION' if regressed else ''}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('--sizes', default='1000,10000,100000', help='comma separated book counts')
+    parser.add_argument('--reviews-per-book', type=int, default=3)
+    parser.add_argument('--readers', type=int, default=20)
+    parser.add_argument('--read-share', type=float, default=0.3, help='share of the books each reader has read')
+    parser.add_argument('--requests', type=int, default=50, help='requests per route')
+    parser.add_argument('--mode', choices=('testclient', 'gunicorn', 'both'), default='both')
+    parser.add_argument('--workers', type=int, default=2, help='gunicorn workers (as in the Dockerfile)')
+    parser.add_argument('--threads', type=int, default=1, help='gunicorn threads per worker')
+    parser.add_argument('--concurrency', type=int, default=4, help='client threads against gunicorn')
+    parser.add_argument('--cold', action='store_true', help='invalidate the caches before every request')
+    parser.add_argument('--db-dir', help='keep the built databases here and reuse them')
+    parser.add_argument('--output', help='write the results to this JSON file')
+    parser.add_argument('--baseline', help='compare with the results JSON of an earlier run')
+    parser.add_argument('--threshold', type=float, default=0.2, help='p95 slowdown that counts as a regression')
+    parser.add_argument('--min-delta-ms', type=float, default=1.0, help='ignore p95 changes smaller than this')
+    args = parser.parse_args()
+
+    # Read first: --output may overwrite the baseline file
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+
+    modes = ('testclient', 'gunicorn') if args.mode == 'both' else (args.mode,)
+    results = {mode: {} for mode in modes}
+    context = multiprocessing.get_context('spawn')
+    print(f"{'mode':>11} {'books':>7} {'route':>24} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'req/s':>8}")
+    for books in (int(value) for value in args.sizes.split(',')):
+        with tempfile.TemporaryDirectory() as tmp:
+            name = f'bench_{books}_{args.reviews_per_book}_{args.readers}_{args.read_share}.db'
+            template = os.path.join(args.db_dir or tmp, name)
+            if not os.path.exists(template):
+                build_db(template, books, args.reviews_per_book, args.readers, args.read_share)
+            for mode in modes:
+                # Every mode starts from the same data, the write routes change it
+                path = os.path.join(tmp, f'{mode}.db')
+                source, target = sqlite3.connect(template), sqlite3.connect(path)
+                source.backup(target)
+                source.close()
+                target.close()
+                if mode == 'testclient':
+                    queue = context.Queue()
+                    process = context.Process(target=run_test_client,
+                                              args=(path, books, args.requests, args.cold, queue))
+                    process.start()
+                    timings = queue.get()
+                    process.join()
+                else:
+                    timings = run_gunicorn(path, books, args.requests, args.concurrency,
+                                           args.workers, args.threads, args.cold)
+                results[mode][str(books)] = timings
+                for label, result in timings.items():
+                    print(f"{mode:>11} {books:>7} {label:>24} {result['p50_ms']:>8.2f} "
+                          f"{result['p95_ms']:>8.2f} {result['p99_ms']:>8.2f} {result['rps']:>8.1f}")
+
+    if args.output:
+        report = {
+            'created': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'args': vars(args),
+            'results': results,
+        }
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"\nResults written to {args.output}")
+
+    if baseline is not None:
+        regressions = compare(results, baseline, args.threshold, args.min_delta_ms)
+        if regressions:
+            print(f"\n{regressions} routes regressed by more than {args.threshold:.0%}")
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
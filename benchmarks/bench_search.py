@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+
+"""
+Full-text search benchmark.
+
+Builds a synthetic database through the app's own schema and migrations
+(so the FTS5 table and its triggers are the real ones), then times the
+/search query against the LIKE '%...%' scan it replaces, for a handful of
+whole-word and prefix queries. Review text is drawn from a Zipf-distributed
+vocabulary, so the first query is a word nearly every book contains: bm25 has
+to rank all of those matches, which is FTS5's worst case.
+
+    python benchmarks/bench_search.py --books 100000 --reviews 1000000
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+
+import common  # noqa: F401  (puts the repo on sys.path)
+from common import summarize
+
+import db  # noqa: E402
+from search import SEARCH_QUERY, build_match  # noqa: E402
+
+SYLLABLES = ('ka', 'lo', 'ri', 'men', 'tas', 'vor', 'el', 'dun', 'pi', 'sha', 'ber', 'on',
+             'qui', 'tra', 'mo', 'len', 'ga', 'wes')
+
+LIKE_QUERY = '''
+    SELECT b.id, b.title, b.author FROM books b
+    WHERE b.title LIKE ?1 OR b.author LIKE ?1
+       OR EXISTS (SELECT 1 FROM reviews r WHERE r.book_id = b.id AND r.review LIKE ?1)
+    LIMIT 50
+'''
+
+
+def make_vocabulary(rng, size=5000):
+    words = set()
+    while len(words) < size:
+        words.add(''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))))
+    return sorted(words, key=lambda word: rng.random())
+
+
+def build_queries(vocabulary):
+    """A very common word, mid-frequency and rare words, a prefix, two words, title/author hits and a miss"""
+    return (vocabulary[0], vocabulary[100], vocabulary[2000], vocabulary[2000][:4],
+            f'{vocabulary[300]} {vocabulary[301]}', 'tolst', 'war peace', 'xylophone')
+
+
+def build_db(path, books, reviews):
+    rng = random.Random(42)
+    vocabulary = make_vocabulary(rng)
+    # Zipf-like word frequencies, as in real text
+    weights = [1 / rank for rank in range(1, len(vocabulary) + 1)]
+
+    def text(count):
+        return ' '.join(rng.choices(vocabulary, weights, k=count))
+
+    conn = db.connect(path, isolation_level=None)
+    db.create_schema(conn)
+    conn.execute('BEGIN')
+    # Reviews go in before their books: the books insert trigger then indexes each
+    # book's review text once instead of the reviews trigger rewriting it per review
+    conn.executemany(
+        'INSERT INTO reviews (book_id, reader, rating, review) VALUES (?, ?, ?, ?)',
+        ((rng.randint(1, books), rng.choice('sn'), rng.randint(1, 5), text(rng.randint(8, 40)))
+         for _ in range(reviews)))
+    conn.executemany(
+        'INSERT INTO books (id, title, author, year, order_index) VALUES (?, ?, ?, ?, ?)',
+        ((i, text(rng.randint(1, 5)).title(), f'{text(1).title()} {text(1).title()}',
+          1800 + i % 220, i) for i in range(1, books + 1)))
+    conn.executemany('INSERT INTO books (title, author, year, order_index) VALUES (?, ?, ?, ?)',
+                     [('War and Peace', 'Leo Tolstoy', 1869, books + 1),
+                      ('Anna Karenina', 'Leo Tolstoy', 1878, books + 2)])
+    conn.execute('COMMIT')
+    # Merge the FTS segments left by the bulk load into one b-tree
+    conn.execute("INSERT INTO book_search (book_search) VALUES ('optimize')")
+    conn.execute('ANALYZE')
+    conn.close()
+    return vocabulary
+
+
+def time_query(conn, sql, params, repeat):
+    latencies = []
+    rows = 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        rows = len(conn.execute(sql, params).fetchall())
+        latencies.append(time.perf_counter() - start)
+    return summarize(latencies), rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('--books', type=int, default=100000)
+    parser.add_argument('--reviews', type=int, default=1000000)
+    parser.add_argument('--repeat', type=int, default=20, help='runs per FTS query')
+    parser.add_argument('--like-repeat', type=int, default=3, help='runs per LIKE query')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'bench.db')
+        start = time.perf_counter()
+        vocabulary = build_db(path, args.books, args.reviews)
+        print(f"{args.books} books, {args.reviews} reviews, "
+              f"built in {time.perf_counter() - start:.1f}s ({os.path.getsize(path) / 1e6:.0f} MB)")
+
+        conn = db.connect(path)
+        print(f"{'query':>24} {'method':>6} {'rows':>5} {'p50 ms':>9} {'p95 ms':>9} {'max ms':>9}")
+        for text in build_queries(vocabulary):
+            fts, fts_rows = time_query(conn, SEARCH_QUERY, (build_match(text), 50), args.repeat)
+            like, like_rows = time_query(conn, LIKE_QUERY, (f'%{text}%',), args.like_repeat)
+            for method, result, rows in (('fts', fts, fts_rows), ('like', like, like_rows)):
+                print(f"{text:>24} {method:>6} {rows:>5} {result['p50_ms']:>9.2f} "
+                      f"{result['p95_ms']:>9.2f} {result['max_ms']:>9.2f}")
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+
+"""
+Cold-start benchmark.
+
+Starts the app in fresh Python processes, as a new gunicorn worker or a
+restarted container would, and times importing it (including
+``initialize_app()`` against an existing database) and the first requests
+to the homepage, a book page and the login page, which compile their
+templates. Each run is repeated with an empty template cache and with the
+templates precompiled by ``flask build``, and reports whether ``requests``
+was loaded at startup.
+
+    python benchmarks/bench_startup.py --runs 10
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+import common  # noqa: F401  (puts the repo on sys.path)
+from common import REPO_ROOT, summarize
+
+# Runs in the child process; prints one JSON line of timings in seconds
+CHILD = '''
+import json, sys, time
+started = time.perf_counter()
+import app
+imported = time.perf_counter()
+client = app.app.test_client()
+timings = {'import': imported - started}
+for label, url in (('first /', '/'), ('first /book/1', '/book/1'), ('first /login', '/login'), ('second /', '/')):
+    start = time.perf_counter()
+    response = client.get(url, headers={'Cache-Control': 'no-cache'})
+    assert response.status_code == 200, (url, response.status_code)
+    timings[label] = time.perf_counter() - start
+timings['total'] = time.perf_counter() - started
+print(json.dumps({'timings': timings, 'requests_loaded': 'requests' in sys.modules}))
+'''
+
+
+def run_child(env):
+    output = subprocess.run([sys.executable, '-c', CHILD], cwd=REPO_ROOT, env=env, check=True,
+                            capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('--runs', type=int, default=10, help='fresh processes per mode')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ, DATABASE_PATH=os.path.join(tmp, 'bench.db'),
+                   COVER_CACHE_PATH=os.path.join(tmp, 'cover_cache.db'),
+                   SILAS_PASSWORD_HASH='unused', NADINE_PASSWORD_HASH='unused',
+                   OPENLIBRARY_API_URL='http://127.0.0.1:9/search.json', COVER_FETCH_RETRIES='0')
+        # First start creates and loads the database, later ones only check it
+        run_child(dict(env, TEMPLATE_CACHE_DIR=''))
+
+        cache_dir = os.path.join(tmp, 'template_cache')
+        modes = (('compile on first use', dict(env, TEMPLATE_CACHE_DIR='')),
+                 ('precompiled', dict(env, TEMPLATE_CACHE_DIR=cache_dir)))
+        subprocess.run([sys.executable, '-m', 'flask', 'build', '--no-bundles'], cwd=REPO_ROOT,
+                       env=dict(modes[1][1], FLASK_APP='app', SKIP_INITIALIZE='1'),
+                       check=True, capture_output=True)
+
+        print(f"{'templates':>21} {'step':>14} {'p50 ms':>8} {'p95 ms':>8} {'max ms':>8}")
+        for label, mode_env in modes:
+            runs = [run_child(mode_env) for _ in range(args.runs)]
+            for step in runs[0]['timings']:
+                stats = summarize([run['timings'][step] for run in runs])
+                print(f"{label:>21} {step:>14} {stats['p50_ms']:>8.1f} {stats['p95_ms']:>8.1f} "
+                      f"{stats['max_ms']:>8.1f}")
+            loaded = sum(run['requests_loaded'] for run in runs)
+            print(f"{label:>21} {'requests':>14} loaded at startup in {loaded}/{len(runs)} runs")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+
+"""
+Static export benchmark.
+
+Builds a synthetic database (as bench_routes.py does), renders the full
+export once, then repeatedly makes one change through the app (marking a
+book read as reader "s", or adding a review) and brings the export up to
+date. Reports how long the full export took, and per change how many
+pages were rendered, how many files changed and how long the update took.
+
+    python benchmarks/bench_static_export.py --books 10000 --changes 50
+"""
+import argparse
+import contextlib
+import io
+import os
+import random
+import tempfile
+
+import common  # noqa: F401  (puts the repo on sys.path)
+from common import summarize
+
+from bench_routes import WORDS, build_db  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('--books', type=int, default=10000)
+    parser.add_argument('--changes', type=int, default=50)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'bench.db')
+        out_dir = os.path.join(tmp, 'export')
+        build_db(path, args.books, reviews_per_book=2, readers=20, read_share=0.3)
+        # Exports are run here, not from the app's background thread
+        os.environ.update(DATABASE_PATH=path, STATIC_EXPORT_DIR='', SKIP_INITIALIZE='1')
+        with contextlib.redirect_stdout(io.StringIO()):
+            import app
+        import static_export
+
+        rendered, written, seconds = static_export.export_site(app.app, out_dir, full=True)
+        print(f"{args.books} books: full export rendered {rendered} pages in {seconds:.2f} s")
+
+        client = app.app.test_client()
+        with client.session_transaction() as session:
+            session['_user_id'] = 's'
+            session['_fresh'] = True
+
+        rng = random.Random(42)
+        timings, pages, files = {}, {}, {}
+        for i in range(args.changes):
+            book_id = rng.randint(1, args.books)
+            if i % 2:
+                label = 'add_review'
+                client.post(f'/add_review/{book_id}', data={'reader': 's', 'rating': rng.randint(1, 5),
+                                                             'review': ' '.join(rng.choices(WORDS, k=12))})
+            else:
+                label = 'mark_read'
+                client.get(f'/mark_read/{book_id}/s')
+            rendered, written, seconds = static_export.export_site(app.app, out_dir)
+            timings.setdefault(label, []).append(seconds)
+            pages.setdefault(label, []).append(rendered)
+            files.setdefault(label, []).append(written)
+
+        print(f"{'change':>12} {'pages':>7} {'changed':>8} {'p50 ms':>8} {'p95 ms':>8} {'max ms':>8}")
+        for label, samples in timings.items():
+            stats = summarize(samples)
+            print(f"{label:>12} {sum(pages[label]) / len(samples):>7.1f} {sum(files[label]) / len(samples):>8.1f} "
+                  f"{stats['p50_ms']:>8.1f} {stats['p95_ms']:>8.1f} {stats['max_ms']:>8.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+"""Local stand-in for the Open Library search API, used by the benchmarks.
+
+Every request sleeps for a fixed latency before answering, so wall-clock time
+reflects how many lookups are in flight at once.
+
+Besides the per-book ``title=&author=`` search it answers batched
+``q=(title:"..." AND author:...) OR ...`` queries, and Google Books style
+``/books/v1/volumes`` requests. A share of the titles (`variant_share`) is
+catalogued under a slightly different title, so batch queries miss them and
+only the per-book search finds them, and a share (`unknown_share`) is not in
+the catalogue at all, which leaves them to the fallback provider.
+"""
+import json
+import re
+import socket
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+CLAUSE_RE = re.compile(r'title:"([^"]*)"(?: AND author:(\S+?)\)?(?= OR |$))?')
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+
+class StubOpenLibrary:
+    """Threaded HTTP server answering /search.json after `latency` seconds"""
+
+    def __init__(self, latency=0.05, variant_share=0.0, unknown_share=0.0):
+        self.latency = latency
+        self.variant_share = variant_share
+        self.unknown_share = unknown_share
+        self.request_count = 0
+        self._lock = threading.Lock()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def setup(self):
+                super().setup()
+                self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+            def do_GET(self):
+                with stub._lock:
+                    stub.request_count += 1
+                time.sleep(stub.latency)
+                url = urlsplit(self.path)
+                payload = stub.respond_google(url) if url.path.startswith('/books/') else stub.respond(url)
+                body = json.dumps(payload).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = _Server(('127.0.0.1', 0), Handler)
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def search_url(self):
+        host, port = self.server.server_address
+        return f'http://{host}:{port}/search.json'
+
+    @property
+    def google_url(self):
+        host, port = self.server.server_address
+        return f'http://{host}:{port}/books/v1/volumes'
+
+    @staticmethod
+    def _bucket(title):
+        return zlib.crc32(title.lower().encode()) % 1000 / 1000
+
+    def _doc(self, title, author):
+        seed = zlib.crc32(title.lower().encode())
+        return {'key': f'/works/OL{seed % 10_000_000}W', 'title': title, 'author_name': [author],
+                'cover_i': seed % 10_000_000, 'isbn': [f'978{seed % 10**10:010d}'],
+                'number_of_pages_median': 100 + seed % 900, 'subject': ['Fiction', 'Classics']}
+
+    def respond(self, url):
+        params = parse_qs(url.query)
+        if 'q' in params:
+            docs = []
+            for title, author in CLAUSE_RE.findall(params['q'][0]):
+                bucket = self._bucket(title)
+                if bucket < self.unknown_share:
+                    continue
+                if bucket < self.unknown_share + self.variant_share:
+                    title = f'{title}: A Novel'
+                docs.append(self._doc(title, author))
+            return {'numFound': len(docs), 'docs': docs}
+
+        title = params.get('title', [''])[0]
+        if self._bucket(title) < self.unknown_share:
+            return {'numFound': 0, 'docs': []}
+        return {'numFound': 1, 'docs': [self._doc(title, params.get('author', [''])[0])]}
+
+    def respond_google(self, url):
+        query = parse_qs(url.query).get('q', [''])[0]
+        title = re.sub(r'^intitle:(.*?) inauthor:.*$', r'\1', query)
+        seed = zlib.crc32(title.lower().encode())
+        return {'totalItems': 1, 'items': [{'volumeInfo': {
+            'title': title, 'pageCount': 100 + seed % 900, 'categories': ['Fiction'],
+            'industryIdentifiers': [{'type': 'ISBN_13', 'identifier': f'979{seed % 10**10:010d}'}],
+            'imageLinks': {'thumbnail': f'http://books.example/{seed}.jpg'},
+        }}]}
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.shutdown()
+        self.server.server_close()
@@ -1,5 +1,4 @@
 import os
-from werkzeug.security import generate_password_hash
 
 class Config:
     """Base configuration."""
@@ -8,10 +7,73 @@ class Config:
     
     # API Configuration
     OPENLIBRARY_API_URL = os.environ.get('OPENLIBRARY_API_URL', 'https://openlibrary.org/search.json')
+    GOOGLE_BOOKS_API_URL = os.environ.get('GOOGLE_BOOKS_API_URL', 'https://www.googleapis.com/books/v1/volumes')
     
-    # User credentials (in production, store hashed passwords)
-    SILAS_PASSWORD_HASH = os.environ.get('SILAS_PASSWORD_HASH') or generate_password_hash('silas')
-    NADINE_PASSWORD_HASH = os.environ.get('NADINE_PASSWORD_HASH') or generate_password_hash('nadine')
+    # Metadata sources asked in order (see enrichment.PROVIDERS), and books per Open Library query
+    ENRICHMENT_PROVIDERS = os.environ.get('ENRICHMENT_PROVIDERS', 'openlibrary,googlebooks')
+    ENRICHMENT_BATCH_SIZE = int(os.environ.get('ENRICHMENT_BATCH_SIZE', 10))
+    
+    # Sync book_list.csv on every start instead of loading it only into an empty database
+    CSV_SYNC_ON_STARTUP = os.environ.get('CSV_SYNC_ON_STARTUP', '').lower() in ('1', 'true', 'yes')
+    
+    # Opt-in profiling: Server-Timing headers, /metrics and a log line for slow requests
+    INSTRUMENTATION = os.environ.get('INSTRUMENTATION', '').lower() in ('1', 'true', 'yes')
+    INSTRUMENTATION_SLOW_MS = float(os.environ.get('INSTRUMENTATION_SLOW_MS', 500))
+    # Bearer token a Prometheus scraper sends for /metrics (without it only logged-in readers see it)
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+    
+    # Cover fetching (parallel lookups, requests per second per host, retries)
+    COVER_FETCH_CONCURRENCY = int(os.environ.get('COVER_FETCH_CONCURRENCY', 8))
+    COVER_FETCH_RATE_LIMIT = float(os.environ.get('COVER_FETCH_RATE_LIMIT', 5))
+    COVER_FETCH_RETRIES = int(os.environ.get('COVER_FETCH_RETRIES', 3))
+    COVER_FETCH_BACKOFF = float(os.environ.get('COVER_FETCH_BACKOFF', 0.5))
+    COVER_FETCH_TIMEOUT = float(os.environ.get('COVER_FETCH_TIMEOUT', 15))
+    
+    # Cover lookup cache (kept in its own file so it survives a database reset)
+    COVER_CACHE_PATH = os.environ.get('COVER_CACHE_PATH') or os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), 'cover_cache.db')
+    COVER_CACHE_NEGATIVE_TTL = int(os.environ.get('COVER_CACHE_NEGATIVE_TTL', 7 * 24 * 3600))
+    COVER_CACHE_POSITIVE_TTL = None
+    COVER_CACHE_MAX_ENTRIES = int(os.environ.get('COVER_CACHE_MAX_ENTRIES', 10000))
+    
+    # Compiled templates are cached here (filled by `flask build`), empty to compile on first use
+    TEMPLATE_CACHE_DIR = os.environ.get('TEMPLATE_CACHE_DIR', os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), '.template_cache'))
+    
+    # Pre-rendered anonymous pages for nginx (see static_export.py), empty to disable
+    STATIC_EXPORT_DIR = os.environ.get('STATIC_EXPORT_DIR', '')
+    
+    # Date (YYYY-MM-DD) by which every book should be read; the history page shows the pace it needs
+    CHALLENGE_DEADLINE = os.environ.get('CHALLENGE_DEADLINE', '')
+    
+    # Database snapshots (see backups.py); 0 hours turns scheduled snapshots off
+    BACKUP_DIR = os.environ.get('BACKUP_DIR') or os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), 'backups')
+    BACKUP_INTERVAL_HOURS = float(os.environ.get('BACKUP_INTERVAL_HOURS', 0))
+    BACKUP_KEEP = int(os.environ.get('BACKUP_KEEP', 14))
+    # Pages copied per step (4 KiB each) and the pause between steps, so requests are never held up
+    BACKUP_PAGES_PER_STEP = int(os.environ.get('BACKUP_PAGES_PER_STEP', 256))
+    BACKUP_STEP_PAUSE = float(os.environ.get('BACKUP_STEP_PAUSE', 0.005))
+    
+    # Login throttling and password checks (see auth.py); a limit of 0 turns that throttle off.
+    # The per-user limit counts a username's failures from one client address
+    LOGIN_MAX_FAILURES_PER_USER = int(os.environ.get('LOGIN_MAX_FAILURES_PER_USER', 5))
+    LOGIN_MAX_FAILURES_PER_IP = int(os.environ.get('LOGIN_MAX_FAILURES_PER_IP', 20))
+    LOGIN_THROTTLE_WINDOW = int(os.environ.get('LOGIN_THROTTLE_WINDOW', 900))
+    # Password checks at once per process, and attempts that may wait for one (more get a 503);
+    # the queue matches gunicorn's 4 threads per worker, so simultaneous logins are not turned away
+    LOGIN_HASH_WORKERS = int(os.environ.get('LOGIN_HASH_WORKERS', 1))
+    LOGIN_HASH_QUEUE = int(os.environ.get('LOGIN_HASH_QUEUE', 4))
+    # Method for new password hashes; hashes made otherwise are replaced at the next login
+    PASSWORD_HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD', 'pbkdf2')
+    # Reverse proxies in front of the app whose X-Forwarded-For is trusted (nginx: 1)
+    TRUSTED_PROXIES = int(os.environ.get('TRUSTED_PROXIES', 0))
+    
+    # User credentials (in production, store hashed passwords). Without a hash the
+    # founding readers get their development password ("silas"/"nadine") when created;
+    # hashing it here would cost every worker a few hundred milliseconds at import.
+    SILAS_PASSWORD_HASH = os.environ.get('SILAS_PASSWORD_HASH')
+    NADINE_PASSWORD_HASH = os.environ.get('NADINE_PASSWORD_HASH')
 
 class DevelopmentConfig(Config):
     """Development configuration."""
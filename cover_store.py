@@ -0,0 +1,87 @@
+"""Local copies of cover images.
+
+Covers are downloaded once into ``static/covers`` under content-hashed file
+names, together with a thumbnail sized for the book cards. Because a file's
+name changes whenever its content does, the files can be served with
+far-future ``immutable`` cache headers, by Flask or directly by nginx's
+``location /static`` block.
+
+Thumbnails are resized locally when Pillow is installed; otherwise Open
+Library's own medium size (``-M``) is stored instead.
+"""
+import hashlib
+import io
+import os
+import tempfile
+
+from covers import new_session
+from instrumentation import instrument_session
+
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+COVERS_SUBDIR = 'covers'
+
+# Cards show covers 240px high; twice that stays sharp on high-DPI screens
+THUMBNAIL_SIZE = (320, 480)
+DOWNLOAD_TIMEOUT = 15
+
+# Shared keep-alive session for cover downloads, created by the first download
+_session = None
+
+
+def get_session():
+    global _session
+    if _session is None:
+        _session = instrument_session(new_session())
+    return _session
+
+
+def _download(url):
+    response = get_session().get(url, timeout=DOWNLOAD_TIMEOUT)
+    response.raise_for_status()
+    if not response.headers.get('Content-Type', 'image/jpeg').startswith('image/'):
+        raise ValueError(f'{url} did not return an image')
+    return response.content
+
+
+def _write_hashed(data, suffix=''):
+    """Store `data` under a name derived from its hash, returns the path relative to static/"""
+    name = f'{hashlib.sha256(data).hexdigest()[:20]}{suffix}.jpg'
+    relative_path = f'{COVERS_SUBDIR}/{name}'
+    path = os.path.join(STATIC_DIR, COVERS_SUBDIR, name)
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write to a temp file first so a half-written cover is never served
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.part')
+        with os.fdopen(fd, 'wb') as tmp:
+            tmp.write(data)
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    return relative_path
+
+
+def _make_thumbnail(original, cover_url):
+    try:
+        from PIL import Image
+    except ImportError:
+        if cover_url.endswith('-L.jpg'):
+            return _download(cover_url[:-len('-L.jpg')] + '-M.jpg')
+        return original
+
+    image = Image.open(io.BytesIO(original))
+    image = image.convert('RGB')
+    image.thumbnail(THUMBNAIL_SIZE)
+    output = io.BytesIO()
+    image.save(output, 'JPEG', quality=82, optimize=True, progressive=True)
+    return output.getvalue()
+
+
+def store_cover(cover_url):
+    """Download `cover_url` and its thumbnail, returns (original_path, thumb_path) relative to static/"""
+    original = _download(cover_url)
+    original_path = _write_hashed(original)
+    thumb_path = _write_hashed(_make_thumbnail(original, cover_url), suffix='-thumb')
+    return original_path, thumb_path
+
+
+def is_stored(relative_path):
+    return bool(relative_path) and os.path.exists(os.path.join(STATIC_DIR, relative_path))
@@ -0,0 +1,160 @@
+"""Shared pieces of the Open Library lookups in ``enrichment.py``.
+
+``new_session()`` builds the keep-alive ``requests`` session, ``RateLimiter``
+spaces out requests per host and ``normalize_title_author()`` cleans titles
+and authors the same way for every search.
+
+``CoverCache`` remembers answers in a separate SQLite cache file keyed on the
+normalized title/author, so rebuilding the database or pressing "Fetch
+Covers" again does not ask Open Library about books it has already answered
+for, including books that have no cover.
+"""
+import json
+import re
+import sqlite3
+import threading
+import time
+
+USER_AGENT = 'ReadingChallenge/1.0 (https://github.com/reading-challenge)'
+COVER_URL_TEMPLATE = 'https://covers.openlibrary.org/b/id/{}-L.jpg'
+
+# Status codes worth another attempt after backing off
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+def new_session(pool_size=1):
+    """Keep-alive requests session with room for `pool_size` connections per host.
+
+    ``requests`` is imported here rather than at the top of the module: it is
+    the slowest import in the app, and only cover lookups and downloads use it.
+    """
+    import requests
+    from requests.adapters import HTTPAdapter
+
+    session = requests.Session()
+    session.headers['User-Agent'] = USER_AGENT
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def normalize_title_author(title, author):
+    """Strip punctuation the same way for every Open Library search"""
+    clean_title = re.sub(r'[^\w\s]', '', title).strip()
+    clean_author = re.sub(r'[^\w\s]', '', author).strip()
+    return clean_title, clean_author
+
+
+class CoverCache:
+    """Persistent title/author -> metadata cache with negative entries.
+
+    The enrichment pipeline stores everything it learned about a book as JSON
+    in the ``metadata`` column, and ``{}`` when no provider knew the book.
+    Those negative entries expire after `negative_ttl` seconds so books added
+    upstream are picked up eventually; the others expire after `positive_ttl`
+    seconds (None = never). The least recently used rows are evicted beyond
+    `max_entries`. Rows written by older cover-only lookups have no metadata
+    and count as misses.
+    """
+
+    def __init__(self, path, negative_ttl=7 * 24 * 3600, positive_ttl=None, max_entries=10000):
+        self.negative_ttl = negative_ttl
+        self.positive_ttl = positive_ttl
+        self.max_entries = max_entries
+        self.conn = sqlite3.connect(path)
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS cover_cache (
+                title TEXT NOT NULL,
+                author TEXT NOT NULL,
+                cover_url TEXT,
+                metadata TEXT,
+                fetched_at REAL NOT NULL,
+                last_used REAL NOT NULL,
+                PRIMARY KEY (title, author)
+            )
+        ''')
+        columns = {row[1] for row in self.conn.execute('PRAGMA table_info(cover_cache)')}
+        if 'metadata' not in columns:
+            self.conn.execute('ALTER TABLE cover_cache ADD COLUMN metadata TEXT')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS idx_cover_cache_last_used ON cover_cache (last_used)')
+        self.conn.commit()
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(
+            config['COVER_CACHE_PATH'],
+            negative_ttl=config['COVER_CACHE_NEGATIVE_TTL'],
+            positive_ttl=config['COVER_CACHE_POSITIVE_TTL'],
+            max_entries=config['COVER_CACHE_MAX_ENTRIES'],
+        )
+
+    @staticmethod
+    def key(title, author):
+        clean_title, clean_author = normalize_title_author(title, author)
+        return clean_title.lower(), clean_author.lower()
+
+    def get_metadata(self, title, author):
+        """Return (hit, metadata); metadata is {} for a cached 'nobody knows this book'"""
+        row = self.conn.execute(
+            'SELECT metadata, fetched_at FROM cover_cache WHERE title = ? AND author = ?',
+            self.key(title, author)
+        ).fetchone()
+        if not row or row[0] is None:
+            return False, None
+
+        metadata = json.loads(row[0])
+        ttl = self.positive_ttl if metadata else self.negative_ttl
+        if ttl is not None and time.time() - row[1] > ttl:
+            return False, None
+
+        self.conn.execute('UPDATE cover_cache SET last_used = ? WHERE title = ? AND author = ?',
+                          (time.time(), *self.key(title, author)))
+        return True, metadata
+
+    def put_metadata(self, title, author, metadata):
+        now = time.time()
+        self.conn.execute('''
+            INSERT OR REPLACE INTO cover_cache (title, author, cover_url, metadata, fetched_at, last_used)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', (*self.key(title, author), metadata.get('cover_url'), json.dumps(metadata), now, now))
+
+    def flush(self):
+        """Commit pending writes and evict the least recently used overflow"""
+        if self.max_entries:
+            self.conn.execute('''
+                DELETE FROM cover_cache WHERE rowid IN (
+                    SELECT rowid FROM cover_cache ORDER BY last_used DESC LIMIT -1 OFFSET ?
+                )
+            ''', (self.max_entries,))
+        self.conn.commit()
+
+    def close(self):
+        self.flush()
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class RateLimiter:
+    """Spaces out requests to the same host to at most `rate` per second"""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate and rate > 0 else 0
+        self._next_slot = {}
+        self._lock = threading.Lock()
+
+    def wait(self, host):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot.get(host, now))
+            self._next_slot[host] = slot + self.interval
+        delay = slot - now
+        if delay > 0:
+            time.sleep(delay)
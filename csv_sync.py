@@ -0,0 +1,181 @@
+"""Incremental sync of book_list.csv into the books table.
+
+Books are matched to existing rows by ``book_key``, a normalized
+title+author (falling back to the title alone when an author was
+corrected), so a re-sync only touches what changed: new titles are
+inserted, corrected rows are updated, ``order_index`` follows the CSV order
+and the S/N marks become reading progress of the founding readers. Marks
+are only ever added by the CSV, never removed, so books marked read in the
+app stay read. Books that disappear from the CSV are kept (with their
+reviews and progress) and moved to the end.
+"""
+import csv
+
+from covers import normalize_title_author
+from db import bump_data_version
+
+# CSV column -> username of the reader whose read marks it holds
+CSV_READER_COLUMNS = ((0, 's'), (1, 'n'))
+
+MARK_READ_SQL = '''
+    INSERT OR IGNORE INTO reading_progress (reader_id, book_id)
+    SELECT id, ? FROM readers WHERE username = ?
+'''
+
+
+def book_key(title, author):
+    """Stable identity of a book across CSV edits (case, punctuation and spacing ignored)"""
+    clean_title, clean_author = normalize_title_author(title, author)
+    return f"{' '.join(clean_title.lower().split())}|{' '.join(clean_author.lower().split())}"
+
+
+def parse_title_year(title):
+    """Split 'War and Peace (1869)' into ('War and Peace', 1869)"""
+    # Extract year from title if present and remove brackets
+    year = None
+    if '(' in title and ')' in title:
+        try:
+            year_str = title[title.rfind('(') + 1:title.rfind(')')]
+            year = int(year_str)
+            title = title[:title.rfind('(')].strip()
+        except ValueError:
+            pass
+    return title, year
+
+
+def read_csv_books(csv_path):
+    """Yield book dicts from the CSV in file order, one row at a time"""
+    with open(csv_path, 'r', encoding='utf-8') as file:
+        csv_reader = csv.reader(file)
+        next(csv_reader, None)  # Skip header
+
+        for row in csv_reader:
+            if len(row) >= 4 and row[2]:  # Make sure we have title and author
+                title, year = parse_title_year(row[2].strip())
+                yield {
+                    'title': title,
+                    'author': row[3].strip(),
+                    'year': year,
+                    'read_by': [username for column, username in CSV_READER_COLUMNS
+                                if row[column].strip().lower() == 'x'],
+                }
+
+
+def apply_sync(cursor, books):
+    """Bring the books table in line with `books` (in list order).
+
+    Must run inside a write transaction. Returns a summary dict with the
+    inserted/updated/unchanged/missing counts, the number of read marks
+    added and the ids of new books.
+    """
+    cursor.execute('''
+        SELECT id, book_key, title, author, year, order_index
+        FROM books ORDER BY order_index
+    ''')
+    existing = {}
+    for row in cursor.fetchall():
+        existing.setdefault(row[1], row)
+
+    # Match on the full key first
+    matched = []
+    seen = set()
+    for book in books:
+        key = book_key(book['title'], book['author'])
+        if key in seen:
+            # Duplicate line in the CSV
+            continue
+        seen.add(key)
+        matched.append((book, key, existing.get(key)))
+
+    # A row whose author (or just its spelling) was corrected no longer matches
+    # its key; pair it with the one unmatched book that has the same title
+    used = {key for _, key, row in matched if row is not None}
+    orphans_by_title = {}
+    for key, row in existing.items():
+        if key not in used:
+            orphans_by_title.setdefault(key.split('|')[0], []).append(row)
+    for position, (book, key, row) in enumerate(matched):
+        candidates = orphans_by_title.get(key.split('|')[0], [])
+        if row is None and len(candidates) == 1:
+            matched[position] = (book, key, candidates.pop())
+            used.add(matched[position][2][1])
+
+    inserts = []
+    inserted_marks = []
+    updates = []
+    marks = []
+    unchanged = 0
+    for order_index, (book, key, row) in enumerate(matched):
+        if row is None:
+            inserts.append((book['title'], book['author'], book['year'], order_index, key))
+            inserted_marks.append(book.get('read_by', ()))
+            continue
+
+        book_id, old_key, title, author, year, old_order_index = row
+        marks.extend((book_id, username) for username in book.get('read_by', ()))
+        new = (book['title'], book['author'], book['year'], order_index, key)
+        old = (title, author, year, old_order_index, old_key)
+        if new != old:
+            updates.append(new + (book_id,))
+        else:
+            unchanged += 1
+
+    # Books dropped from the CSV keep their reviews and move to the end
+    order_index = len(matched)
+    missing = [row for key, row in existing.items() if key not in used]
+    moves = []
+    for row in missing:
+        if row[5] != order_index:
+            moves.append((order_index, row[0]))
+        order_index += 1
+
+    if updates:
+        cursor.executemany('''
+            UPDATE books SET title = ?, author = ?, year = ?, order_index = ?, book_key = ?
+            WHERE id = ?
+        ''', updates)
+    if moves:
+        cursor.executemany('UPDATE books SET order_index = ? WHERE id = ?', moves)
+
+    new_ids = []
+    if inserts:
+        # We hold the write lock, so every id above the current maximum is ours
+        cursor.execute('SELECT COALESCE(MAX(id), 0) FROM books')
+        max_id = cursor.fetchone()[0]
+        cursor.executemany('''
+            INSERT INTO books (title, author, year, cover_url, order_index, book_key)
+            VALUES (?, ?, ?, NULL, ?, ?)
+        ''', inserts)
+        cursor.execute('SELECT id FROM books WHERE id > ? ORDER BY id', (max_id,))
+        new_ids = [row[0] for row in cursor.fetchall()]
+        marks.extend((book_id, username) for book_id, usernames in zip(new_ids, inserted_marks)
+                     for username in usernames)
+
+    marked = 0
+    if marks:
+        cursor.executemany(MARK_READ_SQL, marks)
+        marked = cursor.rowcount
+
+    if inserts or updates or moves or marked:
+        bump_data_version(cursor)
+
+    return {
+        'inserted': len(inserts),
+        'updated': len(updates),
+        'unchanged': unchanged,
+        'missing': len(missing),
+        'marked': marked,
+        'new_ids': new_ids,
+    }
+
+
+def sync_csv(conn, csv_path):
+    """Sync `csv_path` into the database in a single transaction (conn must be in autocommit mode)"""
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        summary = apply_sync(conn.cursor(), read_csv_books(csv_path))
+    except Exception:
+        conn.execute('ROLLBACK')
+        raise
+    conn.execute('COMMIT')
+    return summary
@@ -0,0 +1,529 @@
+"""Shared database helpers.
+
+Connections are opened through ``connect()`` so every one of them gets the
+same tuning: WAL journal mode (readers never wait for a writer), relaxed
+``synchronous``, a larger page cache, a busy timeout instead of immediate
+``database is locked`` errors, and a bigger prepared-statement cache.
+
+Request handlers use ``get_db()``, which hands out one pooled connection per
+thread. It is released (never closed) in ``teardown_appcontext``, so a
+worker reuses the same connection and its prepared statements across
+requests, and an early return can no longer leak a connection.
+
+The schema is versioned with ``PRAGMA user_version``. ``create_schema()`` creates
+the original tables; everything added since lives in ``MIGRATIONS`` and is
+applied in place, one version per transaction, by ``migrate()``.
+
+The ``app_meta`` table holds a ``data_version`` counter that every write
+path bumps in the same transaction as its change. Anything derived from the
+database (cached stats, cached pages) is keyed on that counter, so all
+gunicorn workers see an invalidation as soon as it is committed.
+"""
+import os
+import re
+import sqlite3
+import threading
+
+from flask import current_app, g, has_app_context
+
+# Pages of page cache per connection (negative = KiB)
+CACHE_SIZE_KIB = 16384
+BUSY_TIMEOUT_MS = 5000
+STATEMENT_CACHE_SIZE = 256
+
+_pool = threading.local()
+
+
+def connect(db_path, **kwargs):
+    """Open a tuned connection to `db_path`"""
+    kwargs.setdefault('timeout', BUSY_TIMEOUT_MS / 1000)
+    kwargs.setdefault('cached_statements', STATEMENT_CACHE_SIZE)
+    conn = sqlite3.connect(db_path, **kwargs)
+    conn.execute('PRAGMA journal_mode = WAL')
+    conn.execute('PRAGMA synchronous = NORMAL')
+    conn.execute(f'PRAGMA cache_size = -{CACHE_SIZE_KIB}')
+    conn.execute(f'PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}')
+    return conn
+
+
+def _pooled_connection(db_path, factory=sqlite3.Connection):
+    # Connections must not cross a fork, so the pool is keyed on the pid too
+    key = (os.getpid(), db_path, factory)
+    conn = getattr(_pool, 'connections', {}).get(key)
+    if conn is None:
+        conn = connect(db_path, factory=factory)
+        conn.row_factory = sqlite3.Row
+        _pool.connections = {key: conn}
+    return conn
+
+
+def get_db():
+    """Connection for the current request, released automatically at teardown"""
+    if 'db' not in g:
+        g.db = _pooled_connection(current_app.config['DATABASE_PATH'],
+                                  current_app.config.get('DATABASE_FACTORY', sqlite3.Connection))
+    return g.db
+
+
+def release_db(exception=None):
+    conn = g.pop('db', None)
+    if conn is not None and conn.in_transaction:
+        # Never hand an open transaction to the next request
+        conn.rollback()
+
+
+def init_app(app):
+    app.teardown_appcontext(release_db)
+
+
+def _backfill_book_keys(conn):
+    from csv_sync import book_key
+
+    rows = conn.execute('SELECT id, title, author FROM books').fetchall()
+    conn.executemany('UPDATE books SET book_key = ? WHERE id = ?',
+                     [(book_key(title, author), book_id) for book_id, title, author in rows])
+
+
+def _review_aggregates(row, sign):
+    """Trigger statements adding (sign '+') or removing (sign '-') review `row` ('new' or 'old')
+    from the rating aggregates, then re-picking that reader's latest rating of the book"""
+    rated = f'({row}.rating IS NOT NULL)'
+    rating = f'COALESCE({row}.rating, 0)'
+    histogram = ', '.join(f'rating_{n} = rating_{n} {sign} ({row}.rating = {n})' for n in range(1, 6))
+    return f'''
+        UPDATE books
+        SET review_count = review_count {sign} {rated},
+            rating_sum = rating_sum {sign} {rating},
+            avg_rating = CASE WHEN review_count {sign} {rated} > 0
+                              THEN (rating_sum {sign} {rating}) * 1.0 / (review_count {sign} {rated}) END,
+            {histogram}
+        WHERE id = {row}.book_id;
+        UPDATE readers
+        SET review_count = review_count {sign} {rated}, rating_sum = rating_sum {sign} {rating}
+        WHERE username = {row}.reader;
+        DELETE FROM latest_ratings WHERE book_id = {row}.book_id AND reader = {row}.reader;
+        INSERT INTO latest_ratings (book_id, reader, rating, review_id, rated_at)
+        SELECT book_id, reader, rating, id, date_added FROM reviews
+        WHERE book_id = {row}.book_id AND reader = {row}.reader AND rating IS NOT NULL
+        ORDER BY date_added DESC, id DESC LIMIT 1;
+    '''
+
+
+
+def _reading_rollups(events):
+    """SELECT of the reading_rollups changes for the reading events in subquery `events`
+    (reader_id, read_at, event and the book's year): +1 per 'read' and -1 per 'unread' in
+    each period's bucket of the read date (undated reads: bucket ''), for the reader and
+    for everyone (reader_id 0), for the book's century and for 'all'"""
+    century = ("CASE WHEN e.year >= 2000 THEN '21st' WHEN e.year >= 1900 THEN '20th' "
+               "WHEN e.year >= 1800 THEN '19th' END")
+    return f'''
+        SELECT periods.column1,
+               CASE WHEN split.column1 & 1 THEN {century} ELSE 'all' END,
+               CASE WHEN split.column1 & 2 THEN e.reader_id ELSE 0 END,
+               COALESCE(CASE periods.column1
+                            WHEN 'day' THEN date(e.read_at)
+                            WHEN 'week' THEN date(e.read_at, '-6 days', 'weekday 1')
+                            WHEN 'month' THEN date(e.read_at, 'start of month')
+                            ELSE date(e.read_at, 'start of year') END, ''),
+               SUM(CASE e.event WHEN 'read' THEN 1 ELSE -1 END)
+        FROM {events} AS e,
+             (VALUES ('day'), ('week'), ('month'), ('year')) AS periods,
+             (VALUES (0), (1), (2), (3)) AS split
+        WHERE split.column1 & 1 = 0 OR {century} IS NOT NULL
+        GROUP BY 1, 2, 3, 4
+    '''
+
+# Schema changes since the original tables, one list per user_version.
+# Append new versions at the end and never edit one that has shipped.
+# A step is an SQL string or a callable taking the connection.
+MIGRATIONS = [
+    # 1: indexes for the homepage, book detail, stats and cover queries
+    [
+        'CREATE INDEX IF NOT EXISTS idx_books_order ON books (order_index)',
+        'CREATE INDEX IF NOT EXISTS idx_books_s_read ON books (s_read, order_index)',
+        'CREATE INDEX IF NOT EXISTS idx_books_n_read ON books (n_read, order_index)',
+        'CREATE INDEX IF NOT EXISTS idx_books_year ON books (year, order_index)',
+        'CREATE INDEX IF NOT EXISTS idx_books_stats ON books (s_read, n_read, year)',
+        """CREATE INDEX IF NOT EXISTS idx_books_missing_cover ON books (id)
+           WHERE cover_url IS NULL OR cover_url = ''""",
+        'CREATE INDEX IF NOT EXISTS idx_reviews_book_date ON reviews (book_id, date_added DESC)',
+        'CREATE INDEX IF NOT EXISTS idx_jobs_kind_status ON jobs (kind, status)',
+    ],
+    # 2: locally stored cover images (paths relative to static/)
+    [
+        'ALTER TABLE books ADD COLUMN cover_original TEXT',
+        'ALTER TABLE books ADD COLUMN cover_thumb TEXT',
+    ],
+    # 3: normalized title+author key used to match CSV rows to books
+    [
+        'ALTER TABLE books ADD COLUMN book_key TEXT',
+        _backfill_book_keys,
+        'CREATE INDEX IF NOT EXISTS idx_books_key ON books (book_key)',
+    ],
+    # 4: full-text search over titles, authors and review text (rowid = books.id)
+    [
+        """CREATE VIRTUAL TABLE IF NOT EXISTS book_search USING fts5(
+               title, author, reviews,
+               tokenize = 'unicode61 remove_diacritics 2',
+               prefix = '2 3'
+           )""",
+        """INSERT INTO book_search (rowid, title, author, reviews)
+           SELECT id, title, author,
+                  (SELECT group_concat(review, ' ') FROM reviews WHERE book_id = books.id)
+           FROM books""",
+        """CREATE TRIGGER IF NOT EXISTS books_search_insert AFTER INSERT ON books BEGIN
+               INSERT INTO book_search (rowid, title, author, reviews)
+               VALUES (new.id, new.title, new.author,
+                       (SELECT group_concat(review, ' ') FROM reviews WHERE book_id = new.id));
+           END""",
+        """CREATE TRIGGER IF NOT EXISTS books_search_update AFTER UPDATE OF title, author ON books BEGIN
+               UPDATE book_search SET title = new.title, author = new.author WHERE rowid = new.id;
+           END""",
+        """CREATE TRIGGER IF NOT EXISTS books_search_delete AFTER DELETE ON books BEGIN
+               DELETE FROM book_search WHERE rowid = old.id;
+           END""",
+        """CREATE TRIGGER IF NOT EXISTS reviews_search_insert AFTER INSERT ON reviews BEGIN
+               UPDATE book_search
+               SET reviews = (SELECT group_concat(review, ' ') FROM reviews WHERE book_id = new.book_id)
+               WHERE rowid = new.book_id;
+           END""",
+        """CREATE TRIGGER IF NOT EXISTS reviews_search_update AFTER UPDATE OF review, book_id ON reviews BEGIN
+               UPDATE book_search
+               SET reviews = (SELECT group_concat(review, ' ') FROM reviews WHERE book_id = old.book_id)
+               WHERE rowid = old.book_id;
+               UPDATE book_search
+               SET reviews = (SELECT group_concat(review, ' ') FROM reviews WHERE book_id = new.book_id)
+               WHERE rowid = new.book_id;
+           END""",
+        """CREATE TRIGGER IF NOT EXISTS reviews_search_delete AFTER DELETE ON reviews BEGIN
+               UPDATE book_search
+               SET reviews = (SELECT group_concat(review, ' ') FROM reviews WHERE book_id = old.book_id)
+               WHERE rowid = old.book_id;
+           END""",
+    ],
+    # 5: readers and per-reader progress replace the s_read/n_read columns
+    [
+        """CREATE TABLE IF NOT EXISTS readers (
+               id INTEGER PRIMARY KEY AUTOINCREMENT,
+               username TEXT NOT NULL UNIQUE,
+               name TEXT NOT NULL,
+               password_hash TEXT,
+               books_read INTEGER NOT NULL DEFAULT 0,
+               created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+           )""",
+        """CREATE TABLE IF NOT EXISTS reading_progress (
+               reader_id INTEGER NOT NULL REFERENCES readers (id),
+               book_id INTEGER NOT NULL REFERENCES books (id),
+               read_at TIMESTAMP,
+               PRIMARY KEY (reader_id, book_id)
+           ) WITHOUT ROWID""",
+        'CREATE INDEX IF NOT EXISTS idx_progress_book ON reading_progress (book_id, read_at)',
+        'CREATE INDEX IF NOT EXISTS idx_readers_books_read ON readers (books_read DESC, name)',
+        'ALTER TABLE books ADD COLUMN read_count INTEGER NOT NULL DEFAULT 0',
+        """CREATE TRIGGER IF NOT EXISTS progress_insert AFTER INSERT ON reading_progress BEGIN
+               UPDATE books SET read_count = read_count + 1 WHERE id = new.book_id;
+               UPDATE readers SET books_read = books_read + 1 WHERE id = new.reader_id;
+           END""",
+        """CREATE TRIGGER IF NOT EXISTS progress_delete AFTER DELETE ON reading_progress BEGIN
+               UPDATE books SET read_count = read_count - 1 WHERE id = old.book_id;
+               UPDATE readers SET books_read = books_read - 1 WHERE id = old.reader_id;
+           END""",
+        # The old columns carry no date, so migrated marks have no read_at
+        "INSERT OR IGNORE INTO readers (username, name) VALUES ('s', 'Silas'), ('n', 'Nadine')",
+        """INSERT OR IGNORE INTO reading_progress (reader_id, book_id)
+           SELECT r.id, b.id FROM books b JOIN readers r ON r.username = 's' WHERE b.s_read""",
+        """INSERT OR IGNORE INTO reading_progress (reader_id, book_id)
+           SELECT r.id, b.id FROM books b JOIN readers r ON r.username = 'n' WHERE b.n_read""",
+        'DROP INDEX IF EXISTS idx_books_s_read',
+        'DROP INDEX IF EXISTS idx_books_n_read',
+        'DROP INDEX IF EXISTS idx_books_stats',
+        'ALTER TABLE books DROP COLUMN s_read',
+        'ALTER TABLE books DROP COLUMN n_read',
+        'CREATE INDEX IF NOT EXISTS idx_books_read_count ON books (read_count, order_index)',
+        'CREATE INDEX IF NOT EXISTS idx_books_stats ON books (read_count, year)',
+        lambda conn: bump_data_version(conn),
+    ],
+    # 6: rating aggregates kept by triggers on reviews (count, average and histogram per
+    #    book, reviews written per reader, each reader's latest rating of a book)
+    [
+        *(f'ALTER TABLE books ADD COLUMN {column} INTEGER NOT NULL DEFAULT 0'
+          for column in ('review_count', 'rating_sum', 'rating_1', 'rating_2', 'rating_3', 'rating_4', 'rating_5')),
+        'ALTER TABLE books ADD COLUMN avg_rating REAL',
+        'ALTER TABLE readers ADD COLUMN review_count INTEGER NOT NULL DEFAULT 0',
+        'ALTER TABLE readers ADD COLUMN rating_sum INTEGER NOT NULL DEFAULT 0',
+        """CREATE TABLE IF NOT EXISTS latest_ratings (
+               book_id INTEGER NOT NULL REFERENCES books (id),
+               reader TEXT NOT NULL,
+               rating INTEGER NOT NULL,
+               review_id INTEGER NOT NULL,
+               rated_at TIMESTAMP,
+               PRIMARY KEY (book_id, reader)
+           ) WITHOUT ROWID""",
+        'CREATE INDEX IF NOT EXISTS idx_reviews_book_reader ON reviews (book_id, reader, date_added DESC, id DESC)',
+        """UPDATE books
+           SET review_count = agg.review_count, rating_sum = agg.rating_sum,
+               rating_1 = agg.rating_1, rating_2 = agg.rating_2, rating_3 = agg.rating_3,
+               rating_4 = agg.rating_4, rating_5 = agg.rating_5,
+               avg_rating = agg.rating_sum * 1.0 / agg.review_count
+           FROM (SELECT book_id, COUNT(rating) AS review_count, SUM(rating) AS rating_sum,
+                        SUM(rating = 1) AS rating_1, SUM(rating = 2) AS rating_2, SUM(rating = 3) AS rating_3,
+                        SUM(rating = 4) AS rating_4, SUM(rating = 5) AS rating_5
+                 FROM reviews WHERE rating IS NOT NULL GROUP BY book_id) AS agg
+           WHERE books.id = agg.book_id""",
+        """UPDATE readers
+           SET review_count = agg.review_count, rating_sum = agg.rating_sum
+           FROM (SELECT reader, COUNT(rating) AS review_count, SUM(rating) AS rating_sum
+                 FROM reviews WHERE rating IS NOT NULL GROUP BY reader) AS agg
+           WHERE readers.username = agg.reader""",
+        """INSERT OR REPLACE INTO latest_ratings (book_id, reader, rating, review_id, rated_at)
+           SELECT book_id, reader, rating, id, date_added FROM (
+               SELECT *, ROW_NUMBER() OVER (PARTITION BY book_id, reader
+                                            ORDER BY date_added DESC, id DESC) AS position
+               FROM reviews WHERE rating IS NOT NULL
+           ) WHERE position = 1""",
+        f"""CREATE TRIGGER IF NOT EXISTS reviews_aggregate_insert AFTER INSERT ON reviews BEGIN
+               {_review_aggregates('new', '+')}
+           END""",
+        f"""CREATE TRIGGER IF NOT EXISTS reviews_aggregate_delete AFTER DELETE ON reviews BEGIN
+               {_review_aggregates('old', '-')}
+           END""",
+        f"""CREATE TRIGGER IF NOT EXISTS reviews_aggregate_update AFTER UPDATE OF rating, book_id, reader
+           ON reviews BEGIN
+               {_review_aggregates('old', '-')}
+               {_review_aggregates('new', '+')}
+           END""",
+        # Homepage sort by rating; the stats index gains the rating columns to stay covering
+        'CREATE INDEX IF NOT EXISTS idx_books_rating ON books (avg_rating DESC, review_count DESC, order_index)',
+        'CREATE INDEX IF NOT EXISTS idx_books_most_read ON books (read_count DESC, order_index)',
+        'DROP INDEX IF EXISTS idx_books_stats',
+        'CREATE INDEX IF NOT EXISTS idx_books_stats ON books (read_count, year, review_count, rating_sum)',
+        'CREATE INDEX IF NOT EXISTS idx_readers_reviews ON readers (review_count DESC, name)',
+        lambda conn: bump_data_version(conn),
+    ],
+    # 7: metadata from the enrichment providers; enriched_at marks books every provider answered
+    [
+        'ALTER TABLE books ADD COLUMN isbn TEXT',
+        'ALTER TABLE books ADD COLUMN page_count INTEGER',
+        'ALTER TABLE books ADD COLUMN subjects TEXT',
+        'ALTER TABLE books ADD COLUMN ol_key TEXT',
+        'ALTER TABLE books ADD COLUMN metadata_source TEXT',
+        'ALTER TABLE books ADD COLUMN enriched_at TIMESTAMP',
+        'CREATE INDEX IF NOT EXISTS idx_books_unenriched ON books (id) WHERE enriched_at IS NULL',
+    ],
+    # 8: append-only log of every reading_progress change, written by triggers so no
+    #    write path can skip it; existing marks are logged as 'read' events at their date
+    [
+        """CREATE TABLE IF NOT EXISTS reading_events (
+               id INTEGER PRIMARY KEY AUTOINCREMENT,
+               reader_id INTEGER NOT NULL REFERENCES readers (id),
+               book_id INTEGER NOT NULL REFERENCES books (id),
+               event TEXT NOT NULL CHECK (event IN ('read', 'unread')),
+               read_at TIMESTAMP,
+               recorded_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+           )""",
+        'CREATE INDEX IF NOT EXISTS idx_reading_events_reader ON reading_events (reader_id, id)',
+        """INSERT INTO reading_events (reader_id, book_id, event, read_at, recorded_at)
+           SELECT reader_id, book_id, 'read', read_at, COALESCE(read_at, CURRENT_TIMESTAMP)
+           FROM reading_progress ORDER BY read_at, reader_id, book_id""",
+        """CREATE TRIGGER IF NOT EXISTS progress_event_insert AFTER INSERT ON reading_progress BEGIN
+               INSERT INTO reading_events (reader_id, book_id, event, read_at)
+               VALUES (new.reader_id, new.book_id, 'read', new.read_at);
+           END""",
+        """CREATE TRIGGER IF NOT EXISTS progress_event_delete AFTER DELETE ON reading_progress BEGIN
+               INSERT INTO reading_events (reader_id, book_id, event, read_at)
+               VALUES (old.reader_id, old.book_id, 'unread', old.read_at);
+           END""",
+        """CREATE TRIGGER IF NOT EXISTS reading_events_no_update BEFORE UPDATE ON reading_events BEGIN
+               SELECT RAISE(ABORT, 'reading_events is append-only');
+           END""",
+        """CREATE TRIGGER IF NOT EXISTS reading_events_no_delete BEFORE DELETE ON reading_events BEGIN
+               SELECT RAISE(ABORT, 'reading_events is append-only');
+           END""",
+    ],
+    # 9: books whose pre-rendered pages are out of date (see static_export.py); every change
+    #    to a book row, including the counters kept by the progress and review triggers,
+    #    marks it, and `seq` tells a running export whether it changed again meanwhile
+    [
+        """CREATE TABLE IF NOT EXISTS static_export_pending (
+               book_id INTEGER PRIMARY KEY,
+               seq INTEGER NOT NULL DEFAULT 0
+           )""",
+        *(f"""CREATE TRIGGER IF NOT EXISTS books_export_{event.lower()} AFTER {event} ON books BEGIN
+               INSERT INTO static_export_pending (book_id) VALUES ({row}.id)
+               ON CONFLICT (book_id) DO UPDATE SET seq = seq + 1;
+           END""" for event, row in (('INSERT', 'new'), ('UPDATE', 'new'), ('DELETE', 'old'))),
+    ],
+    # 10: failed logins per username and per client address in the current throttling
+    #     window (see auth.py), shared by every worker
+    [
+        """CREATE TABLE IF NOT EXISTS login_failures (
+               scope TEXT NOT NULL CHECK (scope IN ('user', 'ip')),
+               key TEXT NOT NULL,
+               window_start REAL NOT NULL,
+               failures INTEGER NOT NULL,
+               PRIMARY KEY (scope, key)
+           ) WITHOUT ROWID""",
+        'CREATE INDEX IF NOT EXISTS idx_login_failures_window ON login_failures (window_start)',
+    ],
+    # 11: books read per day, week, month and year, per reader and per century (see
+    #     history.py); a trigger on reading_events adds every mark and unmark, and a change
+    #     of a book's year moves its current marks to the new century
+    [
+        """CREATE TABLE IF NOT EXISTS reading_rollups (
+               period TEXT NOT NULL CHECK (period IN ('day', 'week', 'month', 'year')),
+               century TEXT NOT NULL,
+               reader_id INTEGER NOT NULL,
+               bucket_start TEXT NOT NULL,
+               books INTEGER NOT NULL,
+               PRIMARY KEY (period, century, reader_id, bucket_start)
+           ) WITHOUT ROWID""",
+        f"""INSERT INTO reading_rollups (period, century, reader_id, bucket_start, books)
+           {_reading_rollups('''(SELECT re.reader_id, re.read_at, re.event, b.year
+                                 FROM reading_events re LEFT JOIN books b ON b.id = re.book_id)''')}""",
+        f"""CREATE TRIGGER IF NOT EXISTS reading_events_rollup AFTER INSERT ON reading_events BEGIN
+               INSERT INTO reading_rollups (period, century, reader_id, bucket_start, books)
+               {_reading_rollups('''(SELECT new.reader_id AS reader_id, new.read_at AS read_at, new.event AS event,
+                                            (SELECT year FROM books WHERE id = new.book_id) AS year)''')}
+               ON CONFLICT (period, century, reader_id, bucket_start) DO UPDATE SET books = books + excluded.books;
+           END""",
+        f"""CREATE TRIGGER IF NOT EXISTS books_year_rollup AFTER UPDATE OF year ON books
+           WHEN old.year IS NOT new.year BEGIN
+               INSERT INTO reading_rollups (period, century, reader_id, bucket_start, books)
+               {_reading_rollups('''(SELECT reader_id, read_at, event, year FROM (
+                                         SELECT reader_id, read_at, 'unread' AS event, old.year AS year
+                                         FROM reading_progress WHERE book_id = new.id
+                                         UNION ALL
+                                         SELECT reader_id, read_at, 'read', new.year
+                                         FROM reading_progress WHERE book_id = new.id))''')}
+               ON CONFLICT (period, century, reader_id, bucket_start) DO UPDATE SET books = books + excluded.books;
+           END""",
+    ],
+    # 12: books no provider knew stay unenriched and are asked about again after
+    #     enrich_after (unix time); those migration 7 stamped as enriched are due again now
+    [
+        'ALTER TABLE books ADD COLUMN enrich_after REAL',
+        'UPDATE books SET enriched_at = NULL WHERE enriched_at IS NOT NULL AND metadata_source IS NULL',
+    ],
+]
+
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+def migrate(conn):
+    """Bring the schema up to SCHEMA_VERSION, returns the list of versions applied"""
+    applied = []
+    for target in range(1, SCHEMA_VERSION + 1):
+        # Re-check inside the write lock so concurrent workers migrate only once
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            if conn.execute('PRAGMA user_version').fetchone()[0] >= target:
+                conn.execute('COMMIT')
+                continue
+            for step in MIGRATIONS[target - 1]:
+                if callable(step):
+                    step(conn)
+                else:
+                    conn.execute(step)
+            conn.execute(f'PRAGMA user_version = {target}')
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        applied.append(target)
+    return applied
+
+
+def create_schema(conn):
+    """Create the original tables if needed and migrate, returns the migrations applied"""
+    from jobs import init_jobs_table
+
+    cursor = conn.cursor()
+
+    # Create books table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS books (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            title TEXT NOT NULL,
+            author TEXT NOT NULL,
+            year INTEGER,
+            s_read BOOLEAN DEFAULT FALSE,
+            n_read BOOLEAN DEFAULT FALSE,
+            cover_url TEXT,
+            order_index INTEGER
+        )
+    ''')
+
+    # Create reviews table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS reviews (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            book_id INTEGER,
+            reader TEXT NOT NULL,
+            rating INTEGER CHECK(rating >= 1 AND rating <= 5),
+            review TEXT,
+            date_added TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (book_id) REFERENCES books (id)
+        )
+    ''')
+
+    # Create background jobs table
+    init_jobs_table(cursor)
+
+    # Create metadata table holding the data version counter
+    init_meta_table(cursor)
+
+    conn.commit()
+    return migrate(conn)
+
+
+def full_table_scans(conn, sql, params=()):
+    """Return the EXPLAIN QUERY PLAN lines of `sql` that read a whole table.
+
+    That is a scan without an index, or one that reads all of a covering index
+    (as cheap per row, but still every row). A scan in index order only counts
+    as partial when the query has a LIMIT to stop it and no temp B-tree sorts
+    its rows first; otherwise it reads the whole index too. Virtual tables
+    (the FTS5 search index) are not counted, they answer MATCH through their
+    own index.
+    """
+    plan = [row[-1] for row in conn.execute(f'EXPLAIN QUERY PLAN {sql}', params).fetchall()]
+    bounded = (re.search(r'\bLIMIT\b', sql, re.IGNORECASE) is not None
+               and not any(line.startswith('USE TEMP B-TREE') for line in plan))
+    return [line for line in plan
+            if line.startswith('SCAN ') and ' VIRTUAL TABLE ' not in line
+            and (' USING ' not in line or ' USING COVERING INDEX ' in line
+                 or (' USING INDEX ' in line and not bounded))]
+
+
+def init_meta_table(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS app_meta (
+            key TEXT PRIMARY KEY,
+            value INTEGER NOT NULL
+        )
+    ''')
+    cursor.execute("INSERT OR IGNORE INTO app_meta (key, value) VALUES ('data_version', 0)")
+    cursor.execute("INSERT OR IGNORE INTO app_meta (key, value) VALUES ('data_updated_at', strftime('%s', 'now'))")
+
+
+def get_data_version(cursor):
+    cursor.execute("SELECT value FROM app_meta WHERE key = 'data_version'")
+    row = cursor.fetchone()
+    return row[0] if row else 0
+
+
+def get_data_state(cursor):
+    """Return (data_version, unix time of the last write) in one lookup"""
+    cursor.execute("SELECT key, value FROM app_meta WHERE key IN ('data_version', 'data_updated_at')")
+    state = dict(cursor.fetchall())
+    return state.get('data_version', 0), state.get('data_updated_at', 0)
+
+
+def bump_data_version(cursor):
+    """Invalidate everything derived from the database; call inside the write transaction"""
+    cursor.execute("UPDATE app_meta SET value = value + 1 WHERE key = 'data_version'")
+    cursor.execute("UPDATE app_meta SET value = strftime('%s', 'now') WHERE key = 'data_updated_at'")
+    if has_app_context():
+        # Lets teardown hooks (the static export) know this request wrote something
+        g.data_written = True
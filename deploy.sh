@@ -25,6 +25,23 @@ fi
 
 echo "✓ Environment file ready"
 
+# docker-compose used to mount ./reading_challenge.db itself; it now mounts ./data, so an
+# existing database moves there (with its WAL files) before the new containers start
+if [[ -f "reading_challenge.db" && ! -e "data/reading_challenge.db" ]]; then
+    if command -v docker >/dev/null && [[ -n "$(docker compose ps -q web 2>/dev/null)" ]]; then
+        echo "Error: stop the running containers (docker compose down) before the database is moved"
+        exit 1
+    fi
+    echo "Moving reading_challenge.db into ./data..."
+    mkdir -p data
+    for file in reading_challenge.db reading_challenge.db-wal reading_challenge.db-shm; do
+        if [[ -f "$file" ]]; then
+            mv "$file" data/
+        fi
+    done
+    echo "✓ Database moved to data/reading_challenge.db"
+fi
+
 # Install/update dependencies
 echo "Installing dependencies..."
 pip install -r requirements.txt
@@ -58,8 +75,9 @@ echo "   railway add"
 echo "   railway up"
 echo
 echo "3. Docker Deployment:"
-echo "   docker build -t reading-challenge ."
-echo "   docker run -d -p 8000:8000 --env-file .env reading-challenge"
+echo "   docker compose up -d --build"
+echo "   (or: docker build -t reading-challenge . && docker run -d -p 8000:8000 --env-file .env \\"
+echo "        -v \$PWD/data:/app/data -e DATABASE_PATH=/app/data/reading_challenge.db reading-challenge)"
 echo
 echo "4. Local Production Test:"
 echo "   ~/.local/bin/gunicorn -w 4 -b 0.0.0.0:8000 wsgi:app"
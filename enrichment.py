@@ -0,0 +1,389 @@
+"""Book metadata enrichment: cover, ISBN, page count, subjects.
+
+Lookups are scheduled with asyncio and go through a chain of providers.
+Each provider answers what it can, and the next one is only asked about
+books that still miss a field it supplies. ``OpenLibraryProvider`` comes
+first. It asks about several books per request with one OR query over
+(title AND author) pairs, so a batch of ten books usually costs one round
+trip. Books the batch query does not match exactly are retried with the
+fuzzier per-book search. ``GoogleBooksProvider`` is the fallback.
+
+The HTTP calls are made with the shared ``requests`` session in a bounded
+thread pool, paced by the per-host rate limiter from ``covers.py`` and
+retried with backoff. Everything found for a book is written to ``books``
+in one UPDATE, batched into one transaction per chunk.
+A ``CoverCache`` remembers the answers across database rebuilds.
+
+A provider is a ``MetadataProvider`` subclass with a ``name``, the
+``fields`` it can supply and an async ``lookup(books)``. Register it in
+``PROVIDERS`` to make it available to ``ENRICHMENT_PROVIDERS``.
+"""
+import asyncio
+import re
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+import db
+from covers import COVER_URL_TEMPLATE, RETRY_STATUSES, RateLimiter, new_session, normalize_title_author
+from db import bump_data_version
+
+METADATA_FIELDS = ('cover_url', 'isbn', 'page_count', 'subjects', 'ol_key')
+
+# Subjects kept per book
+MAX_SUBJECTS = 8
+
+# An unknown field is bound as NULL and keeps the current value; a new cover_url drops the stored copies.
+# Only a complete answer (every provider asked replied) from a provider that knew the book marks it
+# enriched; a complete "nobody knows it" leaves it unenriched until :retry_at
+STORE_METADATA_SQL = '''
+    UPDATE books SET
+        cover_original = CASE WHEN :cover_url IS NOT NULL AND :cover_url IS NOT cover_url
+                              THEN NULL ELSE cover_original END,
+        cover_thumb = CASE WHEN :cover_url IS NOT NULL AND :cover_url IS NOT cover_url
+                           THEN NULL ELSE cover_thumb END,
+        cover_url = COALESCE(:cover_url, cover_url),
+        isbn = COALESCE(:isbn, isbn),
+        page_count = COALESCE(:page_count, page_count),
+        subjects = COALESCE(:subjects, subjects),
+        ol_key = COALESCE(:ol_key, ol_key),
+        metadata_source = COALESCE(:source, metadata_source),
+        enriched_at = CASE WHEN NOT :complete THEN enriched_at
+                           WHEN :source IS NOT NULL THEN CURRENT_TIMESTAMP END,
+        enrich_after = CASE WHEN :complete AND :source IS NULL THEN :retry_at END
+    WHERE id = :id
+'''
+
+
+def _normalize(text):
+    return ' '.join(re.sub(r'[^\w\s]', ' ', text or '').lower().split())
+
+
+def _pick_isbn(isbns):
+    """Prefer an ISBN-13 over an ISBN-10"""
+    isbns = [isbn for isbn in isbns or () if isbn]
+    return next((isbn for isbn in isbns if len(isbn) == 13), isbns[0] if isbns else None)
+
+
+def _subjects(subjects):
+    return '; '.join(subjects[:MAX_SUBJECTS]) if subjects else None
+
+
+class HttpClient:
+    """JSON GETs for the providers: bounded concurrency, per-host rate limit and retries"""
+
+    def __init__(self, concurrency=8, rate_limit=5.0, retries=3, backoff=0.5, timeout=15):
+        self.concurrency = max(1, int(concurrency))
+        self.retries = max(0, int(retries))
+        self.backoff = backoff
+        self.timeout = timeout
+        self.rate_limiter = RateLimiter(rate_limit)
+        self._executor = ThreadPoolExecutor(max_workers=self.concurrency)
+
+        self.session = new_session(self.concurrency)
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(
+            concurrency=config['COVER_FETCH_CONCURRENCY'],
+            rate_limit=config['COVER_FETCH_RATE_LIMIT'],
+            retries=config['COVER_FETCH_RETRIES'],
+            backoff=config['COVER_FETCH_BACKOFF'],
+            timeout=config['COVER_FETCH_TIMEOUT'],
+        )
+
+    def close(self):
+        self._executor.shutdown()
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _get(self, url, host):
+        self.rate_limiter.wait(host)
+        return self.session.get(url, timeout=self.timeout)
+
+    async def get_json(self, url):
+        """GET `url` and decode it, raises requests.RequestException once the retries are used up"""
+        host = urllib.parse.urlsplit(url).netloc
+        loop = asyncio.get_running_loop()
+        for attempt in range(self.retries + 1):
+            try:
+                response = await loop.run_in_executor(self._executor, self._get, url, host)
+            except requests.RequestException:
+                if attempt == self.retries:
+                    raise
+            else:
+                if response.status_code not in RETRY_STATUSES or attempt == self.retries:
+                    response.raise_for_status()
+                    return response.json()
+            await asyncio.sleep(self.backoff * (2 ** attempt))
+
+
+class MetadataProvider:
+    """A source of book metadata.
+
+    ``lookup(books)`` takes (id, title, author) rows and returns a dict from
+    book id to the fields found (keys from METADATA_FIELDS, missing or None
+    when unknown), or None when the source definitively does not know the
+    book. Books the source could not be asked about (network errors) are left
+    out, so they are tried again next time.
+    """
+    name = None
+    fields = METADATA_FIELDS
+
+    def __init__(self, http):
+        self.http = http
+
+    async def lookup(self, books):
+        raise NotImplementedError
+
+
+class OpenLibraryProvider(MetadataProvider):
+    """Open Library search API, several books per request"""
+    name = 'openlibrary'
+    search_fields = 'key,title,author_name,cover_i,isbn,number_of_pages_median,subject'
+    # Results requested per book in a batch, editions of other books can match too
+    docs_per_book = 3
+
+    def __init__(self, http, search_url, batch_size=10):
+        super().__init__(http)
+        self.search_url = search_url
+        self.batch_size = max(1, int(batch_size))
+
+    @staticmethod
+    def _metadata(doc):
+        return {
+            'cover_url': COVER_URL_TEMPLATE.format(doc['cover_i']) if doc.get('cover_i') else None,
+            'isbn': _pick_isbn(doc.get('isbn')),
+            'page_count': doc.get('number_of_pages_median'),
+            'subjects': _subjects(doc.get('subject')),
+            'ol_key': doc.get('key'),
+        }
+
+    @staticmethod
+    def _matches(doc, title, author):
+        if _normalize(doc.get('title')) != _normalize(title):
+            return False
+        surname = _normalize(author).split()[-1:] or ['']
+        return any(surname[0] in _normalize(name) for name in doc.get('author_name') or [''])
+
+    def _batch_query(self, books):
+        clauses = []
+        for _, title, author in books:
+            clean_title, clean_author = normalize_title_author(title, author)
+            clause = f'title:"{clean_title}"'
+            surname = clean_author.split()[-1:]
+            if surname:
+                clause = f'({clause} AND author:{surname[0]})'
+            clauses.append(clause)
+        query = urllib.parse.urlencode({
+            'q': ' OR '.join(clauses),
+            'fields': self.search_fields,
+            'limit': len(books) * self.docs_per_book,
+        })
+        return f'{self.search_url}?{query}'
+
+    def _single_query(self, title, author):
+        clean_title, clean_author = normalize_title_author(title, author)
+        query = urllib.parse.urlencode({'title': clean_title, 'author': clean_author,
+                                        'fields': self.search_fields, 'limit': 1})
+        return f'{self.search_url}?{query}'
+
+    async def _lookup_batch(self, books):
+        try:
+            docs = (await self.http.get_json(self._batch_query(books))).get('docs', [])
+        except (requests.RequestException, ValueError) as e:
+            print(f"Open Library batch lookup failed for {len(books)} books: {e}")
+            return {}, list(books)
+
+        found = {}
+        unmatched = []
+        for book_id, title, author in books:
+            # Prefer a matching work that has a cover
+            matches = [doc for doc in docs if self._matches(doc, title, author)]
+            matches.sort(key=lambda doc: not doc.get('cover_i'))
+            if matches:
+                found[book_id] = self._metadata(matches[0])
+            else:
+                unmatched.append((book_id, title, author))
+        return found, unmatched
+
+    async def _lookup_single(self, book_id, title, author):
+        try:
+            docs = (await self.http.get_json(self._single_query(title, author))).get('docs', [])
+        except (requests.RequestException, ValueError) as e:
+            print(f"Open Library lookup failed for '{title}' by {author}: {e}")
+            return book_id, False, None
+        return book_id, True, self._metadata(docs[0]) if docs else None
+
+    async def lookup(self, books):
+        batches = [books[start:start + self.batch_size] for start in range(0, len(books), self.batch_size)]
+        results = await asyncio.gather(*(self._lookup_batch(batch) for batch in batches))
+
+        found = {}
+        unmatched = []
+        for batch_found, batch_unmatched in results:
+            found.update(batch_found)
+            unmatched.extend(batch_unmatched)
+
+        # Titles that differ slightly from Open Library's get the fuzzier per-book search
+        singles = await asyncio.gather(*(self._lookup_single(*book) for book in unmatched))
+        for book_id, answered, metadata in singles:
+            if answered:
+                found[book_id] = metadata
+        return found
+
+
+class GoogleBooksProvider(MetadataProvider):
+    """Google Books volumes API, one request per book"""
+    name = 'googlebooks'
+    fields = ('cover_url', 'isbn', 'page_count', 'subjects')
+
+    def __init__(self, http, api_url):
+        super().__init__(http)
+        self.api_url = api_url
+
+    @staticmethod
+    def _metadata(volume):
+        info = volume.get('volumeInfo', {})
+        identifiers = {entry.get('type'): entry.get('identifier') for entry in info.get('industryIdentifiers', [])}
+        thumbnail = info.get('imageLinks', {}).get('thumbnail')
+        return {
+            'cover_url': thumbnail.replace('http://', 'https://', 1) if thumbnail else None,
+            'isbn': identifiers.get('ISBN_13') or identifiers.get('ISBN_10'),
+            'page_count': info.get('pageCount'),
+            'subjects': _subjects(info.get('categories')),
+        }
+
+    async def _lookup_one(self, book_id, title, author):
+        clean_title, clean_author = normalize_title_author(title, author)
+        query = urllib.parse.urlencode({'q': f'intitle:{clean_title} inauthor:{clean_author}', 'maxResults': 1})
+        try:
+            items = (await self.http.get_json(f'{self.api_url}?{query}')).get('items') or []
+        except (requests.RequestException, ValueError) as e:
+            print(f"Google Books lookup failed for '{title}' by {author}: {e}")
+            return book_id, False, None
+        return book_id, True, self._metadata(items[0]) if items else None
+
+    async def lookup(self, books):
+        results = await asyncio.gather(*(self._lookup_one(*book) for book in books))
+        return {book_id: metadata for book_id, answered, metadata in results if answered}
+
+
+PROVIDERS = {
+    'openlibrary': lambda http, config: OpenLibraryProvider(http, config['OPENLIBRARY_API_URL'],
+                                                            batch_size=config['ENRICHMENT_BATCH_SIZE']),
+    'googlebooks': lambda http, config: GoogleBooksProvider(http, config['GOOGLE_BOOKS_API_URL']),
+}
+
+
+def providers_from_config(http, config):
+    """Instantiate the providers named in ENRICHMENT_PROVIDERS, in order"""
+    names = [name.strip() for name in config['ENRICHMENT_PROVIDERS'].split(',') if name.strip()]
+    unknown = [name for name in names if name not in PROVIDERS]
+    if unknown:
+        raise ValueError(f"Unknown enrichment providers: {', '.join(unknown)}")
+    return [PROVIDERS[name](http, config) for name in names]
+
+
+async def enrich(books, providers):
+    """Ask each provider in turn about the books still missing one of its fields.
+
+    Returns ({id: metadata}, complete ids); metadata carries the name of the
+    first provider that knew the book as 'source'. A book is complete once
+    every provider it was pending for has answered: one that could not be
+    asked (network errors) may still know a missing field, so the book must
+    be tried again.
+    """
+    metadata = {book_id: {} for book_id, _, _ in books}
+    asked = set()
+    unanswered = set()
+    for provider in providers:
+        pending = [book for book in books
+                   if any(metadata[book[0]].get(field) is None for field in provider.fields)]
+        if not pending:
+            break
+        results = await provider.lookup(pending)
+        asked.update(book_id for book_id, _, _ in pending)
+        unanswered.update(book_id for book_id, _, _ in pending if book_id not in results)
+        for book_id, found in results.items():
+            if not found:
+                continue
+            for field, value in found.items():
+                if value is not None and metadata[book_id].get(field) is None:
+                    metadata[book_id][field] = value
+            metadata[book_id].setdefault('source', provider.name)
+    return metadata, asked - unanswered
+
+
+def _store(conn, metadata, complete, retry_after):
+    retry_at = time.time() + retry_after
+    rows = [{'id': book_id, 'source': None, **dict.fromkeys(METADATA_FIELDS), **fields,
+             'complete': book_id in complete, 'retry_at': retry_at}
+            for book_id, fields in metadata.items()]
+    with conn:
+        conn.executemany(STORE_METADATA_SQL, rows)
+        bump_data_version(conn)
+
+
+async def _enrich_books(db_path, books, providers, chunk_size, cache, progress, retry_after):
+    conn = db.connect(db_path)
+    done_count = 0
+    found_count = 0
+    try:
+        for start in range(0, len(books), chunk_size):
+            chunk = books[start:start + chunk_size]
+            known = {}
+            complete = set()
+            misses = []
+            for book_id, title, author in chunk:
+                hit, cached = cache.get_metadata(title, author) if cache is not None else (False, None)
+                if hit:
+                    known[book_id] = cached
+                    complete.add(book_id)
+                else:
+                    misses.append((book_id, title, author))
+
+            if misses:
+                metadata, answered = await enrich(misses, providers)
+                for book_id, title, author in misses:
+                    if book_id in answered:
+                        known[book_id] = metadata[book_id]
+                        complete.add(book_id)
+                        if cache is not None:
+                            cache.put_metadata(title, author, metadata[book_id])
+                    elif metadata[book_id]:
+                        # Partial answers are kept, but neither cached nor marked enriched
+                        known[book_id] = metadata[book_id]
+
+            # Books some provider could not be asked about stay unenriched and are retried next time
+            if known:
+                _store(conn, known, complete, retry_after)
+            if cache is not None:
+                cache.flush()
+            done_count += len(chunk)
+            found_count += sum(1 for fields in known.values() if fields)
+            if progress is not None:
+                progress(done=done_count, found=found_count)
+    finally:
+        conn.close()
+    return found_count
+
+
+def enrich_books(db_path, books, providers, chunk_size=80, cache=None, progress=None, retry_after=None):
+    """Enrich (id, title, author) rows and store the results, committing once per chunk.
+
+    `progress(done=..., found=...)` is called after every chunk. Books no
+    provider knew are selected again by UNENRICHED_BOOKS_QUERY `retry_after`
+    seconds later (default: when the cache forgets them, or at once without a
+    cache). Returns the number of books some provider knew.
+    """
+    if retry_after is None:
+        retry_after = cache.negative_ttl if cache is not None else 0
+    return asyncio.run(_enrich_books(db_path, list(books), providers, chunk_size, cache, progress, retry_after))
@@ -0,0 +1,15 @@
+"""Gunicorn settings, read from the working directory (Dockerfile, Procfile).
+
+With --preload the app is imported once in the master, before the workers
+fork. Threads started there would not run in the workers, and a worker could
+inherit a lock one of them held mid-operation, so the app leaves its
+background threads to this hook, which runs in every worker after the fork.
+"""
+import os
+
+os.environ['BACKGROUND_WORK_AFTER_FORK'] = '1'
+
+
+def post_fork(server, worker):
+    import app
+    app.start_background_work()
@@ -0,0 +1,250 @@
+"""Reading history: books read per day, week, month or year, and the pace toward the goal.
+
+``reading_rollups`` (migration 11) holds the number of books read in every
+day, week (starting Monday), month and year, per reader and for everyone
+(``reader_id`` 0), per century and for ``'all'``. A trigger on
+``reading_events`` adds each mark and takes each unmark back from the
+buckets of its read date (UTC), so the table is always current and no page
+ever aggregates the event log. Marks without a date sit in bucket ``''``,
+before every date.
+
+A chart is one query over the primary key: the buckets in its range, plus
+what was read before the range, summed from the years, months and days
+before its first bucket. Its cost depends on the range and the number of
+readers shown, not on how many books were ever marked.
+"""
+from datetime import date, datetime, timedelta, timezone
+
+from queries import CENTURIES
+from readers import TOP_READERS_QUERY, get_reader, reader_color
+from stats import get_stats
+
+PERIODS = ('day', 'week', 'month', 'year')
+# Buckets shown when the range has no start, and the most one chart may have
+DEFAULT_BUCKETS = {'day': 30, 'week': 26, 'month': 24, 'year': 10}
+MAX_BUCKETS = 400
+# Readers charted next to everyone when no reader is picked
+HISTORY_READERS = 6
+# Average length of each period in days, for paces and projections
+PERIOD_DAYS = {'day': 1, 'week': 7, 'month': 365.25 / 12, 'year': 365.25}
+
+EVERYONE = {'id': 0, 'username': None, 'name': 'Everyone'}
+
+
+def build_history_query(reader_count):
+    """Rollup rows of the chart's buckets, and one "before the range" row ('') per reader"""
+    readers = ', '.join(f':reader{index}' for index in range(reader_count))
+    before = '''
+        SELECT reader_id, '' AS bucket_start, SUM(books) FROM reading_rollups
+        WHERE period = '{period}' AND century = :century AND reader_id IN ({readers})
+          AND bucket_start >= {low} AND bucket_start < {high}
+        GROUP BY reader_id'''
+    return '\n        UNION ALL'.join([
+        f'''
+        SELECT reader_id, bucket_start, books FROM reading_rollups
+        WHERE period = :period AND century = :century AND reader_id IN ({readers})
+          AND bucket_start >= :first AND bucket_start < :after''',
+        # Years before the first bucket's year (and undated marks), then its year's months, then its month's days
+        before.format(period='year', readers=readers, low="''", high=':year_start'),
+        before.format(period='month', readers=readers, low=':year_start', high=':month_start'),
+        before.format(period='day', readers=readers, low=':month_start', high=':first'),
+    ])
+
+
+def bucket_start(period, day):
+    """First day of the `period` bucket holding `day`"""
+    if period == 'week':
+        return day - timedelta(days=day.weekday())
+    if period == 'month':
+        return day.replace(day=1)
+    if period == 'year':
+        return day.replace(month=1, day=1)
+    return day
+
+
+def next_bucket(period, start):
+    if period == 'week':
+        return start + timedelta(days=7)
+    if period == 'month':
+        return date(start.year + start.month // 12, start.month % 12 + 1, 1)
+    if period == 'year':
+        return date(start.year + 1, 1, 1)
+    return start + timedelta(days=1)
+
+
+def previous_bucket(period, start):
+    if period == 'week':
+        return start - timedelta(days=7)
+    if period == 'month':
+        return date(start.year - (start.month == 1), (start.month - 2) % 12 + 1, 1)
+    if period == 'year':
+        return date(start.year - 1, 1, 1)
+    return start - timedelta(days=1)
+
+
+def today():
+    """The current date in UTC, the time zone of read_at"""
+    return datetime.now(timezone.utc).date()
+
+
+def parse_date(value, name):
+    if not value:
+        return None
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        raise ValueError(f'{name} must be a date (YYYY-MM-DD)')
+
+
+def challenge_deadline(config):
+    """CHALLENGE_DEADLINE as a date, or None"""
+    return parse_date(config['CHALLENGE_DEADLINE'], 'CHALLENGE_DEADLINE')
+
+
+def history_buckets(period, start=None, end=None, current=None):
+    """Bucket starts from the one holding `start` to the one holding `end` (default: today).
+
+    Without a start the range is DEFAULT_BUCKETS long; a range longer than
+    MAX_BUCKETS keeps its last MAX_BUCKETS buckets.
+    """
+    last = bucket_start(period, end or current or today())
+    first = last
+    if start:
+        first = bucket_start(period, start)
+        if first > last:
+            raise ValueError('start must not be after end')
+    else:
+        for _ in range(DEFAULT_BUCKETS[period] - 1):
+            first = previous_bucket(period, first)
+
+    buckets = [last]
+    while buckets[-1] > first and len(buckets) < MAX_BUCKETS:
+        buckets.append(previous_bucket(period, buckets[-1]))
+    return buckets[::-1]
+
+
+def history_readers(cursor, username=None):
+    """Everyone, plus the reader `username` or the readers who read most (LookupError for an unknown one)"""
+    if username:
+        reader = get_reader(cursor, username)
+        if reader is None:
+            raise LookupError('Reader not found')
+        return [EVERYONE, {'id': reader['id'], 'username': reader['username'], 'name': reader['name']}]
+    cursor.execute(TOP_READERS_QUERY, (HISTORY_READERS,))
+    return [EVERYONE] + [{'id': reader_id, 'username': username, 'name': name}
+                         for reader_id, username, name, _ in cursor.fetchall()]
+
+
+def get_history(cursor, period='month', century='all', username=None, start=None, end=None,
+                deadline=None, current=None):
+    """Books read per bucket and cumulatively for everyone and the charted readers.
+
+    `start`, `end` and `deadline` are dates or None; raises ValueError for
+    a bad period, century or range and LookupError for an unknown reader.
+    """
+    if period not in PERIODS:
+        raise ValueError(f"period must be one of {', '.join(PERIODS)}")
+    if century not in CENTURIES:
+        raise ValueError(f"century must be one of {', '.join(CENTURIES)}")
+    current = current or today()
+    buckets = history_buckets(period, start, end, current)
+    readers = history_readers(cursor, username)
+
+    params = {
+        'period': period,
+        'century': century,
+        'first': buckets[0].isoformat(),
+        'after': next_bucket(period, buckets[-1]).isoformat(),
+        'year_start': bucket_start('year', buckets[0]).isoformat(),
+        'month_start': bucket_start('month', buckets[0]).isoformat(),
+        **{f'reader{index}': reader['id'] for index, reader in enumerate(readers)},
+    }
+    before = {reader['id']: 0 for reader in readers}
+    counts = {reader['id']: {} for reader in readers}
+    for reader_id, bucket, books in cursor.execute(build_history_query(len(readers)), params):
+        if bucket:
+            counts[reader_id][bucket] = books
+        else:
+            before[reader_id] += books or 0
+
+    stats = get_stats(cursor)
+    goal = stats['total'] if century == 'all' else stats[f'books_{century}']
+    days_left = (deadline - current).days if deadline else None
+    series = []
+    for reader in readers:
+        read = [counts[reader['id']].get(bucket.isoformat(), 0) for bucket in buckets]
+        cumulative, total = [], before[reader['id']]
+        for books in read:
+            total += books
+            cumulative.append(total)
+        pace = sum(read) / len(buckets)
+        entry = {
+            **reader,
+            'color': reader_color(reader['id']) if reader['id'] else '#343a40',
+            'before': before[reader['id']],
+            'read': read,
+            'cumulative': cumulative,
+            'total': total,
+            'pace': round(pace, 2),
+            'remaining': None,
+            'needed': None,
+            'projected_finish': None,
+        }
+        # Everyone's marks add up several readers, the goal is each reader's
+        if reader['id']:
+            remaining = max(goal - total, 0)
+            entry['remaining'] = remaining
+            if remaining and days_left and days_left > 0:
+                entry['needed'] = round(remaining / (days_left / PERIOD_DAYS[period]), 2)
+            if remaining and pace:
+                try:
+                    finish = current + timedelta(days=remaining / pace * PERIOD_DAYS[period])
+                    entry['projected_finish'] = finish.isoformat()
+                except OverflowError:
+                    pass  # past the year 9999 at this pace
+        series.append(entry)
+
+    return {
+        'period': period,
+        'century': century,
+        'start': buckets[0].isoformat(),
+        'end': (next_bucket(period, buckets[-1]) - timedelta(days=1)).isoformat(),
+        'buckets': [bucket.isoformat() for bucket in buckets],
+        'goal': goal,
+        'deadline': deadline.isoformat() if deadline else None,
+        'series': series,
+    }
+
+
+def bucket_label(period, bucket):
+    day = date.fromisoformat(bucket)
+    if period == 'year':
+        return str(day.year)
+    if period == 'month':
+        return day.strftime('%b %Y')
+    return f"{day.day} {day.strftime('%b')}"
+
+
+def chart(history, series, values, width=720, height=240, max_labels=8):
+    """SVG coordinates for plotting `values` ('read' or 'cumulative') of the entries in `series`"""
+    buckets = history['buckets']
+    top = max([max(entry[values]) for entry in series] + [1])
+    step = width / max(len(buckets) - 1, 1)
+
+    def y(value):
+        return round(height - value / top * height, 1)
+
+    lines = [{
+        'name': entry['name'],
+        'color': entry['color'],
+        'points': ' '.join(f'{round(index * step, 1)},{y(value)}' for index, value in enumerate(entry[values])),
+    } for entry in series]
+    every = max(1, -(-len(buckets) // max_labels))
+    return {
+        'width': width,
+        'height': height,
+        'lines': lines,
+        'x_labels': [(round(index * step, 1), bucket_label(history['period'], bucket))
+                     for index, bucket in enumerate(buckets) if index % every == 0],
+        'y_labels': [(y(top * fraction), round(top * fraction)) for fraction in ((0, 0.5, 1) if top > 1 else (0, 1))],
+    }
@@ -0,0 +1,140 @@
+"""Conditional GET and response caching for the read-only pages.
+
+Pages only change when a write bumps the database's data version or a
+deploy changes the code, templates or ``flask build`` bundles, so the
+version and a hash of those files (plus the page, its query arguments and,
+for pages with login dependent content, the user) make a strong ETag. A request carrying a
+matching ``If-None-Match`` or a fresh ``If-Modified-Since`` gets a 304
+without running the view. Otherwise the rendered body is served from an
+in-process cache if it was rendered for the same ETag. Only the one
+``app_meta`` lookup per request touches SQLite.
+
+Anonymous responses are marked ``public`` so nginx can micro-cache them;
+logged-in responses are ``private``.
+"""
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone
+from functools import wraps
+
+from flask import make_response, request, session
+from flask_login import current_user
+
+from db import get_data_state, get_db
+
+# Rendered pages kept per process
+MAX_ENTRIES = 256
+
+_APP_DIR = os.path.dirname(os.path.abspath(__file__))
+_TEMPLATE_DIR = os.path.join(_APP_DIR, 'templates')
+# Written by `flask build`; pages link the bundle files it names
+_ASSET_MANIFEST = os.path.join(_APP_DIR, 'static', 'dist', 'manifest.json')
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def _build_files():
+    """The app's modules, its templates and the asset manifest: everything a page is made from"""
+    paths = [os.path.join(_APP_DIR, name) for name in os.listdir(_APP_DIR) if name.endswith('.py')]
+    paths += [os.path.join(root, name) for root, _, names in os.walk(_TEMPLATE_DIR) for name in names]
+    if os.path.exists(_ASSET_MANIFEST):
+        paths.append(_ASSET_MANIFEST)
+    return sorted(paths)
+
+
+def _build_id():
+    """Changes whenever the code, templates or bundles are deployed, so old ETags stop matching.
+
+    Returns (id, unix time of the newest file); the id hashes file contents, so
+    every worker and replica of one image agrees on it.
+    """
+    digest = hashlib.sha1()
+    newest = 0
+    for path in _build_files():
+        digest.update(os.path.relpath(path, _APP_DIR).encode())
+        with open(path, 'rb') as f:
+            digest.update(f.read())
+        newest = max(newest, os.stat(path).st_mtime)
+    return digest.hexdigest()[:12], newest
+
+
+BUILD_ID, BUILD_TIME = _build_id()
+
+
+def _cache_key(vary_args, vary_user):
+    user = current_user.get_id() if vary_user and current_user.is_authenticated else None
+    args = tuple(request.args.get(name, '') for name in vary_args)
+    return request.path, args, user
+
+
+def _etag(key, version):
+    digest = hashlib.sha1(repr((BUILD_ID, key, version)).encode()).hexdigest()
+    return f'{version}-{digest[:16]}'
+
+
+def _not_modified(etag, last_modified):
+    if request.if_none_match:
+        return request.if_none_match.contains(etag)
+    return request.if_modified_since is not None and last_modified <= request.if_modified_since
+
+
+def _add_headers(response, etag, last_modified, user):
+    response.set_etag(etag)
+    response.last_modified = last_modified
+    response.headers['Cache-Control'] = 'private, no-cache' if user else 'public, no-cache'
+    response.vary.add('Cookie')
+    return response
+
+
+def cached_page(vary_args=(), vary_user=True):
+    """Decorate a GET view whose output only depends on the database and `vary_args`"""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            # Pages showing one-off flash messages are never cached
+            if '_flashes' in session:
+                return view(*args, **kwargs)
+
+            try:
+                version, updated_at = get_data_state(get_db().cursor())
+            except Exception:
+                # Database not initialized yet, let the view handle it
+                return view(*args, **kwargs)
+
+            key = _cache_key(vary_args, vary_user)
+            etag = _etag(key, version)
+            # A deploy counts as a change too, for clients that only send If-Modified-Since
+            last_modified = datetime.fromtimestamp(int(max(updated_at, BUILD_TIME)), timezone.utc)
+            user = key[2]
+
+            if _not_modified(etag, last_modified):
+                return _add_headers(make_response('', 304), etag, last_modified, user)
+
+            with _cache_lock:
+                cached = _cache.get(key)
+                if cached and cached[0] == etag:
+                    _cache.move_to_end(key)
+                    body = cached[1]
+                else:
+                    body = None
+
+            if body is None:
+                response = make_response(view(*args, **kwargs))
+                # Only cache plain pages, not redirects or pages that just flashed
+                if response.status_code != 200 or '_flashes' in session:
+                    return response
+                body = response.get_data()
+                with _cache_lock:
+                    _cache[key] = (etag, body)
+                    _cache.move_to_end(key)
+                    while len(_cache) > MAX_ENTRIES:
+                        _cache.popitem(last=False)
+            else:
+                response = make_response(body)
+
+            return _add_headers(response, etag, last_modified, user)
+        return wrapper
+    return decorator
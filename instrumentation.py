@@ -0,0 +1,257 @@
+"""Opt-in request profiling: SQL, template and outbound HTTP timings.
+
+Enabled with ``INSTRUMENTATION=1``. When it is off, ``init_app()`` returns
+before registering anything, so requests run exactly as without it.
+
+When it is on:
+
+- request connections from ``db.get_db()`` use a cursor that times every
+  ``execute``/``executemany`` and ``fetch*`` call (rows pulled by iterating
+  over a cursor are not timed),
+- template rendering is timed through Flask's render signals,
+- responses from the instrumented ``requests`` sessions (cover lookups and
+  cover downloads) are timed with ``response.elapsed``,
+- every response gets a ``Server-Timing`` header (visible in the browser's
+  network panel) and requests slower than ``INSTRUMENTATION_SLOW_MS`` are
+  printed with their breakdown,
+- ``/metrics`` serves Prometheus histograms per route, per template and per
+  outbound host, to logged-in readers and to scrapers sending
+  ``Authorization: Bearer <METRICS_TOKEN>``; everyone else gets a 404.
+
+Metrics are kept per process; with several gunicorn workers each scrape
+sees the worker that answered it. Streamed responses are timed up to the
+point the body starts streaming.
+"""
+import hmac
+import sqlite3
+import threading
+import time
+import urllib.parse
+
+from flask import (Response, abort, before_render_template, current_app, g, has_request_context, request,
+                   template_rendered)
+from flask_login import current_user
+
+# Prometheus' default buckets, in seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+METRICS_PREFIX = 'reading_challenge'
+
+_enabled = False
+
+
+class Histogram:
+    """Cumulative-bucket latency histogram with one series per label tuple"""
+
+    def __init__(self, name, help_text, label_names):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, labels, seconds):
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * len(BUCKETS), 0, 0.0]
+            buckets = series[0]
+            for index, bound in enumerate(BUCKETS):
+                if seconds <= bound:
+                    buckets[index] += 1
+            series[1] += 1
+            series[2] += seconds
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            series = sorted((labels, (list(buckets), count, total))
+                            for labels, (buckets, count, total) in self._series.items())
+        for labels, (buckets, count, total) in series:
+            label_text = ','.join(f'{name}="{_escape(value)}"' for name, value in zip(self.label_names, labels))
+            prefix = label_text + ',' if label_text else ''
+            for bound, bucket_count in zip(BUCKETS, buckets):
+                lines.append(f'{self.name}_bucket{{{prefix}le="{bound}"}} {bucket_count}')
+            lines.append(f'{self.name}_bucket{{{prefix}le="+Inf"}} {count}')
+            lines.append(f'{self.name}_sum{{{label_text}}} {total:.6f}')
+            lines.append(f'{self.name}_count{{{label_text}}} {count}')
+        return '\n'.join(lines)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+REQUEST_SECONDS = Histogram(f'{METRICS_PREFIX}_request_duration_seconds',
+                            'Time to handle a request, by route', ('endpoint', 'method', 'status'))
+QUERY_SECONDS = Histogram(f'{METRICS_PREFIX}_db_query_duration_seconds',
+                          'Time spent in one SQLite call, by route', ('endpoint',))
+TEMPLATE_SECONDS = Histogram(f'{METRICS_PREFIX}_template_render_duration_seconds',
+                             'Time to render a template', ('template',))
+OUTBOUND_SECONDS = Histogram(f'{METRICS_PREFIX}_outbound_request_duration_seconds',
+                             'Time until an outbound HTTP response arrived, by host', ('host', 'status'))
+HISTOGRAMS = (REQUEST_SECONDS, QUERY_SECONDS, TEMPLATE_SECONDS, OUTBOUND_SECONDS)
+
+
+def _endpoint():
+    return request.url_rule.endpoint if request.url_rule is not None else 'unmatched'
+
+
+def _add_timing(kind, seconds):
+    """Add to the current request's totals for `kind` ('db', 'template' or 'http')"""
+    timings = g.get('request_timings')
+    if timings is not None:
+        entry = timings[kind]
+        entry[0] += 1
+        entry[1] += seconds
+
+
+def _record_query(seconds):
+    if has_request_context():
+        _add_timing('db', seconds)
+        QUERY_SECONDS.observe((_endpoint(),), seconds)
+
+
+class TimedCursor(sqlite3.Cursor):
+    """Cursor that records how long each call into SQLite takes"""
+
+    def execute(self, *args):
+        start = time.perf_counter()
+        try:
+            return super().execute(*args)
+        finally:
+            _record_query(time.perf_counter() - start)
+
+    def executemany(self, *args):
+        start = time.perf_counter()
+        try:
+            return super().executemany(*args)
+        finally:
+            _record_query(time.perf_counter() - start)
+
+    def fetchone(self):
+        start = time.perf_counter()
+        try:
+            return super().fetchone()
+        finally:
+            _record_query(time.perf_counter() - start)
+
+    def fetchmany(self, *args):
+        start = time.perf_counter()
+        try:
+            return super().fetchmany(*args)
+        finally:
+            _record_query(time.perf_counter() - start)
+
+    def fetchall(self):
+        start = time.perf_counter()
+        try:
+            return super().fetchall()
+        finally:
+            _record_query(time.perf_counter() - start)
+
+
+class TimedConnection(sqlite3.Connection):
+    """Connection whose cursors (including those of conn.execute) are TimedCursors"""
+
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, *args):
+        return self.cursor().execute(*args)
+
+    def executemany(self, *args):
+        return self.cursor().executemany(*args)
+
+
+def _record_response(response, *args, **kwargs):
+    seconds = response.elapsed.total_seconds()
+    host = urllib.parse.urlsplit(response.url).netloc
+    OUTBOUND_SECONDS.observe((host, str(response.status_code)), seconds)
+    if has_request_context():
+        _add_timing('http', seconds)
+
+
+def instrument_session(session):
+    """Time the responses of a requests.Session (no-op while instrumentation is off)"""
+    if _enabled and _record_response not in session.hooks['response']:
+        session.hooks['response'].append(_record_response)
+    return session
+
+
+def _template_started(sender, template, context, **extra):
+    g.setdefault('template_starts', []).append(time.perf_counter())
+
+
+def _template_finished(sender, template, context, **extra):
+    starts = g.get('template_starts')
+    if not starts:
+        return
+    seconds = time.perf_counter() - starts.pop()
+    TEMPLATE_SECONDS.observe((template.name or 'string',), seconds)
+    _add_timing('template', seconds)
+
+
+def _start_request():
+    g.request_start = time.perf_counter()
+    g.request_timings = {'db': [0, 0.0], 'template': [0, 0.0], 'http': [0, 0.0]}
+
+
+def _finish_request(slow_ms):
+    def finish(response):
+        start = g.get('request_start')
+        if start is None:
+            return response
+        total = time.perf_counter() - start
+        timings = g.request_timings
+        endpoint = _endpoint()
+        if endpoint not in ('metrics', 'static'):
+            REQUEST_SECONDS.observe((endpoint, request.method, str(response.status_code)), total)
+
+        parts = [f'{kind};dur={seconds * 1000:.2f};desc="{label} x{count}"'
+                 for kind, label in (('db', 'SQLite'), ('template', 'Templates'), ('http', 'Outbound HTTP'))
+                 for count, seconds in [timings[kind]] if count]
+        parts.append(f'total;dur={total * 1000:.2f}')
+        response.headers['Server-Timing'] = ', '.join(parts)
+
+        if total * 1000 >= slow_ms:
+            print(f"Slow request {request.method} {request.full_path.rstrip('?')}: {total * 1000:.0f} ms "
+                  f"(db {timings['db'][1] * 1000:.0f} ms in {timings['db'][0]} calls, "
+                  f"templates {timings['template'][1] * 1000:.0f} ms, "
+                  f"outbound {timings['http'][1] * 1000:.0f} ms)")
+        return response
+    return finish
+
+
+def _may_see_metrics():
+    token = current_app.config['METRICS_TOKEN']
+    if token and hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        return True
+    return current_user.is_authenticated
+
+
+def metrics():
+    """Prometheus text exposition of every histogram (404 without a login or the token)"""
+    if not _may_see_metrics():
+        abort(404)
+    body = '\n'.join(histogram.render() for histogram in HISTOGRAMS) + '\n'
+    # nginx.conf ignores Cache-Control for its micro-cache but honours X-Accel-Expires, so a
+    # scraper's copy is never handed to the next anonymous visitor
+    return Response(body, mimetype='text/plain; version=0.0.4',
+                    headers={'Cache-Control': 'private, no-store', 'X-Accel-Expires': '0'})
+
+
+def init_app(app):
+    """Wire up the instrumentation if INSTRUMENTATION is on, otherwise do nothing"""
+    global _enabled
+    if not app.config['INSTRUMENTATION']:
+        return
+    _enabled = True
+
+    app.config['DATABASE_FACTORY'] = TimedConnection
+    app.before_request(_start_request)
+    app.after_request(_finish_request(app.config['INSTRUMENTATION_SLOW_MS']))
+    before_render_template.connect(_template_started, app)
+    template_rendered.connect(_template_finished, app)
+    app.add_url_rule('/metrics', 'metrics', metrics)
+    print("Instrumentation enabled: Server-Timing headers and /metrics")
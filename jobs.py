@@ -0,0 +1,160 @@
+"""SQLite-backed background jobs.
+
+Jobs live in the ``jobs`` table of the application database, so every
+gunicorn worker sees the same queue. A job is claimed inside a
+``BEGIN IMMEDIATE`` transaction, which serializes workers on SQLite's write
+lock: exactly one thread runs a job while everyone else can read its progress.
+"""
+import os
+import threading
+import time
+
+import db
+
+# Seconds without a heartbeat before a running job is treated as abandoned
+STALE_AFTER = 300
+# Kinds that cannot heartbeat while they work: a backup reports only once the copy is
+# done, since any write to the database (a heartbeat too) makes the copy start over
+STALE_AFTER_KIND = {'backup': 3600}
+
+JOB_FIELDS = ('id', 'kind', 'status', 'total', 'done', 'found', 'error',
+              'created_at', 'started_at', 'finished_at')
+
+LATEST_JOB_QUERY = f'''
+    SELECT {', '.join(JOB_FIELDS)} FROM jobs WHERE kind = ? ORDER BY id DESC LIMIT 1
+'''
+
+
+def init_jobs_table(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'queued',
+            total INTEGER DEFAULT 0,
+            done INTEGER DEFAULT 0,
+            found INTEGER DEFAULT 0,
+            error TEXT,
+            owner TEXT,
+            heartbeat REAL,
+            created_at REAL NOT NULL,
+            started_at REAL,
+            finished_at REAL
+        )
+    ''')
+
+
+def stale_after(kind):
+    return STALE_AFTER_KIND.get(kind, STALE_AFTER)
+
+
+def _connect(db_path):
+    # Autocommit mode, transactions are opened explicitly
+    return db.connect(db_path, timeout=30, isolation_level=None)
+
+
+def enqueue_job(db_path, kind, min_interval=None):
+    """Queue a job of `kind` unless one is already queued or running, returns its id.
+
+    With `min_interval` (seconds) no job is queued either if one of `kind`
+    was created less than that long ago; its id is returned instead.
+    """
+    conn = _connect(db_path)
+    try:
+        conn.execute('BEGIN IMMEDIATE')
+        now = time.time()
+        row = conn.execute('''
+            SELECT id FROM jobs
+            WHERE kind = ? AND (status = 'queued' OR (status = 'running' AND heartbeat > ?) OR created_at > ?)
+            ORDER BY id DESC LIMIT 1
+        ''', (kind, now - stale_after(kind), now - min_interval if min_interval else now)).fetchone()
+        if row:
+            job_id = row[0]
+        else:
+            job_id = conn.execute('INSERT INTO jobs (kind, created_at) VALUES (?, ?)',
+                                  (kind, now)).lastrowid
+        conn.execute('COMMIT')
+        return job_id
+    finally:
+        conn.close()
+
+
+def claim_job(db_path, kind, owner):
+    """Mark the oldest queued (or abandoned) job of `kind` as ours, returns its id or None"""
+    conn = _connect(db_path)
+    try:
+        conn.execute('BEGIN IMMEDIATE')
+        now = time.time()
+        if conn.execute('''
+            SELECT 1 FROM jobs WHERE kind = ? AND status = 'running' AND heartbeat > ?
+        ''', (kind, now - stale_after(kind))).fetchone():
+            conn.execute('COMMIT')
+            return None
+
+        row = conn.execute('''
+            SELECT id FROM jobs WHERE kind = ? AND status IN ('queued', 'running')
+            ORDER BY id LIMIT 1
+        ''', (kind,)).fetchone()
+        if row:
+            conn.execute('''
+                UPDATE jobs SET status = 'running', owner = ?, heartbeat = ?, started_at = ?,
+                                done = 0, found = 0
+                WHERE id = ?
+            ''', (owner, now, now, row[0]))
+        conn.execute('COMMIT')
+        return row[0] if row else None
+    finally:
+        conn.close()
+
+
+def update_job(db_path, job_id, **fields):
+    """Store progress fields for a job and refresh its heartbeat"""
+    fields['heartbeat'] = time.time()
+    assignments = ', '.join(f'{name} = ?' for name in fields)
+    conn = _connect(db_path)
+    try:
+        conn.execute(f'UPDATE jobs SET {assignments} WHERE id = ?', (*fields.values(), job_id))
+    finally:
+        conn.close()
+
+
+def get_latest_job(db_path, kind):
+    """Return the most recent job of `kind` as a dict, or None"""
+    conn = _connect(db_path)
+    try:
+        row = conn.execute(LATEST_JOB_QUERY, (kind,)).fetchone()
+    finally:
+        conn.close()
+    return dict(zip(JOB_FIELDS, row)) if row else None
+
+
+def run_pending_jobs(db_path, kind, handler):
+    """Claim and run queued jobs of `kind` until none are left.
+
+    `handler(progress)` does the work and calls ``progress(total=..., done=..., found=...)``
+    as it goes. It returns nothing; raising marks the job as failed.
+    """
+    owner = f'{os.getpid()}:{threading.get_ident()}'
+    while True:
+        job_id = claim_job(db_path, kind, owner)
+        if job_id is None:
+            return
+
+        def progress(**fields):
+            update_job(db_path, job_id, **fields)
+
+        try:
+            handler(progress)
+        except Exception as e:
+            print(f"Job {job_id} ({kind}) failed: {e}")
+            update_job(db_path, job_id, status='failed', error=str(e), finished_at=time.time())
+        else:
+            update_job(db_path, job_id, status='done', finished_at=time.time())
+
+
+def start_job_thread(db_path, kind, handler):
+    """Run pending jobs of `kind` in a daemon thread so the caller returns immediately"""
+    thread = threading.Thread(target=run_pending_jobs, args=(db_path, kind, handler),
+                              name=f'{kind}-jobs', daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,124 @@
+"""SQL shared by the page routes, the JSON API and the query plan check."""
+
+BOOK_COLUMNS = ('id', 'title', 'author', 'year', 'read_count', 'review_count', 'avg_rating',
+                'cover_url', 'order_index')
+
+# Columns of the homepage cards; cover_thumb is the locally stored thumbnail,
+# order_index continues the grid on the next page
+LIST_COLUMNS = ('id', 'title', 'author', 'year', 'read_count', 'review_count', 'avg_rating',
+                'cover_url', 'cover_thumb', 'order_index')
+
+# Cards rendered per page of the homepage grid (a multiple of 2, 3 and 4 columns)
+BOOKS_PAGE_SIZE = 48
+
+BOOK_DETAIL_QUERY = '''
+    SELECT id, title, author, year, read_count, cover_url, cover_thumb, cover_original,
+           review_count, avg_rating, rating_1, rating_2, rating_3, rating_4, rating_5,
+           isbn, page_count, subjects, ol_key
+    FROM books WHERE id = ?
+'''
+COVER_QUERY = 'SELECT cover_url, cover_thumb, cover_original FROM books WHERE id = ?'
+BOOK_REVIEWS_QUERY = '''
+    SELECT rv.reader, rv.rating, rv.review, rv.date_added, r.id AS reader_id, r.name
+    FROM reviews rv LEFT JOIN readers r ON r.username = rv.reader
+    WHERE rv.book_id = ? ORDER BY rv.date_added DESC
+    LIMIT ?
+'''
+# Reviews shown on a book's page before "show all", and ratings listed per book
+BOOK_REVIEWS_SHOWN = 20
+MAX_LATEST_RATINGS = 24
+
+# Each reader's most recent rating of a book, maintained by triggers on reviews
+LATEST_RATINGS_QUERY = f'''
+    SELECT lr.reader, lr.rating, lr.rated_at, r.id AS reader_id, r.name
+    FROM latest_ratings lr LEFT JOIN readers r ON r.username = lr.reader
+    WHERE lr.book_id = ?
+    ORDER BY lr.rated_at DESC
+    LIMIT {MAX_LATEST_RATINGS}
+'''
+# Books no metadata provider has answered for yet (covers, ISBN, pages, subjects), and books
+# nobody knew whose retry time (a unix time, the parameter is now) has come
+UNENRICHED_BOOKS_QUERY = '''
+    SELECT id, title, author FROM books
+    WHERE enriched_at IS NULL AND (enrich_after IS NULL OR enrich_after <= ?)
+'''
+
+FILTERS = ['all', 'read', 'unread', 'mine', 'todo']
+# Filters relative to one reader, they need a reader id
+READER_FILTERS = ['mine', 'todo']
+# Filters of the old two-reader list, with the usernames whose books they showed ('both': read by both)
+LEGACY_FILTERS = {'silas': ('s',), 'nadine': ('n',), 'both': ('s', 'n')}
+CENTURIES = ['all', '19th', '20th', '21st']
+# Homepage orderings, each backed by an index (unrated books sort last)
+SORTS = {
+    'list': 'b.order_index',
+    'rating': 'b.avg_rating DESC, b.review_count DESC, b.order_index',
+}
+
+
+def build_book_conditions(filter_by, century_filter):
+    """WHERE conditions for the reading status and century filters"""
+    base_conditions = []
+
+    # Apply reading status filter
+    if filter_by == 'read':
+        base_conditions.append('b.read_count > 0')
+    elif filter_by == 'unread':
+        base_conditions.append('b.read_count = 0')
+    elif filter_by == 'mine':
+        base_conditions.append('rp.reader_id IS NOT NULL')
+    elif filter_by == 'todo':
+        base_conditions.append('rp.reader_id IS NULL')
+
+    # Apply century filter
+    if century_filter == '19th':
+        base_conditions.append('b.year >= 1800 AND b.year < 1900')
+    elif century_filter == '20th':
+        base_conditions.append('b.year >= 1900 AND b.year < 2000')
+    elif century_filter == '21st':
+        base_conditions.append('b.year >= 2000')
+
+    return base_conditions
+
+
+def build_books_query(filter_by, century_filter, columns=LIST_COLUMNS, after=False, limit=False,
+                      reader=False, sort='list', offset=False):
+    """Book list query ordered by order_index, or by one of the other `sort` orders.
+
+    With `reader` the query takes a reader id parameter first and adds that
+    reader's ``read`` flag and ``read_at`` (NULL for marks without a date),
+    one primary key lookup per book; the 'mine' and 'todo' filters need it. With `after` it takes an
+    order_index parameter to continue after (keyset pagination, list order
+    only); with `limit` it takes a row count parameter, and with `offset` a
+    number of rows to skip after that (for the other orders, walking their index).
+    """
+    if filter_by in READER_FILTERS and not reader:
+        raise ValueError(f'filter {filter_by!r} needs a reader')
+    if after and sort != 'list':
+        raise ValueError('keyset pagination needs the list order')
+    if offset and not limit:
+        raise ValueError('offset needs a limit')
+
+    base_conditions = build_book_conditions(filter_by, century_filter)
+    if after:
+        base_conditions.append('b.order_index > ?')
+
+    select = [f'b.{column}' for column in columns]
+    join = ''
+    if reader:
+        select += ['rp.reader_id IS NOT NULL AS read', 'rp.read_at']
+        join = 'LEFT JOIN reading_progress rp ON rp.book_id = b.id AND rp.reader_id = ?'
+
+    # Build final query
+    where_clause = ''
+    if base_conditions:
+        where_clause = 'WHERE ' + ' AND '.join(base_conditions)
+
+    return f'''
+        SELECT {', '.join(select)} FROM books b
+        {join}
+        {where_clause}
+        ORDER BY {SORTS[sort]}
+        {'LIMIT ?' if limit else ''}
+        {'OFFSET ?' if offset else ''}
+    '''
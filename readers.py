@@ -0,0 +1,158 @@
+"""Readers (members of the reading group) and their reading progress.
+
+Each reader is a row in ``readers``; a book they have finished is a row in
+``reading_progress`` (primary key reader_id+book_id). Triggers keep two
+counters in step with it, ``books.read_count`` and ``readers.books_read``,
+so pages and stats read one counter per book or reader shown instead of
+aggregating the whole members x books progress table after every mark.
+Two more triggers append every mark and unmark to ``reading_events``, a log
+that is never updated or deleted from.
+
+The two founding readers are created by migration 5; their password hashes
+come from the config on every start (see ``sync_founding_readers``). Other
+members are added with ``flask add-reader``.
+"""
+from werkzeug.security import generate_password_hash
+
+from db import bump_data_version
+
+# username, display name, config key of the password hash
+FOUNDING_READERS = (
+    ('s', 'Silas', 'SILAS_PASSWORD_HASH'),
+    ('n', 'Nadine', 'NADINE_PASSWORD_HASH'),
+)
+
+# Badge backgrounds, picked by reader id (the founding readers keep their colors)
+READER_GRADIENTS = (
+    'linear-gradient(135deg, #11998e 0%, #38ef7d 100%)',
+    'linear-gradient(135deg, #667eea 0%, #764ba2 100%)',
+    'linear-gradient(135deg, #f7971e 0%, #ffd200 100%)',
+    'linear-gradient(135deg, #ee0979 0%, #ff6a00 100%)',
+    'linear-gradient(135deg, #00c6ff 0%, #0072ff 100%)',
+    'linear-gradient(135deg, #8e2de2 0%, #4a00e0 100%)',
+    'linear-gradient(135deg, #e52d27 0%, #b31217 100%)',
+    'linear-gradient(135deg, #56ab2f 0%, #a8e063 100%)',
+)
+
+# Solid colors for charts, the first color of each gradient
+READER_COLORS = tuple(gradient.split(', ')[1].split()[0] for gradient in READER_GRADIENTS)
+
+# Readers listed on a book's page
+MAX_BOOK_READERS = 24
+
+READER_QUERY = 'SELECT id, username, name, password_hash, books_read FROM readers WHERE username = ?'
+TOP_READERS_QUERY = '''
+    SELECT id, username, name, books_read FROM readers
+    ORDER BY books_read DESC, name
+    LIMIT ?
+'''
+BOOK_READERS_QUERY = f'''
+    SELECT r.id, r.username, r.name, rp.read_at
+    FROM reading_progress rp JOIN readers r ON r.id = rp.reader_id
+    WHERE rp.book_id = ?
+    ORDER BY rp.read_at
+    LIMIT {MAX_BOOK_READERS}
+'''
+PROGRESS_QUERY = 'SELECT read_at FROM reading_progress WHERE reader_id = ? AND book_id = ?'
+MARK_READ_SQL = '''
+    INSERT OR IGNORE INTO reading_progress (reader_id, book_id, read_at)
+    SELECT ?, id, COALESCE(?, CURRENT_TIMESTAMP) FROM books WHERE id = ?
+'''
+# Puts back a mark recorded without a date (before read_at was kept), as it was
+MARK_UNDATED_SQL = '''
+    INSERT OR IGNORE INTO reading_progress (reader_id, book_id, read_at)
+    SELECT ?, id, NULL FROM books WHERE id = ?
+'''
+UNMARK_READ_SQL = 'DELETE FROM reading_progress WHERE reader_id = ? AND book_id = ? RETURNING read_at'
+
+# read_at for update_progress() that marks a book read without a date
+UNDATED = object()
+
+# Most books one progress update may mark or unmark
+MAX_PROGRESS_BATCH = 500
+
+
+def reader_gradient(reader_id):
+    return READER_GRADIENTS[(reader_id - 1) % len(READER_GRADIENTS)]
+
+
+def reader_color(reader_id):
+    return READER_COLORS[(reader_id - 1) % len(READER_COLORS)]
+
+
+def get_reader(cursor, username):
+    """Return the readers row for `username`, or None"""
+    cursor.execute(READER_QUERY, ((username or '').lower(),))
+    return cursor.fetchone()
+
+
+def add_reader(cursor, username, name, password_hash):
+    """Create a reader, returns its id (raises sqlite3.IntegrityError if the username is taken)"""
+    cursor.execute('INSERT INTO readers (username, name, password_hash) VALUES (?, ?, ?)',
+                   (username.lower(), name, password_hash))
+    return cursor.lastrowid
+
+
+def sync_founding_readers(conn, config):
+    """Create the founding readers if needed and set their password hashes from `config`.
+
+    A reader without a configured hash keeps the one stored, and only gets the
+    development password (their lowercased name) if there is none yet, so the
+    slow password hashing runs once rather than on every start.
+    """
+    with conn:
+        for username, name, hash_key in FOUNDING_READERS:
+            conn.execute('INSERT OR IGNORE INTO readers (username, name) VALUES (?, ?)', (username, name))
+            if config[hash_key]:
+                conn.execute('UPDATE readers SET password_hash = ? WHERE username = ?',
+                             (config[hash_key], username))
+            elif conn.execute('SELECT password_hash IS NULL FROM readers WHERE username = ?',
+                              (username,)).fetchone()[0]:
+                conn.execute('UPDATE readers SET password_hash = ? WHERE username = ?',
+                             (generate_password_hash(name.lower(), method=config['PASSWORD_HASH_METHOD']), username))
+
+
+def configured_password_hash(config, username):
+    """The password hash `config` sets for a founding reader, or None"""
+    for founding_username, _, hash_key in FOUNDING_READERS:
+        if founding_username == username:
+            return config[hash_key]
+    return None
+
+
+def mark_book_read(cursor, reader_id, book_id):
+    """Record that a reader finished a book, returns False if it was already marked (or no such book)"""
+    cursor.execute(MARK_READ_SQL, (reader_id, None, book_id))
+    if cursor.rowcount:
+        bump_data_version(cursor)
+        return True
+    return False
+
+
+def update_progress(cursor, reader_id, read=(), unread=()):
+    """Mark and unmark books for a reader, in the caller's transaction.
+
+    `read` holds (book_id, read_at) pairs, read_at None meaning now and
+    UNDATED meaning no date, and `unread` holds book ids. Books already in the requested state and ids of
+    books that do not exist are skipped, so repeating an update changes
+    nothing. Returns the ids marked and the (book_id, read_at) pairs
+    unmarked (read_at None for an undated mark), which together are enough
+    to undo the update.
+    """
+    marked = []
+    for book_id, read_at in read:
+        if read_at is UNDATED:
+            cursor.execute(MARK_UNDATED_SQL, (reader_id, book_id))
+        else:
+            cursor.execute(MARK_READ_SQL, (reader_id, read_at, book_id))
+        if cursor.rowcount:
+            marked.append(book_id)
+    unmarked = []
+    for book_id in unread:
+        cursor.execute(UNMARK_READ_SQL, (reader_id, book_id))
+        row = cursor.fetchone()
+        if row is not None:
+            unmarked.append((book_id, row[0]))
+    if marked or unmarked:
+        bump_data_version(cursor)
+    return marked, unmarked
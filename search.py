@@ -0,0 +1,56 @@
+"""Full-text search over books and their reviews.
+
+The ``book_search`` FTS5 table (migration 4) mirrors ``books.title``,
+``books.author`` and the concatenated ``reviews.review`` text of each book,
+kept in sync by triggers. Queries match every word of the search box as a
+prefix and are ranked with bm25, weighting title above author above reviews.
+"""
+import re
+
+from markupsafe import Markup, escape
+
+# Private-use characters mark matches, so text is escaped before <mark> is added
+_MATCH_START = '\ue000'
+_MATCH_END = '\ue001'
+
+MAX_RESULTS = 50
+
+SEARCH_QUERY = f'''
+    SELECT b.id, b.title, b.author, b.year, b.read_count, b.cover_url, b.cover_thumb,
+           highlight(book_search, 0, '{_MATCH_START}', '{_MATCH_END}') AS title_match,
+           highlight(book_search, 1, '{_MATCH_START}', '{_MATCH_END}') AS author_match,
+           snippet(book_search, 2, '{_MATCH_START}', '{_MATCH_END}', '…', 16) AS review_snippet,
+           bm25(book_search, 10.0, 5.0, 1.0) AS rank
+    FROM book_search
+    JOIN books b ON b.id = book_search.rowid
+    WHERE book_search MATCH ?
+    ORDER BY rank
+    LIMIT ?
+'''
+
+
+def build_match(text):
+    """Turn free text into an FTS5 query matching every word as a prefix"""
+    words = re.findall(r'\w+', text or '')
+    return ' '.join(f'"{word}"*' for word in words)
+
+
+def highlight_html(text):
+    """Escape `text` and wrap the marked matches in <mark>"""
+    if not text:
+        return Markup('')
+    escaped = str(escape(text))
+    return Markup(escaped.replace(_MATCH_START, '<mark>').replace(_MATCH_END, '</mark>'))
+
+
+def plain_text(text):
+    return (text or '').replace(_MATCH_START, '').replace(_MATCH_END, '')
+
+
+def search_books(cursor, text, limit=MAX_RESULTS):
+    """Return ranked result rows for the search box text (empty for an empty query)"""
+    match = build_match(text)
+    if not match:
+        return []
+    cursor.execute(SEARCH_QUERY, (match, limit))
+    return cursor.fetchall()
@@ -0,0 +1,315 @@
+"""Pre-rendered copies of the pages anonymous visitors see.
+
+``flask export-static`` renders the homepage (every public filter x century
+x sort combination, plus the pages of cards the grid loads while
+scrolling), every book page, the leaderboard and the about page into
+``STATIC_EXPORT_DIR``, where nginx serves them to visitors without a
+session cookie (see nginx.conf). Pages are rendered through the app itself,
+with a test client that has no session, so a file holds exactly what an
+anonymous request would get. A page's URL maps to a file by
+``export_path()``: ``/book/5`` is ``book/5.html``, and a query string
+becomes a ``__`` suffix (the app sorts query parameters in every link it
+builds, so each page has one URL).
+
+With ``STATIC_EXPORT_DIR`` set the export keeps itself current. Triggers
+record every changed book row in ``static_export_pending`` (migration 9),
+whichever path wrote it. At startup, after any request that wrote to the
+database and after a cover fetch, a background thread re-renders only what those books
+touch:
+
+- their own pages and the leaderboard,
+- the first homepage page of each combination, which carries the stats,
+- each card list from the first page the books are or were on, stopping
+  once a page comes out unchanged and nothing after it can have moved
+  (books leaving or joining a list, or changing their rating, move the
+  cards after them).
+
+Writes that change no book (a new reader, the founding readers' count)
+still bump ``data_version``. The manifest records the version it was
+rendered at, so when the version moved and no book is pending, the export
+re-renders the pages showing shared data: the homepage, the first page of
+each combination and the leaderboard.
+
+If more than ``FULL_EXPORT_SHARE`` of the books changed, it renders
+everything instead. Files are only rewritten when their content changed,
+and each write is atomic. A lock file makes exports run one at a time
+across all workers. Logged-in visitors and all writes still go to the app.
+"""
+import contextlib
+import fcntl
+import html
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+import urllib.parse
+
+from flask import g, url_for
+
+import db
+from queries import BOOKS_PAGE_SIZE, CENTURIES, FILTERS, READER_FILTERS, SORTS, build_books_query
+
+MANIFEST_NAME = '.manifest.json'
+LOCK_NAME = '.lock'
+
+# Above this share of the books changed at once, re-render everything
+FULL_EXPORT_SHARE = 0.25
+
+# Homepage filters that do not depend on who is logged in
+PUBLIC_FILTERS = [filter_by for filter_by in FILTERS if filter_by not in READER_FILTERS]
+
+BOOK_ID_RE = re.compile(r'data-book-id="(\d+)"')
+NEXT_PAGE_RE = re.compile(r'data-next="([^"]+)"')
+
+# (pid, thread, wakeup event) of this process's export thread; workers forked
+# from a preloading master start their own
+_export_thread = None
+_export_thread_lock = threading.Lock()
+
+
+def export_path(url):
+    """File for a page URL, relative to the export directory, as nginx.conf looks it up"""
+    parts = urllib.parse.urlsplit(url)
+    path = parts.path.strip('/') or 'index'
+    return f'{path}__{parts.query}.html' if parts.query else f'{path}.html'
+
+
+class Exporter:
+    """Renders pages into the export directory, rewriting only files whose content changed"""
+
+    def __init__(self, app, out_dir, conn):
+        self.app = app
+        self.out_dir = out_dir
+        self.conn = conn
+        self.client = app.test_client()
+        self.rendered = 0
+        self.written = 0
+
+    def url(self, endpoint, **values):
+        with self.app.test_request_context():
+            return url_for(endpoint, **values)
+
+    def chains(self):
+        """(key, first page URL) of every homepage card list"""
+        return [(f'{filter_by}|{century}|{sort}', self.url('index', filter=filter_by, century=century, sort=sort))
+                for filter_by in PUBLIC_FILTERS for century in CENTURIES for sort in SORTS]
+
+    def render(self, url):
+        response = self.client.get(url)
+        if response.status_code != 200:
+            raise RuntimeError(f'{url} answered {response.status_code}')
+        self.rendered += 1
+        return response.get_data()
+
+    def write(self, url, body):
+        """Store a rendered page, returns False if the file already held exactly this"""
+        path = os.path.join(self.out_dir, export_path(url))
+        try:
+            with open(path, 'rb') as f:
+                if f.read() == body:
+                    return False
+        except FileNotFoundError:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.part')
+        with os.fdopen(fd, 'wb') as tmp:
+            tmp.write(body)
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+        self.written += 1
+        return True
+
+    def export_page(self, url):
+        return self.write(url, self.render(url))
+
+    def delete(self, url):
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(os.path.join(self.out_dir, export_path(url)))
+
+    def walk_chain(self, first_url, old_pages=(), start=0, watch=frozenset(), old_last=-1):
+        """Render a card list from page `start` on, returns its pages as [{'url': ..., 'ids': [...]}].
+
+        The walk stops early at a page that comes out unchanged once every book
+        in `watch` has been seen and the last old page holding one of them
+        (`old_last`) has been passed: from there on the list is as before.
+        """
+        pages = [dict(page) for page in old_pages[:start]]
+        old_positions = {page['url']: index for index, page in enumerate(old_pages)}
+        unseen = set(watch)
+        url = old_pages[start]['url'] if start else first_url
+        index = start
+        while url:
+            body = self.render(url)
+            text = body.decode('utf-8')
+            ids = [int(book_id) for book_id in BOOK_ID_RE.findall(text)]
+            changed = self.write(url, body)
+            pages.append({'url': url, 'ids': ids})
+            unseen.difference_update(ids)
+            if not changed and not unseen and index >= old_last and url in old_positions:
+                pages.extend(old_pages[old_positions[url] + 1:])
+                break
+            next_page = NEXT_PAGE_RE.search(text)
+            url = html.unescape(next_page.group(1)) if next_page else None
+            index += 1
+
+        for page in old_pages:
+            if page['url'] not in {new_page['url'] for new_page in pages}:
+                self.delete(page['url'])
+        return pages
+
+    def export_shared(self):
+        """Render the pages every write can change: the stats on each first page and the leaderboard"""
+        self.export_page('/')
+        self.export_page(self.url('leaderboard'))
+        for _, first_url in self.chains():
+            self.export_page(first_url)
+
+    def export_all(self, old):
+        """Render every page, returns the new manifest"""
+        for url in ('/', self.url('about'), self.url('leaderboard')):
+            self.export_page(url)
+        chains = {key: self.walk_chain(first_url, old['chains'].get(key, ()))
+                  for key, first_url in self.chains()}
+        book_ids = [row[0] for row in self.conn.execute('SELECT id FROM books')]
+        for book_id in book_ids:
+            self.export_page(self.url('book_detail', book_id=book_id))
+        for book_id in set(old['books']) - set(book_ids):
+            self.delete(self.url('book_detail', book_id=book_id))
+        return {'chains': chains, 'books': book_ids}
+
+    def export_changed(self, old, book_ids):
+        """Render what the books in `book_ids` touch, returns the new manifest"""
+        placeholders = ', '.join('?' * len(book_ids))
+        existing = {row[0] for row in self.conn.execute(
+            f'SELECT id FROM books WHERE id IN ({placeholders})', book_ids)}
+
+        for book_id in book_ids:
+            if book_id in existing:
+                self.export_page(self.url('book_detail', book_id=book_id))
+            else:
+                self.delete(self.url('book_detail', book_id=book_id))
+        self.export_page('/')
+        self.export_page(self.url('leaderboard'))
+
+        changed = set(book_ids)
+        chains = {}
+        for key, first_url in self.chains():
+            filter_by, century, sort = key.split('|')
+            old_pages = old['chains'].get(key)
+            if not old_pages:
+                chains[key] = self.walk_chain(first_url)
+                continue
+
+            # Where the changed books are in this list now, and the old pages that held any of them
+            order = self.conn.execute(build_books_query(filter_by, century, columns=('id',), sort=sort))
+            positions = {row[0]: position for position, row in enumerate(order) if row[0] in changed}
+            holding = [index for index, page in enumerate(old_pages) if changed & set(page['ids'])]
+
+            # Pages before the first one a changed book is or was on stay as they are
+            pages_touched = holding + [position // BOOKS_PAGE_SIZE for position in positions.values()]
+            start = min(pages_touched, default=None)
+            if start != 0:
+                # The first page shows the stats, which every change can move
+                self.export_page(first_url)
+            if start is None:
+                chains[key] = old_pages
+                continue
+            chains[key] = self.walk_chain(first_url, old_pages, start=start, watch=positions,
+                                          old_last=max(holding, default=-1))
+
+        books = sorted((set(old['books']) - changed) | existing)
+        return {'chains': chains, 'books': books}
+
+
+@contextlib.contextmanager
+def _export_lock(out_dir):
+    os.makedirs(out_dir, exist_ok=True)
+    with open(os.path.join(out_dir, LOCK_NAME), 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def _load_manifest(out_dir):
+    try:
+        with open(os.path.join(out_dir, MANIFEST_NAME)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _save_manifest(out_dir, manifest):
+    fd, tmp_path = tempfile.mkstemp(dir=out_dir, suffix='.part')
+    with os.fdopen(fd, 'w') as tmp:
+        tmp.write(json.dumps(manifest))  # one call to the C encoder, json.dump streams in Python
+    os.replace(tmp_path, os.path.join(out_dir, MANIFEST_NAME))
+
+
+def export_site(app, out_dir, full=False):
+    """Bring the export in `out_dir` up to date, returns (pages rendered, files written, seconds)"""
+    started = time.perf_counter()
+    with _export_lock(out_dir):
+        conn = db.connect(app.config['DATABASE_PATH'])
+        try:
+            # Taken before rendering: a book changed again meanwhile keeps its row (its seq moved on)
+            pending = conn.execute('SELECT book_id, seq FROM static_export_pending').fetchall()
+            version = db.get_data_version(conn.cursor())
+            old = _load_manifest(out_dir)
+            exporter = Exporter(app, out_dir, conn)
+            book_count = conn.execute('SELECT COUNT(*) FROM books').fetchone()[0]
+            if full or old is None or len(pending) > FULL_EXPORT_SHARE * book_count:
+                manifest = exporter.export_all(old or {'chains': {}, 'books': []})
+                _save_manifest(out_dir, {**manifest, 'data_version': version})
+            elif pending:
+                manifest = exporter.export_changed(old, [book_id for book_id, _ in pending])
+                _save_manifest(out_dir, {**manifest, 'data_version': version})
+            elif old.get('data_version') != version:
+                exporter.export_shared()
+                _save_manifest(out_dir, {**old, 'data_version': version})
+
+            with conn:
+                conn.executemany('DELETE FROM static_export_pending WHERE book_id = ? AND seq = ?', pending)
+        finally:
+            conn.close()
+    return exporter.rendered, exporter.written, time.perf_counter() - started
+
+
+def _run(app, wakeup):
+    while True:
+        wakeup.wait()
+        wakeup.clear()
+        try:
+            rendered, written, seconds = export_site(app, app.config['STATIC_EXPORT_DIR'])
+            print(f"Static export: {written} of {rendered} pages changed in {seconds * 1000:.0f} ms")
+        except Exception as e:
+            print(f"Static export failed: {e}")
+
+
+def schedule(app):
+    """Update the export in this process's background thread (no-op without STATIC_EXPORT_DIR)"""
+    global _export_thread
+    if not app.config['STATIC_EXPORT_DIR']:
+        return
+    with _export_thread_lock:
+        if _export_thread is None or _export_thread[0] != os.getpid() or not _export_thread[1].is_alive():
+            wakeup = threading.Event()
+            thread = threading.Thread(target=_run, args=(app, wakeup), name='static-export', daemon=True)
+            _export_thread = (os.getpid(), thread, wakeup)
+            thread.start()
+    _export_thread[2].set()
+
+
+def init_app(app):
+    """Build every link with sorted query parameters, and re-export after requests that wrote"""
+    # One URL per page, so the file nginx looks for is the one the export wrote
+    app.url_map.sort_parameters = True
+    if not app.config['STATIC_EXPORT_DIR']:
+        return
+
+    @app.teardown_request
+    def export_after_write(exception=None):
+        if exception is None and g.get('data_written'):
+            schedule(app)
@@ -0,0 +1,155 @@
+"""Reading statistics for the homepage header and the leaderboard.
+
+Book counters come from a single aggregate scan over ``books`` (read means
+read by at least one reader). Per-reader counts, review counts and rating
+averages are columns kept up to date by triggers, so only the readers and
+books shown are read, however many members the group has. The homepage
+stats are cached per process and reused until the database's data version
+changes.
+"""
+import threading
+
+from db import get_data_version
+from readers import TOP_READERS_QUERY
+
+STATS_QUERY = '''
+    SELECT
+        COUNT(*),
+        SUM(CASE WHEN read_count > 0 THEN 1 ELSE 0 END),
+        SUM(CASE WHEN year >= 1800 AND year < 1900 THEN 1 ELSE 0 END),
+        SUM(CASE WHEN year >= 1900 AND year < 2000 THEN 1 ELSE 0 END),
+        SUM(CASE WHEN year >= 2000 THEN 1 ELSE 0 END),
+        SUM(review_count),
+        SUM(rating_sum)
+    FROM books
+'''
+READER_COUNT_QUERY = 'SELECT COUNT(*) FROM readers'
+
+LEADERBOARD_SIZE = 25
+# Books need this many ratings to be ranked by their average
+MIN_RATINGS = 2
+
+LEADERBOARD_READERS_QUERY = '''
+    SELECT id, username, name, books_read, review_count, rating_sum FROM readers
+    ORDER BY books_read DESC, name
+    LIMIT ?
+'''
+LEADERBOARD_REVIEWERS_QUERY = '''
+    SELECT id, username, name, books_read, review_count, rating_sum FROM readers
+    WHERE review_count > 0
+    ORDER BY review_count DESC, name
+    LIMIT ?
+'''
+TOP_RATED_QUERY = '''
+    SELECT id, title, author, year, avg_rating, review_count, read_count FROM books
+    WHERE review_count >= ?
+    ORDER BY avg_rating DESC, review_count DESC, order_index
+    LIMIT ?
+'''
+MOST_READ_QUERY = '''
+    SELECT id, title, author, year, avg_rating, review_count, read_count FROM books
+    WHERE read_count > 0
+    ORDER BY read_count DESC, order_index
+    LIMIT ?
+'''
+
+# Readers listed with their progress
+TOP_READERS = 6
+
+_cache = {'version': None, 'stats': None}
+_cache_lock = threading.Lock()
+
+
+def percentage(count, total):
+    return round((count / total * 100), 1) if total > 0 else 0
+
+
+def compute_stats(cursor):
+    cursor.execute(STATS_QUERY)
+    total_books, read_count, books_19th, books_20th, books_21st, review_count, rating_sum = (
+        value or 0 for value in cursor.fetchone()
+    )
+
+    cursor.execute(READER_COUNT_QUERY)
+    reader_count = cursor.fetchone()[0]
+
+    cursor.execute(TOP_READERS_QUERY, (TOP_READERS,))
+    top_readers = [{
+        'id': reader_id,
+        'username': username,
+        'name': name,
+        'read': books_read,
+        'percentage': percentage(books_read, total_books),
+    } for reader_id, username, name, books_read in cursor.fetchall()]
+
+    return {
+        'total': total_books,
+        'read': read_count,
+        'unread': total_books - read_count,
+        'percentage': percentage(read_count, total_books),
+        'readers': reader_count,
+        'top_readers': top_readers,
+        'books_19th': books_19th,
+        'books_20th': books_20th,
+        'books_21st': books_21st,
+        'reviews': review_count,
+        'avg_rating': round(rating_sum / review_count, 1) if review_count else None,
+    }
+
+
+def get_stats(cursor):
+    """Return the stats dict, recomputing only when the data version moved"""
+    version = get_data_version(cursor)
+    with _cache_lock:
+        if _cache['version'] == version:
+            return _cache['stats']
+
+    stats = compute_stats(cursor)
+    with _cache_lock:
+        _cache['version'] = version
+        _cache['stats'] = stats
+    return stats
+
+
+def _reader_entry(row):
+    reader_id, username, name, books_read, review_count, rating_sum = row
+    return {
+        'id': reader_id,
+        'username': username,
+        'name': name,
+        'read': books_read,
+        'reviews': review_count,
+        'avg_rating': round(rating_sum / review_count, 1) if review_count else None,
+    }
+
+
+def _book_entry(row):
+    book_id, title, author, year, avg_rating, review_count, read_count = row
+    return {
+        'id': book_id,
+        'title': title,
+        'author': author,
+        'year': year,
+        'avg_rating': round(avg_rating, 2) if avg_rating is not None else None,
+        'reviews': review_count,
+        'readers': read_count,
+    }
+
+
+def get_leaderboard(cursor, size=LEADERBOARD_SIZE):
+    """Top readers, reviewers and books, each one indexed query over the precomputed counters"""
+    cursor.execute(LEADERBOARD_READERS_QUERY, (size,))
+    readers = [_reader_entry(row) for row in cursor.fetchall()]
+    cursor.execute(LEADERBOARD_REVIEWERS_QUERY, (size,))
+    reviewers = [_reader_entry(row) for row in cursor.fetchall()]
+    cursor.execute(TOP_RATED_QUERY, (MIN_RATINGS, size))
+    top_rated = [_book_entry(row) for row in cursor.fetchall()]
+    cursor.execute(MOST_READ_QUERY, (size,))
+    most_read = [_book_entry(row) for row in cursor.fetchall()]
+    return {
+        'readers': readers,
+        'reviewers': reviewers,
+        'top_rated': top_rated,
+        'most_read': most_read,
+        'min_ratings': MIN_RATINGS,
+    }
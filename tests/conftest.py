@@ -0,0 +1,38 @@
+"""Shared fixtures: the app on a fresh database in a temporary directory, with no background work"""
+import os
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Set before app is imported: config and DATABASE_PATH are read at import time
+_TMP = tempfile.mkdtemp(prefix='reading-challenge-tests-')
+os.environ['DATABASE_PATH'] = os.path.join(_TMP, 'reading_challenge.db')
+os.environ['COVER_CACHE_PATH'] = os.path.join(_TMP, 'cover_cache.db')
+os.environ['BACKUP_DIR'] = os.path.join(_TMP, 'backups')
+os.environ['STATIC_EXPORT_DIR'] = ''
+os.environ['SKIP_INITIALIZE'] = '1'
+
+import app as app_module  # noqa: E402
+
+
+@pytest.fixture(scope='session')
+def app():
+    """The Flask app with its schema created and the books loaded (no cover fetching)"""
+    app_module.init_db()
+    app_module.load_books_from_csv()
+    app_module.app.config['TESTING'] = True
+    return app_module.app
+
+
+@pytest.fixture
+def reader_client(app):
+    """A test client logged in as the founding reader 's'"""
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = 's'
+        session['_fresh'] = True
+    return client
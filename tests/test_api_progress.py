@@ -0,0 +1,30 @@
+"""POST /api/progress: how read_at is parsed and stored"""
+
+
+def mark_and_unmark(client, book_id, read_at):
+    """Mark a book read with read_at, unmark it again, and return the date the undo body puts back"""
+    assert client.post('/api/progress', json={'unread': [book_id]}).status_code == 200
+    response = client.post('/api/progress', json={'read': [{'id': book_id, 'read_at': read_at}]})
+    assert response.status_code == 200, response.get_data(as_text=True)
+    assert response.get_json()['marked'] == [book_id]
+    response = client.post('/api/progress', json={'unread': [book_id]})
+    assert response.status_code == 200, response.get_data(as_text=True)
+    return response.get_json()['undo']['read'][0]['read_at']
+
+
+def test_read_at_offset_is_converted_to_utc(reader_client):
+    assert mark_and_unmark(reader_client, 1, '2025-01-01T10:00:00+05:00') == '2025-01-01 05:00:00'
+
+
+def test_read_at_offset_can_cross_midnight(reader_client):
+    assert mark_and_unmark(reader_client, 2, '2025-01-01T01:30:00+02:00') == '2024-12-31 23:30:00'
+
+
+def test_read_at_without_offset_is_kept(reader_client):
+    assert mark_and_unmark(reader_client, 3, '2025-01-01 10:00:00') == '2025-01-01 10:00:00'
+    assert mark_and_unmark(reader_client, 3, '2025-01-01') == '2025-01-01 00:00:00'
+
+
+def test_read_at_must_be_iso(reader_client):
+    response = reader_client.post('/api/progress', json={'read': [{'id': 4, 'read_at': 'yesterday'}]})
+    assert response.status_code == 400
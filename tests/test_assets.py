@@ -0,0 +1,16 @@
+"""CSS minification for the static bundles"""
+from assets import minify_css
+
+
+def test_whitespace_comments_and_last_semicolons_go():
+    css = '/* layout */\n.card {\n  color: red;\n  margin: 0 auto;\n}\n.a > .b, .c { top: 0; }\n'
+    assert minify_css(css) == '.card{color:red;margin:0 auto}.a>.b,.c{top:0}'
+
+
+def test_license_headers_are_kept():
+    assert minify_css('/*! MIT */\n.a { top: 0; }') == '/*! MIT */ .a{top:0}'
+
+
+def test_quoted_strings_are_kept():
+    css = '.a::after { content: ";}"; font-family: "Open  Sans, x"; }\n.b { content: \'a ;} b\'; }'
+    assert minify_css(css) == '.a::after{content:";}";font-family:"Open  Sans, x"}.b{content:\'a ;} b\'}'
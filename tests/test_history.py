@@ -0,0 +1,20 @@
+"""History pages and the CHALLENGE_DEADLINE setting"""
+import os
+import subprocess
+import sys
+
+from conftest import ROOT
+
+
+def test_malformed_deadline_stops_the_start():
+    env = {**os.environ, 'CHALLENGE_DEADLINE': '2026-13-01'}
+    result = subprocess.run([sys.executable, '-c', 'import app'], cwd=ROOT, env=env,
+                            capture_output=True, text=True)
+    assert result.returncode != 0
+    assert 'CHALLENGE_DEADLINE must be a date (YYYY-MM-DD)' in result.stderr
+
+
+def test_history_pages(app, reader_client):
+    assert reader_client.get('/history').status_code == 200
+    assert reader_client.get('/api/history?period=week').status_code == 200
+    assert reader_client.get('/api/history?start=soon').status_code == 400
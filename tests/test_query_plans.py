@@ -0,0 +1,57 @@
+"""Every route query searches an index instead of reading a whole table (what `flask check-query-plans` runs)"""
+import sqlite3
+
+import pytest
+
+import db
+
+
+@pytest.fixture(scope='module')
+def scratch(tmp_path_factory):
+    """An empty database with the current schema"""
+    conn = db.connect(str(tmp_path_factory.mktemp('plans') / 'plans.db'))
+    db.create_schema(conn)
+    yield conn
+    conn.close()
+
+
+def route_query_params():
+    import app as app_module
+    return [pytest.param(sql, params, id=label) for label, sql, params in app_module.route_queries()
+            if label not in app_module.ALLOWED_SCANS]
+
+
+@pytest.mark.parametrize('sql, params', route_query_params())
+def test_route_query_uses_an_index(scratch, sql, params):
+    assert db.full_table_scans(scratch, sql, params) == []
+
+
+@pytest.fixture
+def table():
+    conn = sqlite3.connect(':memory:')
+    conn.execute('CREATE TABLE t (id INTEGER PRIMARY KEY, a INTEGER, b INTEGER, c TEXT)')
+    conn.execute('CREATE INDEX idx_t_a ON t (a)')
+    yield conn
+    conn.close()
+
+
+def test_scan_without_index_is_flagged(table):
+    assert db.full_table_scans(table, 'SELECT * FROM t WHERE c = ?', ('x',)) == ['SCAN t']
+
+
+def test_search_is_not_flagged(table):
+    assert db.full_table_scans(table, 'SELECT * FROM t WHERE a = ?', (1,)) == []
+
+
+def test_index_order_scan_with_limit_is_not_flagged(table):
+    assert db.full_table_scans(table, 'SELECT * FROM t ORDER BY a LIMIT 10') == []
+
+
+def test_index_order_scan_without_limit_is_flagged(table):
+    assert db.full_table_scans(table, 'SELECT * FROM t ORDER BY a') == ['SCAN t USING INDEX idx_t_a']
+
+
+def test_index_scan_sorted_in_temp_btree_is_flagged(table):
+    # The LIMIT applies after every row was read and sorted
+    scans = db.full_table_scans(table, 'SELECT * FROM t INDEXED BY idx_t_a WHERE b > 0 ORDER BY b LIMIT 10')
+    assert scans == ['SCAN t USING INDEX idx_t_a']